@@ -0,0 +1,102 @@
+import argparse
+import importlib.util
+import random
+import time
+from pathlib import Path
+
+SPLITTER_PATH = Path(__file__).parent / "memcontext" / "multimodal" / "videorag" / "_splitter.py"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="SeparatorSplitter 微基准：在合成的长转写 token 序列上对比旧的逐位置切片实现"
+    )
+    parser.add_argument("--tokens", type=int, default=1_000_000, help="转写 token 数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每个实现重复次数，取最快一次")
+    parser.add_argument("--chunk-size", type=int, default=1200, help="chunk_size")
+    parser.add_argument("--chunk-overlap", type=int, default=100, help="chunk_overlap")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    return parser.parse_args()
+
+
+def load_splitter_cls():
+    # 直接按文件加载，避免导入 videorag 包时加载 torch 等依赖
+    spec = importlib.util.spec_from_file_location("videorag_splitter", SPLITTER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.SeparatorSplitter
+
+
+def legacy_split_tokens_with_separators(splitter, tokens):
+    """The previous implementation: slice and compare every separator at every position."""
+    splits = []
+    current_split = []
+    i = 0
+    while i < len(tokens):
+        separator_found = False
+        for separator in splitter._separators:
+            if tokens[i:i+len(separator)] == separator:
+                if splitter._keep_separator in [True, "end"]:
+                    current_split.extend(separator)
+                if current_split:
+                    splits.append(current_split)
+                    current_split = []
+                if splitter._keep_separator == "start":
+                    current_split.extend(separator)
+                i += len(separator)
+                separator_found = True
+                break
+        if not separator_found:
+            current_split.append(tokens[i])
+            i += 1
+    if current_split:
+        splits.append(current_split)
+    return [s for s in splits if s]
+
+
+def make_transcript(num_tokens, separators, seed):
+    """Random token ids with a separator roughly every 8-40 tokens, like ASR sentences."""
+    rng = random.Random(seed)
+    tokens = []
+    while len(tokens) < num_tokens:
+        tokens.extend(rng.randrange(1000, 100000) for _ in range(rng.randint(8, 40)))
+        tokens.extend(rng.choice(separators))
+    return tokens[:num_tokens]
+
+
+def best_of(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main() -> None:
+    args = parse_args()
+    SeparatorSplitter = load_splitter_cls()
+    # 与 PROMPTS["default_text_separator"] 编码后的形态类似：单 token 标点和多 token 换行组合
+    separators = [[271], [198, 198], [198], [13, 220], [1811], [30], [0], [11, 220], [3922], [220]]
+    tokens = make_transcript(args.tokens, separators, args.seed)
+    for keep_separator in ["end", "start", False]:
+        splitter = SeparatorSplitter(
+            separators=separators,
+            keep_separator=keep_separator,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+        )
+        new_time, new_splits = best_of(lambda: splitter._split_tokens_with_separators(tokens), args.repeat)
+        old_time, old_splits = best_of(lambda: legacy_split_tokens_with_separators(splitter, tokens), args.repeat)
+        assert new_splits == old_splits, f"split results differ for keep_separator={keep_separator}"
+        chunk_time, chunks = best_of(lambda: splitter.split_tokens(tokens), args.repeat)
+        print(
+            f"keep_separator={keep_separator!s:<5} tokens={len(tokens):,} splits={len(new_splits):,} "
+            f"legacy={old_time:.3f}s dispatch={new_time:.3f}s speedup={old_time / new_time:.1f}x "
+            f"split_tokens={chunk_time:.3f}s chunks={len(chunks):,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
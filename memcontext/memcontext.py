@@ -1,5 +1,7 @@
 import os
 import json
+import time
+import threading
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Sequence, Union
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -13,6 +15,7 @@ try:
         generate_id,
         gpt_user_profile_analysis,
         gpt_knowledge_extraction,
+        gpt_generate_multi_summary,
         ensure_directory_exists,
     )
     from . import prompts
@@ -23,7 +26,13 @@ try:
     from .retriever import Retriever
     from .multimodal import ConverterFactory
     from .multimodal.converter import ConversionChunk, ConversionOutput
-    from .multimodal.utils import guess_file_extension, guess_mime_type, compute_file_hash
+    from .multimodal.utils import (
+        guess_file_extension,
+        guess_mime_type,
+        compute_file_hash,
+        remote_call_slot,
+        set_remote_call_limit,
+    )
 except ImportError:
     # 回退到绝对导入（当作为独立模块使用时）
     from utils import (
@@ -32,6 +41,7 @@ except ImportError:
         generate_id,
         gpt_user_profile_analysis,
         gpt_knowledge_extraction,
+        gpt_generate_multi_summary,
         ensure_directory_exists,
     )
     import prompts
@@ -42,13 +52,21 @@ except ImportError:
     from retriever import Retriever
     from multimodal import ConverterFactory
     from multimodal.converter import ConversionChunk, ConversionOutput
-    from multimodal.utils import guess_file_extension, guess_mime_type, compute_file_hash
+    from multimodal.utils import (
+        guess_file_extension,
+        guess_mime_type,
+        compute_file_hash,
+        remote_call_slot,
+        set_remote_call_limit,
+    )
 
 # Heat threshold for triggering profile/knowledge update from mid-term memory
 H_PROFILE_UPDATE_THRESHOLD = 5.0 
 DEFAULT_ASSISTANT_ID = "default_assistant_profile"
 
 class Memcontext:
+    _progress_callback_lock = threading.Lock()
+
     def __init__(self, user_id: str, 
                  openai_api_key: str, 
                  data_storage_path: str,
@@ -183,6 +201,9 @@ class Memcontext:
         )
         
         self.mid_term_heat_threshold = mid_term_heat_threshold
+        # 并行导入多模态文件时，mid_term 写入与文件存储索引更新需要串行化
+        self._mid_term_write_lock = threading.RLock()
+        self._file_storage_lock = threading.Lock()
 
     def _extract_knowledge_from_recent_mid_term(self, pages_to_extract=None):
         """
@@ -436,7 +457,7 @@ class Memcontext:
         if skip_short_term:
             # 直接批量添加到 mid_term，跳过 short_term
             # 这样可以避免频繁的 short_term -> mid_term 转换
-            from .utils import check_conversation_continuity, generate_page_meta_info, gpt_generate_multi_summary
+            from .utils import check_conversation_continuity, generate_page_meta_info
             
             # get_timestamp 和 generate_id 已经在文件顶部导入了，直接使用
             
@@ -480,53 +501,16 @@ class Memcontext:
                 return
             
             # 生成批量摘要
-            input_text_for_summary = "\n".join([
-                f"User: {p.get('user_input','')}\nAssistant: {p.get('agent_response','')}" 
-                for p in pages_to_insert
-            ])
-            
-            print(f"Memorycontext: Generating multi-topic summary for {len(pages_to_insert)} pages...")
-            multi_summary_result = gpt_generate_multi_summary(
-                input_text_for_summary, self.client, model=self.llm_model
-            )
+            combined_summary, combined_keywords = self._summarize_pages_for_mid_term(pages_to_insert)
             
             # 插入到 mid_term
             # 对于批量添加，将所有页面作为一个整体插入到一个 session
-            # 如果 multi_summary 返回多个主题，合并所有主题的摘要和关键词
-            if multi_summary_result and multi_summary_result.get("summaries"):
-                # 合并所有主题的摘要和关键词
-                all_summaries = []
-                all_keywords = set()
-                for summary_item in multi_summary_result["summaries"]:
-                    theme = summary_item.get("theme", "")
-                    content = summary_item.get("content", "")
-                    if theme and content:
-                        all_summaries.append(f"{theme}: {content}")
-                    keywords = summary_item.get("keywords", [])
-                    if isinstance(keywords, list):
-                        all_keywords.update(keywords)
-                    elif isinstance(keywords, str):
-                        all_keywords.update([k.strip() for k in keywords.split(",") if k.strip()])
-                
-                combined_summary = " | ".join(all_summaries) if all_summaries else "Batch of memories from multimodal content ingestion."
-                combined_keywords = list(all_keywords)
-                
-                # 只插入一次，使用合并后的摘要
-                self.mid_term_memory.insert_pages_into_session(
-                    summary_for_new_pages=combined_summary,
-                    keywords_for_new_pages=combined_keywords,
-                    pages_to_insert=pages_to_insert,
-                    similarity_threshold=self.mid_term_similarity_threshold
-                )
-            else:
-                # Fallback
-                fallback_summary = "Batch of memories from multimodal content ingestion."
-                self.mid_term_memory.insert_pages_into_session(
-                    summary_for_new_pages=fallback_summary,
-                    keywords_for_new_pages=[],
-                    pages_to_insert=pages_to_insert,
-                    similarity_threshold=self.mid_term_similarity_threshold
-                )
+            self.mid_term_memory.insert_pages_into_session(
+                summary_for_new_pages=combined_summary,
+                keywords_for_new_pages=combined_keywords,
+                pages_to_insert=pages_to_insert,
+                similarity_threshold=self.mid_term_similarity_threshold
+            )
             
             # 更新页面连接
             for page in pages_to_insert:
@@ -550,6 +534,45 @@ class Memcontext:
                     meta_data=mem.get("meta_data")
                 )
 
+    def _summarize_pages_for_mid_term(self, pages: List[Dict[str, Any]], max_chars_per_page: int = None):
+        """
+        对一组页面做一次 multi-summary 调用，返回 (合并后的摘要, 关键词列表)。
+        如果 multi_summary 返回多个主题，合并所有主题的摘要和关键词。
+        """
+        def _clip(text):
+            text = text or ""
+            return text[:max_chars_per_page] if max_chars_per_page else text
+
+        input_text_for_summary = "\n".join([
+            f"User: {_clip(p.get('user_input',''))}\nAssistant: {_clip(p.get('agent_response',''))}" 
+            for p in pages
+        ])
+        
+        print(f"Memorycontext: Generating multi-topic summary for {len(pages)} pages...")
+        multi_summary_result = gpt_generate_multi_summary(
+            input_text_for_summary, self.client, model=self.llm_model
+        )
+        
+        fallback_summary = "Batch of memories from multimodal content ingestion."
+        if not multi_summary_result or not multi_summary_result.get("summaries"):
+            return fallback_summary, []
+        
+        all_summaries = []
+        all_keywords = set()
+        for summary_item in multi_summary_result["summaries"]:
+            theme = summary_item.get("theme", "")
+            content = summary_item.get("content", "")
+            if theme and content:
+                all_summaries.append(f"{theme}: {content}")
+            keywords = summary_item.get("keywords", [])
+            if isinstance(keywords, list):
+                all_keywords.update(keywords)
+            elif isinstance(keywords, str):
+                all_keywords.update([k.strip() for k in keywords.split(",") if k.strip()])
+        
+        combined_summary = " | ".join(all_summaries) if all_summaries else fallback_summary
+        return combined_summary, list(all_keywords)
+
     def get_response(self, query: str, relationship_with_user="friend", style_hint="", user_conversation_meta_data: dict = None) -> str:
         """
         Generates a response to the user's query, incorporating memory and context.
@@ -902,28 +925,87 @@ class Memcontext:
         agent_response: Optional[str] = None,
         converter_kwargs: Optional[Dict[str, Any]] = None,
         progress_callback=None,
+        stream_batch_size: int = 4,
+        stream_flush_interval: float = 30.0,
+        max_workers: int = 1,
+        max_concurrent_remote_calls: Optional[int] = None,
     ):
         """
         Convert multimodal inputs into textual memories and store them.
+
+        Chunks are consumed from ``converter.convert_stream`` and written to
+        mid-term in batches of ``stream_batch_size`` (or whenever
+        ``stream_flush_interval`` seconds have passed since the last write),
+        so early segments of a long video become searchable before the whole
+        file has been converted.
+
+        When several sources are given, ``max_workers > 1`` ingests them in
+        parallel (hashing, storage copy and conversion run per worker; mid-term
+        writes are serialized). ``max_concurrent_remote_calls`` caps the number
+        of in-flight remote model calls across all workers. With multiple
+        sources, ``progress_callback`` messages are prefixed with the file they
+        belong to.
         """
 
         converter_kwargs = converter_kwargs or {}
         sources = source if isinstance(source, (list, tuple)) else [source]
-        ingestion_results = []
+        if max_concurrent_remote_calls is not None:
+            set_remote_call_limit(max_concurrent_remote_calls)
 
-        for item in sources:
-            result = self._ingest_single_multimodal(
+        def ingest(index, item):
+            return self._ingest_single_multimodal(
                 item,
                 source_type=source_type,
                 converter_type=converter_type,
                 agent_response=agent_response,
-                converter_kwargs=converter_kwargs,
-                progress_callback=progress_callback,
+                # 每个文件使用独立的 kwargs 副本，避免 file_storage_id 等字段在文件之间串用
+                converter_kwargs=dict(converter_kwargs),
+                progress_callback=self._make_file_progress_callback(
+                    progress_callback, index, len(sources), item, source_type
+                ),
+                stream_batch_size=stream_batch_size,
+                stream_flush_interval=stream_flush_interval,
             )
-            ingestion_results.append(result)
+
+        workers = max(1, min(max_workers or 1, len(sources)))
+        if workers == 1:
+            ingestion_results = [ingest(index, item) for index, item in enumerate(sources)]
+        else:
+            print(f"Memorycontext: Ingesting {len(sources)} multimodal sources with {workers} workers")
+            ingestion_results = [None] * len(sources)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(ingest, index, item): index
+                    for index, item in enumerate(sources)
+                }
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        ingestion_results[index] = future.result()
+                    except Exception as e:
+                        print(f"Memorycontext: Failed to ingest source #{index}: {e}")
+                        ingestion_results[index] = {"status": "failed", "error": str(e)}
+            succeeded = sum(1 for r in ingestion_results if r.get("status") == "success")
+            print(f"Memorycontext: Parallel ingestion finished, {succeeded}/{len(sources)} succeeded, "
+                  f"{sum(r.get('chunks_written', 0) for r in ingestion_results)} chunks written")
 
         return ingestion_results[0] if len(ingestion_results) == 1 else ingestion_results
 
+    @staticmethod
+    def _make_file_progress_callback(progress_callback, index: int, total: int, item, source_type: str):
+        """为多文件导入生成按文件区分的进度回调（消息带上文件序号和名称，回调调用串行化）"""
+        if progress_callback is None or total == 1:
+            return progress_callback
+        label = Path(item).name if source_type == "file_path" else f"source_{index}"
+        prefix = f"[{index + 1}/{total} {label}]"
+        lock = Memcontext._progress_callback_lock
+
+        def file_progress_callback(progress: float, message: str) -> None:
+            with lock:
+                progress_callback(progress, f"{prefix} {message}")
+
+        return file_progress_callback
+
     def _ingest_single_multimodal(
         self,
         item: Union[str, Path, bytes],
@@ -933,6 +1015,8 @@ class Memcontext:
         agent_response: Optional[str],
         converter_kwargs: Dict[str, Any],
         progress_callback,
+        stream_batch_size: int = 4,
+        stream_flush_interval: float = 30.0,
     ):
         # 确保 converter_kwargs 是字典
         if converter_kwargs is None:
@@ -995,11 +1079,12 @@ class Memcontext:
                     if not stored_file_id:
                         print(f"FileStorageManager: Uploading video file from {file_path_str}")
                         print(f"FileStorageManager: storage_base_path={self.file_storage_manager.storage_base_path}")
-                        file_record = self.file_storage_manager.upload_file(
-                            file_path=file_path_str,
-                            file_type=FileType.VIDEO,
-                            metadata=base_metadata
-                        )
+                        with self._file_storage_lock:
+                            file_record = self.file_storage_manager.upload_file(
+                                file_path=file_path_str,
+                                file_type=FileType.VIDEO,
+                                metadata=base_metadata
+                            )
                         stored_file_id = file_record.file_id
                         stored_file_path = file_record.stored_path
                         print(f"FileStorageManager: Video uploaded with file_id={stored_file_id}")
@@ -1027,7 +1112,7 @@ class Memcontext:
         file_id = base_metadata.get("source_file_id") or stored_file_id
         cache_file = cache_dir / f"{file_id}.json" if file_id else None
 
-        output = None
+        chunk_stream = None
         if cache_file and cache_file.exists():
             try:
                 with open(cache_file, "r", encoding="utf-8") as f:
@@ -1043,144 +1128,86 @@ class Memcontext:
                             metadata=meta,
                         )
                     )
-                output = ConversionOutput(
-                    status="success",
-                    text="\n\n".join(c.text for c in cached_chunks),
-                    chunks=cached_chunks,
-                    metadata=cached.get("metadata", {}),
-                )
-                output.ensure_chunks()
+                chunk_stream = self._replay_cached_chunks(cached_chunks, cached.get("metadata", {}))
                 print(f"Memorycontext: Video already processed (file_id={file_id}), using cached result. Skipping re-processing.")
                 # 如果缓存存在，直接使用缓存，不重新处理
             except Exception as e:
                 print(f"Memorycontext: Failed to load cache for file_id={file_id}, will re-run conversion. Error: {e}")
-                output = None
+                chunk_stream = None
 
-        if output is None:
+        from_cache = chunk_stream is not None
+        if chunk_stream is None:
             # 确保 converter_kwargs 中包含 file_storage_manager 和 file_storage_id（如果已上传）
             if stored_file_id and self.file_storage_manager:
                 converter_kwargs['file_storage_manager'] = self.file_storage_manager
                 converter_kwargs['file_storage_id'] = stored_file_id
             
-            output = converter.convert(
+            chunk_stream = converter.convert_stream(
                 item,
                 source_type=source_type,
                 **converter_kwargs,
             )
-            output.ensure_chunks()
-            # 写入缓存，便于同一文件再次导入时直接复用
-            if cache_file:
-                try:
-                    cache_payload = {
-                        "metadata": output.metadata,
-                        "chunks": [
-                            {"text": ch.text, "metadata": ch.metadata}
-                            for ch in output.chunks
-                        ],
-                    }
-                    with open(cache_file, "w", encoding="utf-8") as f:
-                        json.dump(cache_payload, f, ensure_ascii=False, indent=2)
-                except Exception as e:
-                    print(f"Memorycontext: Failed to write cache for file_id={file_id}, skip caching. Error: {e}")
 
+        # 流式消费：每凑够 stream_batch_size 个片段（或距上次写入超过 stream_flush_interval 秒）
+        # 就批量写入 mid_term，长视频的前几个片段在整段视频处理完之前就可以被检索到。
+        # 缓存回放或不支持流式输出的转换器会一次性给出全部片段，此时整文件只写入一次。
+        if from_cache or not converter.supports_streaming:
+            stream_batch_size = float("inf")
+            stream_flush_interval = float("inf")
         timestamps = []
-        
-        # 检查是否应该使用简洁格式存储（不显示详细的chunk格式）
-        # 如果 agent_response 是简单的上传消息，使用简洁格式存储chunks
-        simple_upload_messages = ["用户上传了一个视频", "用户上传了一个测试视频", "已上传", "已存储视频文件"]
-        use_simple_format = (
-            agent_response and 
-            any(msg in agent_response for msg in simple_upload_messages)
-        )
-        
-        # 准备所有记忆数据
-        memories_to_add = []
-        
-        # 存储所有chunks，但根据 use_simple_format 决定格式
-        for chunk in output.chunks:
-                # 安全地合并元数据，确保所有值都是字典
-                try:
-                    base_meta = base_metadata if isinstance(base_metadata, dict) else {}
-                    output_meta = output.metadata if isinstance(output.metadata, dict) else {}
-                    chunk_meta_dict = chunk.metadata if isinstance(chunk.metadata, dict) else {}
-                    
-                    chunk_meta = {
-                        **base_meta,
-                        **output_meta,
-                        **chunk_meta_dict,
-                        "source_type": "multimodal",
-                    }
-                except (TypeError, AttributeError) as e:
-                    print(f"Memorycontext: Error merging metadata: {e}")
-                    chunk_meta = {"source_type": "multimodal"}
-                
-                # 构建 user_input 和 agent_response
-                # 前端展示：片段内容和音频信息
-                # metadata 中存储：其他所有信息（包括视频ID）
-                
-                # 1. 构建 user_input（简洁格式，用于前端展示，不显示视频ID）
-                try:
-                    time_range = chunk_meta.get("time_range", "")
-                    
-                    if time_range:
-                        # 简洁格式：只显示时间范围，不显示视频ID
-                        user_input = f"视频片段 {time_range}"
-                    else:
-                        user_input = "用户上传了一个视频"
-                except Exception as e:
-                    print(f"Memorycontext: Error building user_input: {e}")
-                    user_input = "用户上传了一个视频"
-                
-                # 2. 构建 agent_response（包含片段内容和音频信息，用于前端展示）
-                response_parts = []
-                
-                # 添加视频片段内容
-                if chunk.text:
-                    response_parts.append(f"【视频内容】\n{chunk.text}")
-                
-                # 添加音频信息
-                audio_transcription = chunk_meta.get("audio_transcription")
-                has_audio = chunk_meta.get("has_audio", False)
-                
-                if audio_transcription:
-                    response_parts.append(f"【音频转录】\n{audio_transcription}")
-                elif has_audio:
-                    response_parts.append("【音频】\n本片段包含音频，但未进行转录")
-                else:
-                    response_parts.append("【音频】\n本片段无音频")
-                
-                # 组合 agent_response
-                if response_parts:
-                    chunk_agent_response = "\n\n".join(response_parts)
-                else:
-                    chunk_agent_response = agent_response or "已上传"
-                
-                memories_to_add.append({
-                    "user_input": user_input,
-                    "agent_response": chunk_agent_response,
-                    "timestamp": get_timestamp(),
-                    "meta_data": chunk_meta,
-                })
-                timestamps.append(get_timestamp())
-        
-        # 使用正常流程：逐个添加到 short_term，超出容量后自动转到 mid_term
-        # 这样更简单，也更符合原来的设计逻辑
-        for mem in memories_to_add:
-            self.add_memory(
-                user_input=mem["user_input"],
-                agent_response=mem["agent_response"],
-                timestamp=mem["timestamp"],
-                meta_data=mem["meta_data"]
-            )
+        pending_memories = []
+        cache_chunks = []
+        chunks_written = 0
+        ingest_state = {}
+        last_flush = time.time()
+        while True:
+            try:
+                chunk = next(chunk_stream)
+            except StopIteration as stop:
+                output = stop.value or ConversionOutput(status="success" if cache_chunks else "failed")
+                break
+
+            cache_chunks.append({"text": chunk.text, "metadata": chunk.metadata})
+            memory = self._build_multimodal_memory(chunk, base_metadata, agent_response)
+            pending_memories.append(memory)
+            timestamps.append(memory["timestamp"])
+
+            if (
+                len(pending_memories) >= max(1, stream_batch_size)
+                or time.time() - last_flush >= stream_flush_interval
+            ):
+                chunks_written += self._flush_multimodal_memories(pending_memories, ingest_state)
+                pending_memories = []
+                last_flush = time.time()
+
+        if pending_memories:
+            chunks_written += self._flush_multimodal_memories(pending_memories, ingest_state)
+        if chunks_written:
+            # 整个文件写完后只做一次 heat 检查
+            with self._mid_term_write_lock:
+                self._trigger_profile_and_knowledge_update_if_needed()
+
+        # 写入缓存，便于同一文件再次导入时直接复用（只缓存完整成功的转换结果）
+        if cache_file and not from_cache and output.status == "success" and cache_chunks:
+            try:
+                cache_payload = {
+                    "metadata": output.metadata,
+                    "chunks": cache_chunks,
+                }
+                with open(cache_file, "w", encoding="utf-8") as f:
+                    json.dump(cache_payload, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"Memorycontext: Failed to write cache for file_id={file_id}, skip caching. Error: {e}")
 
         # 返回结果：优先返回 file_storage_id（如果存在），否则返回 source_file_id
         result_file_id = stored_file_id if stored_file_id else (base_metadata.get("file_storage_id") or base_metadata.get("source_file_id"))
         result = {
             "status": output.status,
             "file_id": result_file_id,
-            "chunks_written": len(output.chunks),
+            "chunks_written": chunks_written,
             "error": output.error,
             "timestamps": timestamps,
+            "session_id": ingest_state.get("session_id"),
         }
         # 如果有 file_storage_manager，添加存储路径信息
         if stored_file_id and self.file_storage_manager:
@@ -1199,6 +1226,134 @@ class Memcontext:
                 print(f"Warning: FileStorageManager says file stored at {stored_file_path}, but file does not exist!")
         return result
 
+    @staticmethod
+    def _replay_cached_chunks(chunks: List[ConversionChunk], metadata: Dict[str, Any]):
+        """把缓存中的 chunks 包装成与 convert_stream 相同的生成器接口"""
+        for chunk in chunks:
+            chunk.metadata = {**(metadata or {}), **(chunk.metadata or {})}
+            yield chunk
+        return ConversionOutput(status="success", metadata=metadata)
+
+    def _build_multimodal_memory(
+        self,
+        chunk: ConversionChunk,
+        base_metadata: Dict[str, Any],
+        agent_response: Optional[str],
+    ) -> Dict[str, Any]:
+        """把单个 ConversionChunk 转换成一条记忆（user_input / agent_response / meta_data）"""
+        # 安全地合并元数据，确保所有值都是字典
+        try:
+            base_meta = base_metadata if isinstance(base_metadata, dict) else {}
+            chunk_meta_dict = chunk.metadata if isinstance(chunk.metadata, dict) else {}
+            
+            chunk_meta = {
+                **base_meta,
+                **chunk_meta_dict,
+                "source_type": "multimodal",
+            }
+        except (TypeError, AttributeError) as e:
+            print(f"Memorycontext: Error merging metadata: {e}")
+            chunk_meta = {"source_type": "multimodal"}
+        
+        # 构建 user_input 和 agent_response
+        # 前端展示：片段内容和音频信息
+        # metadata 中存储：其他所有信息（包括视频ID）
+        
+        # 1. 构建 user_input（简洁格式，用于前端展示，不显示视频ID）
+        try:
+            time_range = chunk_meta.get("time_range", "")
+            
+            if time_range:
+                # 简洁格式：只显示时间范围，不显示视频ID
+                user_input = f"视频片段 {time_range}"
+            else:
+                user_input = "用户上传了一个视频"
+        except Exception as e:
+            print(f"Memorycontext: Error building user_input: {e}")
+            user_input = "用户上传了一个视频"
+        
+        # 2. 构建 agent_response（包含片段内容和音频信息，用于前端展示）
+        response_parts = []
+        
+        # 添加视频片段内容
+        if chunk.text:
+            response_parts.append(f"【视频内容】\n{chunk.text}")
+        
+        # 添加音频信息
+        audio_transcription = chunk_meta.get("audio_transcription")
+        has_audio = chunk_meta.get("has_audio", False)
+        
+        if audio_transcription:
+            response_parts.append(f"【音频转录】\n{audio_transcription}")
+        elif has_audio:
+            response_parts.append("【音频】\n本片段包含音频，但未进行转录")
+        else:
+            response_parts.append("【音频】\n本片段无音频")
+        
+        # 组合 agent_response
+        if response_parts:
+            chunk_agent_response = "\n\n".join(response_parts)
+        else:
+            chunk_agent_response = agent_response or "已上传"
+        
+        return {
+            "user_input": user_input,
+            "agent_response": chunk_agent_response,
+            "timestamp": get_timestamp(),
+            "meta_data": chunk_meta,
+        }
+
+    def _flush_multimodal_memories(self, memories: List[Dict[str, Any]], ingest_state: Dict[str, Any]) -> int:
+        """
+        多模态批量写入路径：绕过 short_term，直接写入 mid_term，返回写入条数。
+        - 同一文件只调用一次 multi-summary（第一次写入时生成，保存在 ingest_state 中）
+        - 本批页面的 embedding 一次性批量计算
+        - 后续批次追加到同一个 session，并与上一批的最后一页保持 pre_page/next_page 链接
+        - 每批只持久化一次 mid_term.json
+        """
+        if not memories:
+            return 0
+        
+        pages_to_insert = []
+        for mem in memories:
+            pages_to_insert.append({
+                "page_id": generate_id("page"),
+                "user_input": mem.get("user_input", ""),
+                "agent_response": mem.get("agent_response", ""),
+                "timestamp": mem.get("timestamp") or get_timestamp(),
+                "meta_data": mem.get("meta_data") or {},
+                "preloaded": False,
+                "analyzed": False,
+                "pre_page": None,
+                "next_page": None,
+                "meta_info": None,
+            })
+        
+        if ingest_state.get("summary") is None:
+            with remote_call_slot():
+                summary, keywords = self._summarize_pages_for_mid_term(pages_to_insert, max_chars_per_page=500)
+            ingest_state["summary"] = summary
+            ingest_state["keywords"] = keywords
+        # 同一文件的片段天然连续，用文件级摘要作为对话链概览，省去逐页的 meta_info LLM 调用
+        for page in pages_to_insert:
+            page["meta_info"] = ingest_state["summary"]
+        
+        # embedding 在锁外批量计算；session 合并和持久化在锁内完成，保证并行导入时 mid_term 状态一致
+        self.mid_term_memory.embed_pages(pages_to_insert)
+        with self._mid_term_write_lock:
+            session_id = self.mid_term_memory.insert_pages_bulk(
+                summary_for_new_pages=ingest_state["summary"],
+                keywords_for_new_pages=ingest_state["keywords"],
+                pages_to_insert=pages_to_insert,
+                similarity_threshold=self.mid_term_similarity_threshold,
+                target_session_id=ingest_state.get("session_id"),
+                previous_page_id=ingest_state.get("last_page_id"),
+            )
+        ingest_state["session_id"] = session_id
+        ingest_state["last_page_id"] = pages_to_insert[-1]["page_id"]
+        print(f"Memorycontext: Bulk wrote {len(pages_to_insert)} multimodal pages to mid-term session {session_id}.")
+        return len(pages_to_insert)
+
     def _build_multimodal_metadata(
         self,
         source: Union[str, Path, bytes],
@@ -6,7 +6,7 @@ import heapq
 from datetime import datetime
 
 from .utils import (
-    get_timestamp, generate_id, get_embedding, normalize_vector,
+    get_timestamp, generate_id, get_embedding, get_embeddings, normalize_vector,
     compute_time_decay, ensure_directory_exists, OpenAIClient
 )
 
@@ -60,7 +60,7 @@ class MidTermMemory:
                 next_page["pre_page"] = prev_page_id
         # self.save() # Avoid saving on every minor update; save at higher level operations
 
-    def evict_lfu(self):
+    def evict_lfu(self, persist=True):
         if not self.access_frequency or not self.sessions:
             return
         
@@ -89,10 +89,11 @@ class MidTermMemory:
             # For now, assuming internal consistency or that Memcontext class manages higher-level links
 
         self.rebuild_heap()
-        self.save()
+        if persist:
+            self.save()
         print(f"MidTermMemory: Evicted session {lfu_sid}.")
 
-    def add_session(self, summary, details, summary_keywords=None):
+    def add_session(self, summary, details, summary_keywords=None, persist=True):
         session_id = generate_id("session")
         summary_vec = get_embedding(
             summary, 
@@ -166,8 +167,9 @@ class MidTermMemory:
         
         print(f"MidTermMemory: Added new session {session_id}. Initial heat: {session_obj['H_segment']:.2f}.")
         if len(self.sessions) > self.max_capacity:
-            self.evict_lfu()
-        self.save()
+            self.evict_lfu(persist=persist)
+        if persist:
+            self.save()
         return session_id
 
     def rebuild_heap(self):
@@ -180,10 +182,10 @@ class MidTermMemory:
         # No save here, it's an internal operation often followed by other ops that save
 
     def insert_pages_into_session(self, summary_for_new_pages, keywords_for_new_pages, pages_to_insert, 
-                                  similarity_threshold=0.6, keyword_similarity_alpha=1.0):
+                                  similarity_threshold=0.6, keyword_similarity_alpha=1.0, persist=True):
         if not self.sessions: # If no existing sessions, just add as a new one
             print("MidTermMemory: No existing sessions. Adding new session directly.")
-            return self.add_session(summary_for_new_pages, pages_to_insert, keywords_for_new_pages)
+            return self.add_session(summary_for_new_pages, pages_to_insert, keywords_for_new_pages, persist=persist)
 
         new_summary_vec = get_embedding(
             summary_for_new_pages,
@@ -264,11 +266,84 @@ class MidTermMemory:
             target_session["last_visit_time"] = get_timestamp() # Update last visit time on modification
             target_session["H_segment"] = compute_segment_heat(target_session)
             self.rebuild_heap() # Rebuild heap as heat has changed
-            self.save()
+            if persist:
+                self.save()
             return best_sid
         else:
             print(f"MidTermMemory: No suitable session to merge (best score {best_overall_score:.2f} < threshold {similarity_threshold}). Creating new session.")
-            return self.add_session(summary_for_new_pages, pages_to_insert, keywords_for_new_pages)
+            return self.add_session(summary_for_new_pages, pages_to_insert, keywords_for_new_pages, persist=persist)
+
+    def embed_pages(self, pages):
+        """为缺少 page_embedding 的页面一次性批量计算（已归一化的）embedding，不修改 session 状态"""
+        pages_missing_embedding = [p for p in pages if not p.get("page_embedding")]
+        if not pages_missing_embedding:
+            return
+        print(f"MidTermMemory: Computing {len(pages_missing_embedding)} page embeddings in one batch")
+        texts = [
+            f"User: {p.get('user_input','')} Assistant: {p.get('agent_response','')}"
+            for p in pages_missing_embedding
+        ]
+        vectors = get_embeddings(
+            texts,
+            model_name=self.embedding_model_name,
+            **self.embedding_model_kwargs
+        )
+        for page_data, vec in zip(pages_missing_embedding, vectors):
+            page_data["page_embedding"] = normalize_vector(vec).tolist()
+
+    def insert_pages_bulk(self, summary_for_new_pages, keywords_for_new_pages, pages_to_insert,
+                          similarity_threshold=0.6, target_session_id=None, previous_page_id=None,
+                          persist=True):
+        """
+        批量写入一组有序页面（例如同一个视频文件的所有片段）。
+        - 所有缺少 embedding 的页面一次性批量计算
+        - 页面按输入顺序串成 pre_page/next_page 链，previous_page_id 用于接上之前已写入的页面
+        - target_session_id 存在时直接追加到该 session，否则按摘要相似度合并或新建 session
+        返回页面所在的 session_id。
+        """
+        if not pages_to_insert:
+            return target_session_id
+
+        self.embed_pages(pages_to_insert)
+
+        prev_id = previous_page_id
+        for page_data in pages_to_insert:
+            page_data.setdefault("page_id", generate_id("page"))
+            page_data["pre_page"] = prev_id
+            page_data["next_page"] = None
+            prev_id = page_data["page_id"]
+        for current, following in zip(pages_to_insert, pages_to_insert[1:]):
+            current["next_page"] = following["page_id"]
+
+        if target_session_id and target_session_id in self.sessions:
+            target_session = self.sessions[target_session_id]
+            for page_data in pages_to_insert:
+                target_session["details"].append({
+                    **page_data,
+                    "page_keywords": page_data.get("page_keywords") or keywords_for_new_pages,
+                })
+            target_session["L_interaction"] += len(pages_to_insert)
+            target_session["last_visit_time"] = get_timestamp()
+            target_session["H_segment"] = compute_segment_heat(target_session)
+            self.rebuild_heap()
+            session_id = target_session_id
+        else:
+            session_id = self.insert_pages_into_session(
+                summary_for_new_pages,
+                keywords_for_new_pages,
+                pages_to_insert,
+                similarity_threshold=similarity_threshold,
+                persist=False,
+            )
+
+        if previous_page_id:
+            prev_page = self.get_page_by_id(previous_page_id)
+            if prev_page:
+                prev_page["next_page"] = pages_to_insert[0]["page_id"]
+
+        if persist:
+            self.save()
+        return session_id
 
     def search_sessions(self, query_text, segment_similarity_threshold=0.1, page_similarity_threshold=0.1, 
                           top_k_sessions=5, keyword_alpha=1.0, recency_tau_search=3600):
@@ -5,6 +5,7 @@ from .converter import (
     ConversionChunk,
     ConversionOutput,
     ProgressCallback,
+    ChunkStream,
 )
 from .factory import ConverterFactory
 
@@ -28,6 +29,7 @@ __all__ = [
     "ConversionChunk",
     "ConversionOutput",
     "ProgressCallback",
+    "ChunkStream",
     "ConverterFactory",
 ]
 
@@ -6,10 +6,13 @@ import math
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from typing import Any, Callable, ContextManager, Dict, Generator, Iterable, List, Optional, Union
+
+from .utils import remote_call_slot
 
 TextSource = Union[str, bytes, Path]
 ProgressCallback = Callable[[float, str], None]
+ChunkStream = Generator["ConversionChunk", None, "ConversionOutput"]
 
 
 @dataclass
@@ -39,6 +42,19 @@ class ConversionOutput:
             ConversionChunk(text=self.text, chunk_index=0, metadata=self.metadata.copy())
         ]
 
+    @classmethod
+    def from_stream(cls, stream: ChunkStream) -> "ConversionOutput":
+        """Drain a chunk stream and return its final output with all chunks attached."""
+        chunks: List[ConversionChunk] = []
+        while True:
+            try:
+                chunks.append(next(stream))
+            except StopIteration as stop:
+                output = stop.value or cls(status="success" if chunks else "failed")
+                break
+        output.chunks = chunks
+        return output
+
 
 class MultimodalConverter(ABC):
     """Base class for all multimodal converters."""
@@ -68,6 +84,34 @@ class MultimodalConverter(ABC):
     ) -> ConversionOutput:
         """Convert the source into text segments."""
 
+    @property
+    def supports_streaming(self) -> bool:
+        """True if the converter overrides ``convert_stream`` with real incremental output."""
+        return type(self).convert_stream is not MultimodalConverter.convert_stream
+
+    def convert_stream(
+        self,
+        source: TextSource,
+        *,
+        source_type: str = "file_path",
+        **kwargs: Any,
+    ) -> ChunkStream:
+        """Yield chunks as soon as they are produced.
+
+        The generator's return value is the final ``ConversionOutput`` (status,
+        metadata, error); its ``chunks`` may be empty since they were already
+        yielded. Converters that can produce partial results (e.g. per video
+        segment) should override this and put converter-level fields into each
+        chunk's metadata. The default falls back to ``convert`` and replays the
+        chunks once conversion has finished, with the output metadata merged in.
+        """
+        output = self.convert(source, source_type=source_type, **kwargs)
+        output.ensure_chunks()
+        for chunk in output.chunks:
+            chunk.metadata = {**output.metadata, **chunk.metadata}
+            yield chunk
+        return output
+
     @abstractmethod
     def supports(self, *, file_type: str, mime_type: Optional[str] = None) -> bool:
         """Return True if this converter can handle the given file type/mime."""
@@ -103,6 +147,10 @@ class MultimodalConverter(ABC):
             )
         return chunks
 
+    def _remote_call_slot(self) -> ContextManager[None]:
+        """Wrap calls to remote models so they respect the global concurrency cap."""
+        return remote_call_slot()
+
     def _report_progress(self, progress: float, message: str) -> None:
         if self.progress_callback:
             clamped = max(0.0, min(1.0, progress))
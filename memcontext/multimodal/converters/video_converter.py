@@ -16,8 +16,10 @@ try:
     from volcenginesdkarkruntime import Ark
 except ImportError:
     Ark = None
-from ..converter import ConversionChunk, ConversionOutput, MultimodalConverter
+from ..converter import ChunkStream, ConversionChunk, ConversionOutput, MultimodalConverter
 from ..factory import ConverterFactory
+from ..frame_hash import hash_distance, segment_frame_hashes
+from ..segmentation import SegmentPlan, adaptive_segments, fixed_segments
 def load_env_file(env_path: Optional[Path] = None) -> None:
     """
     加载 .env 文件到环境变量
@@ -116,6 +118,22 @@ class VideoConverter(MultimodalConverter):
         self.siliconflow_api_url = os.environ.get("SILICONFLOW_API_URL", "https://api.siliconflow.cn/v1/audio/transcriptions")
         self.siliconflow_model = os.environ.get("SILICONFLOW_MODEL", "TeleAI/TeleSpeechASR")
         
+        # 切分策略：fixed（默认）按固定 60 秒切分，scene 按镜头切换自适应切分（限制在最短/最长时长内，需显式开启）
+        self.segmentation = str(config.get("segmentation") or os.environ.get("VIDEO_SEGMENTATION", "fixed")).lower()
+        self.scene_detection_method = config.get("scene_detection_method") or os.environ.get("VIDEO_SCENE_DETECTION_METHOD", "ffmpeg")
+        self.min_segment_duration = float(config.get("min_segment_duration", 10))
+        self.max_segment_duration = float(config.get("max_segment_duration", 60))
+        self.scene_threshold = float(config.get("scene_threshold", 0.3))
+        # 连续静态片段合并后的最长时长，默认不超过 max_segment_duration（片段需整体上传）；调大才会合并出更长的片段
+        max_static = config.get("max_static_segment_duration")
+        self.max_static_segment_duration = float(max_static) if max_static is not None else self.max_segment_duration
+        # 静态片段（无画面变化且无音频内容）是否直接跳过，不调用视觉模型
+        self.skip_static_segments = bool(config.get("skip_static_segments", False))
+        # 近似重复片段检测（需显式开启）：与上一个实际分析过的片段感知哈希距离低于阈值时，复用其描述（平移时间戳）
+        self.dedup_segments = bool(config.get("dedup_segments", False))
+        self.dedup_hash_threshold = float(config.get("dedup_hash_threshold", 0.08))
+        self.dedup_sample_frames = int(config.get("dedup_sample_frames", 4))
+        
         # 输出音频转录配置状态
         if self.enable_audio_transcription:
             if not self.siliconflow_api_key:
@@ -123,9 +141,40 @@ class VideoConverter(MultimodalConverter):
         else:
             self._report_progress(0.0, "音频转录功能未启用（设置 ENABLE_AUDIO_TRANSCRIPTION=true 启用）")
 
-    def _split_video_by_time(self, video_path: str, segment_duration: int = 60) -> List[Tuple[str, float, float]]:
+    def _plan_video_segments(self, video_path: str, video_duration: float) -> List[SegmentPlan]:
+        """
+        规划视频切分边界：
+        - scene 模式：用 ffmpeg 场景分数 / 直方图差异在镜头切换处切分，
+          片段时长限制在 [min_segment_duration, max_segment_duration]，连续静态片段会被合并
+          （合并后不超过 max_static_segment_duration，默认等于 max_segment_duration）
+        - fixed 模式或场景检测失败时：按 max_segment_duration 固定切分
+        """
+        if self.segmentation == "scene":
+            try:
+                plans = adaptive_segments(
+                    video_path,
+                    video_duration,
+                    method=self.scene_detection_method,
+                    min_duration=self.min_segment_duration,
+                    max_duration=self.max_segment_duration,
+                    scene_threshold=self.scene_threshold,
+                    max_static_duration=self.max_static_segment_duration,
+                )
+                if plans:
+                    return plans
+            except Exception as e:
+                self._report_progress(0.1, f"⚠️  场景检测失败，回退到固定时长切分: {str(e)[:100]}")
+        return fixed_segments(video_duration, self.max_segment_duration)
+
+    def _split_video_by_time(
+        self,
+        video_path: str,
+        segment_duration: int = 60,
+        time_ranges: Optional[List[Tuple[float, float]]] = None,
+    ) -> List[Tuple[str, float, float]]:
         """
         使用 ffmpeg 将视频按时间切分成多个片段（每个片段 segment_duration 秒）
+        如果提供 time_ranges，则按给定的 [(开始时间, 结束时间), ...] 切分
         返回: [(片段路径, 开始时间, 结束时间), ...]
         """
         if not shutil.which("ffmpeg"):
@@ -140,20 +189,13 @@ class VideoConverter(MultimodalConverter):
         temp_dir = tempfile.mkdtemp(prefix="video_chunks_")
         segments = []
         
+        if time_ranges is None:
+            time_ranges = [(p.start, p.end) for p in fixed_segments(video_duration, segment_duration)]
+        
         try:
             segment_index = 0
-            start_time = 0.0
             
-            while start_time < video_duration:
-                # 计算结束时间：如果剩余时长不足1分钟，就按实际剩余时长切分
-                remaining_duration = video_duration - start_time
-                if remaining_duration <= segment_duration:
-                    # 最后一段不足1分钟，按实际剩余时长切分
-                    end_time = video_duration
-                else:
-                    # 正常1分钟切分
-                    end_time = start_time + segment_duration
-                
+            for start_time, end_time in time_ranges:
                 # 确保不会产生空片段
                 if end_time <= start_time:
                     break
@@ -196,11 +238,6 @@ class VideoConverter(MultimodalConverter):
                     segment_index += 1
                 else:
                     break
-                
-                # 移动到下一段，如果已经到达视频末尾则退出
-                start_time = end_time
-                if start_time >= video_duration:
-                    break
             
             return segments
         except Exception as e:
@@ -349,7 +386,13 @@ class VideoConverter(MultimodalConverter):
         except Exception:
             return False
     
-    def _split_audio_by_time(self, audio_path: str, segment_duration: int = 60, output_dir: str = None) -> List[Tuple[str, float, float]]:
+    def _split_audio_by_time(
+        self,
+        audio_path: str,
+        segment_duration: int = 60,
+        output_dir: str = None,
+        time_ranges: Optional[List[Tuple[float, float]]] = None,
+    ) -> List[Tuple[str, float, float]]:
         """
         将音频文件按时间切分成多个片段
         
@@ -357,6 +400,7 @@ class VideoConverter(MultimodalConverter):
             audio_path: 音频文件路径
             segment_duration: 每个片段的时长（秒），默认60秒
             output_dir: 输出目录，如果为None则使用临时目录
+            time_ranges: 可选，按给定的 [(开始时间, 结束时间), ...] 切分（与视频片段对齐）
         
         Returns:
             list: [(片段路径, 开始时间, 结束时间), ...]
@@ -378,11 +422,17 @@ class VideoConverter(MultimodalConverter):
         audio_name = Path(audio_path).stem
         audio_ext = Path(audio_path).suffix
         
+        if time_ranges is None:
+            time_ranges = [(p.start, p.end) for p in fixed_segments(total_duration, segment_duration)]
+        
         segment_index = 0
-        start_time = 0.0
         
-        while start_time < total_duration:
-            end_time = min(start_time + segment_duration, total_duration)
+        for start_time, end_time in time_ranges:
+            end_time = min(end_time, total_duration)
+            if end_time <= start_time:
+                # 音频比视频短时，保持与视频片段的索引对齐
+                segments.append((None, start_time, end_time))
+                continue
             segment_path = os.path.join(output_dir, f"{audio_name}_segment_{segment_index:04d}{audio_ext}")
             
             # 使用ffmpeg切分音频
@@ -418,8 +468,8 @@ class VideoConverter(MultimodalConverter):
                 if result.returncode == 0 and os.path.exists(segment_path) and os.path.getsize(segment_path) > 0:
                     segments.append((segment_path, start_time, end_time))
                     segment_index += 1
-            
-            start_time = end_time
+                else:
+                    segments.append((None, start_time, end_time))
         
         return segments
     
@@ -442,7 +492,8 @@ class VideoConverter(MultimodalConverter):
                     "Authorization": f"Bearer {self.siliconflow_api_key}"
                 }
                 
-                response = requests.post(self.siliconflow_api_url, data=payload, files=files, headers=headers, timeout=120)
+                with self._remote_call_slot():
+                    response = requests.post(self.siliconflow_api_url, data=payload, files=files, headers=headers, timeout=120)
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -469,13 +520,19 @@ class VideoConverter(MultimodalConverter):
             self._report_progress(0.0, f"⚠️  音频转录出错: {str(e)[:100]}")
             return None
     
-    def _transcribe_audio_segments_list(self, audio_path: str, segment_start_time: float = 0.0) -> List[str]:
+    def _transcribe_audio_segments_list(
+        self,
+        audio_path: str,
+        segment_start_time: float = 0.0,
+        time_ranges: Optional[List[Tuple[float, float]]] = None,
+    ) -> List[str]:
         """
-        将音频文件按1分钟切分并转录，返回文本列表
+        将音频文件按1分钟（或按 time_ranges 与视频片段对齐）切分并转录，返回文本列表
         
         Args:
             audio_path: 音频文件路径
             segment_start_time: 音频在整个视频中的开始时间偏移
+            time_ranges: 可选，与视频片段一致的切分区间
         
         Returns:
             List[str]: 每个片段的转录文本列表
@@ -488,7 +545,7 @@ class VideoConverter(MultimodalConverter):
         
         try:
             # 切分音频（每60秒一个片段）
-            segments = self._split_audio_by_time(audio_path, segment_duration=60)
+            segments = self._split_audio_by_time(audio_path, segment_duration=60, time_ranges=time_ranges)
             
             transcription_list = []
             
@@ -502,8 +559,8 @@ class VideoConverter(MultimodalConverter):
                     f"正在转录音频片段 {i+1}/{len(segments)} [{adjusted_start:.1f}s - {adjusted_end:.1f}s]..."
                 )
                 
-                # 转录片段
-                text = self._transcribe_audio_segment_with_siliconflow(segment_path, adjusted_start)
+                # 转录片段（切分失败的区间保留空文本以保持索引对齐）
+                text = self._transcribe_audio_segment_with_siliconflow(segment_path, adjusted_start) if segment_path else None
                 
                 if text:
                     transcription_list.append(text)
@@ -514,12 +571,14 @@ class VideoConverter(MultimodalConverter):
                 
                 # 清理临时片段文件
                 try:
-                    os.remove(segment_path)
+                    if segment_path:
+                        os.remove(segment_path)
                 except Exception:
                     pass
             
             # 清理临时目录
-            temp_dir = os.path.dirname(segments[0][0]) if segments else None
+            first_path = next((seg[0] for seg in segments if seg[0]), None)
+            temp_dir = os.path.dirname(first_path) if first_path else None
             if temp_dir and os.path.exists(temp_dir) and temp_dir.startswith(tempfile.gettempdir()):
                 try:
                     shutil.rmtree(temp_dir, ignore_errors=True)
@@ -580,6 +639,20 @@ class VideoConverter(MultimodalConverter):
         
         return '\n'.join(filtered_lines)
 
+    def _segment_hashes(self, segment_path: str, segment_duration: float) -> List[int]:
+        """计算片段采样帧的感知哈希；未开启去重或抽帧失败时返回空列表（即总是调用模型）"""
+        if not self.dedup_segments:
+            return []
+        try:
+            return segment_frame_hashes(
+                segment_path,
+                duration=segment_duration,
+                num_frames=self.dedup_sample_frames,
+            )
+        except Exception as e:
+            self._report_progress(0.0, f"⚠️  片段感知哈希计算失败，跳过去重: {str(e)[:100]}")
+            return []
+
     def _encode_video(self, video_path: str) -> str:
         """
         将视频文件编码为 Base64 字符串
@@ -679,27 +752,28 @@ class VideoConverter(MultimodalConverter):
         # 使用 SDK 调用 API
         self._report_progress(0.3, f"正在分析视频: {os.path.basename(video_path)}...")
         
-        completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "video_url",
-                            "video_url": {
-                                "url": f"data:video/{video_format};base64,{base64_video}",
-                                "fps":4,
+        with self._remote_call_slot():
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "video_url",
+                                "video_url": {
+                                    "url": f"data:video/{video_format};base64,{base64_video}",
+                                    "fps":4,
+                                },
                             },
-                        },
-                        {
-                            "type": "text",
-                            "text": base_prompt,
-                        },
-                    ],
-                }
-            ],
-        )
+                            {
+                                "type": "text",
+                                "text": base_prompt,
+                            },
+                        ],
+                    }
+                ],
+            )
         
         # 提取视频描述
         if completion.choices and len(completion.choices) > 0:
@@ -718,7 +792,22 @@ class VideoConverter(MultimodalConverter):
         真实视频识别实现：使用 API 进行本地视频文件分析
         如果视频文件超过 50MB，会自动切分成多个片段分别分析
         """
+        return ConversionOutput.from_stream(
+            self.convert_stream(source, source_type=source_type, **kwargs)
+        )
+
+    def convert_stream(self, source, *, source_type: str = "file_path", **kwargs: Any) -> ChunkStream:
+        """
+        流式版本：每个片段分析完成后立即 yield 一个 ConversionChunk，
+        生成器的返回值是不含 chunks 的 ConversionOutput（状态和元数据）。
+        """
         segments = []
+        chunks_yielded = 0
+        stream_metadata = {
+            "converter_provider": "video_api_converter",
+            "converter_version": "1.0.0",
+            "model": self.model,
+        }
         try:
             # 只支持本地文件路径
             if source_type != "file_path":
@@ -732,11 +821,24 @@ class VideoConverter(MultimodalConverter):
             self._report_progress(0.05, "获取视频信息...")
             video_duration = self._get_video_duration(video_path)
             
-            # 不论视频大小，都按1分钟（60秒）切分
-            chunks = []
-            self._report_progress(0.1, f"开始按1分钟切分视频...")
-            segments = self._split_video_by_time(video_path, segment_duration=60)
-            self._report_progress(0.2, f"视频已切分成 {len(segments)} 个片段")
+            if video_duration is None:
+                raise ValueError("无法获取视频时长")
+            
+            # 规划切分边界（默认按镜头切换自适应切分，失败时回退为固定时长）
+            self._report_progress(0.1, f"正在规划视频切分（模式: {self.segmentation}）...")
+            segment_plans = self._plan_video_segments(video_path, video_duration)
+            static_starts = {round(p.start, 3) for p in segment_plans if p.static}
+            time_ranges = [(p.start, p.end) for p in segment_plans]
+            segments = self._split_video_by_time(video_path, time_ranges=time_ranges)
+            self._report_progress(0.2, f"视频已切分成 {len(segments)} 个片段（其中静态片段 {len(static_starts)} 个）")
+            # 流式输出时最终元数据要到结束才可用，因此把转换器级别的字段写进每个 chunk
+            stream_metadata["video_duration"] = video_duration
+            stream_metadata["segments_count"] = len(segments)
+            stream_metadata["segmentation"] = self.segmentation
+            static_skipped = 0
+            near_duplicates = 0
+            # 上一个实际调用模型分析的片段：(帧哈希, 相对时间戳描述, 片段序号)
+            last_analyzed = None
             
             # 提取整个视频的音频（如果启用音频转录）
             audio_transcription_list = []
@@ -749,9 +851,13 @@ class VideoConverter(MultimodalConverter):
                         audio_size = os.path.getsize(temp_audio_path) if os.path.exists(temp_audio_path) else 0
                         self._report_progress(0.16, f"✅ 音频提取成功: {audio_size / 1024:.2f}KB")
                         
-                        # 对音频进行1分钟切片并转录
-                        self._report_progress(0.17, "正在对音频进行1分钟切片并转录...")
-                        audio_transcription_list = self._transcribe_audio_segments_list(temp_audio_path, segment_start_time=0.0)
+                        # 按与视频片段相同的区间切分音频并转录
+                        self._report_progress(0.17, "正在对音频切片并转录...")
+                        audio_transcription_list = self._transcribe_audio_segments_list(
+                            temp_audio_path,
+                            segment_start_time=0.0,
+                            time_ranges=[(start, end) for _, start, end in segments],
+                        )
                         
                         if audio_transcription_list:
                             self._report_progress(0.18, f"✅ 音频转录完成: {len(audio_transcription_list)} 个片段")
@@ -775,27 +881,53 @@ class VideoConverter(MultimodalConverter):
                 progress_start = 0.2 + (i / len(segments)) * 0.7
                 progress_end = 0.2 + ((i + 1) / len(segments)) * 0.7
                 
-                self._report_progress(
-                    progress_start,
-                    f"正在分析片段 {i+1}/{len(segments)} ({start_time:.1f}s - {end_time:.1f}s)..."
-                )
+                # 获取对应的音频转录文本（如果启用）
+                audio_text = ""
+                if audio_transcription_list and i < len(audio_transcription_list):
+                    audio_text = audio_transcription_list[i]
                 
-                # 分析片段
-                segment_description = self._analyze_video_segment(
-                    segment_path,
-                    segment_duration=segment_duration,
-                    segment_start=start_time
-                )
+                is_static = round(start_time, 3) in static_starts
+                if self.skip_static_segments and is_static and not audio_text and len(segments) > 1:
+                    # 画面无变化且没有音频内容，跳过视觉模型调用
+                    static_skipped += 1
+                    self._report_progress(progress_end, f"片段 {i+1}/{len(segments)} 为静态画面，已跳过")
+                    continue
+                
+                frame_hashes = self._segment_hashes(segment_path, segment_duration)
+                reused_from = None
+                if (
+                    last_analyzed is not None
+                    and frame_hashes
+                    and hash_distance(frame_hashes, last_analyzed[0]) <= self.dedup_hash_threshold
+                ):
+                    # 画面与上一个分析过的片段几乎相同：复用描述，只裁剪到本片段时长
+                    reused_from = last_analyzed[2]
+                    near_duplicates += 1
+                    relative_description = self._filter_timestamps_by_duration(last_analyzed[1], segment_duration)
+                    self._report_progress(
+                        progress_start,
+                        f"片段 {i+1}/{len(segments)} 与片段 {reused_from+1} 近似重复，复用描述"
+                    )
+                else:
+                    self._report_progress(
+                        progress_start,
+                        f"正在分析片段 {i+1}/{len(segments)} ({start_time:.1f}s - {end_time:.1f}s)..."
+                    )
+                    
+                    # 分析片段
+                    relative_description = self._analyze_video_segment(
+                        segment_path,
+                        segment_duration=segment_duration,
+                        segment_start=start_time
+                    )
+                    if frame_hashes:
+                        last_analyzed = (frame_hashes, relative_description, i)
+                segment_description = relative_description
                 
                 # 调整时间戳，加上片段开始时间偏移
                 if start_time > 0:
                     segment_description = self._adjust_timestamps(segment_description, start_time)
                 
-                # 获取对应的音频转录文本（如果启用）
-                audio_text = ""
-                if audio_transcription_list and i < len(audio_transcription_list):
-                    audio_text = audio_transcription_list[i]
-                
                 # 合并视频分析和音频转录结果
                 if audio_text:
                     segment_description = self._merge_video_and_audio_analysis(segment_description, audio_text)
@@ -807,8 +939,10 @@ class VideoConverter(MultimodalConverter):
                 end_seconds = int(end_time % 60)
                 
                 chunk_metadata = {
+                    **stream_metadata,
                     "source_type": "video",
-                    "chunk_index": i,
+                    "chunk_index": chunks_yielded,
+                    "segment_index": i,
                     "chunk_count_estimate": len(segments),
                     "duration_seconds": int(segment_duration),
                     "time_range": f"{start_minutes:02d}:{start_seconds:02d}-{end_minutes:02d}:{end_seconds:02d}",
@@ -822,40 +956,42 @@ class VideoConverter(MultimodalConverter):
                     "segment_end_time": round(end_time, 2),
                     "has_audio": bool(audio_text),
                     "audio_transcription": audio_text if audio_text else None,
-                    "audio_transcription_list": audio_transcription_list if i == 0 else None,  # 只在第一个chunk保存完整列表
+                    "audio_transcription_list": audio_transcription_list if chunks_yielded == 0 else None,  # 只在第一个chunk保存完整列表
+                    "static_segment": is_static,
+                    "near_duplicate_of": reused_from,
                 }
                 
-                chunk = ConversionChunk(
+                self._report_progress(progress_end, f"片段 {i+1}/{len(segments)} 分析完成")
+                chunk_index = chunks_yielded
+                chunks_yielded += 1
+                yield ConversionChunk(
                     text=segment_description,
-                    chunk_index=i,
+                    chunk_index=chunk_index,
                     metadata=chunk_metadata,
                 )
-                chunks.append(chunk)
-                
-                self._report_progress(progress_end, f"片段 {i+1}/{len(segments)} 分析完成")
             
             self._report_progress(1.0, "视频分析完成")
             
             return ConversionOutput(
                 status="success",
-                chunks=chunks,
                 metadata={
-                    "converter_provider": "video_api_converter",
-                    "converter_version": "1.0.0",
+                    **stream_metadata,
                     "conversion_time": datetime.utcnow().isoformat() + "Z",
-                    "video_duration": video_duration,
-                    "segments_count": len(segments) if segments else 0,
-                    "chunks_count": len(chunks),
-                    "model": self.model,
+                    "chunks_count": chunks_yielded,
+                    "static_segments_skipped": static_skipped,
+                    "near_duplicate_segments": near_duplicates,
+                    # 未调用视觉模型的片段占比（静态跳过 + 近似重复复用）
+                    "skip_ratio": round((static_skipped + near_duplicates) / len(segments), 4) if segments else 0.0,
                 },
             )
         except Exception as e:
+            # 已经输出的片段保留在下游，状态标记为 partial
             return ConversionOutput(
-                status="failed",
-                chunks=[],
+                status="partial" if chunks_yielded else "failed",
                 metadata={
                     "converter_provider": "video_api_converter",
                     "converter_version": "1.0.0",
+                    "chunks_count": chunks_yielded,
                 },
                 error=str(e),
             )
@@ -17,6 +17,7 @@ from ..videorag._utils import always_get_an_event_loop, logger
 from ..videorag._videoutil import (
     merge_segment_information,
     saving_video_segments,
+    segment_cache_dir,
     segment_caption,
     speech_to_text,
     split_video,
@@ -204,7 +205,12 @@ class VideoConverter(MultimodalConverter):
 
         debug_caption = kwargs.get("debug_caption", self.config.get("debug_caption", False))
         videorag.load_caption_model(debug=debug_caption)
-        query_param = kwargs.get("query_param") or self.config.get("query_param") or QueryParam(mode="videorag")
+        # 摘要只针对刚入库的这个视频，working_dir 中可能还有其他视频
+        query_param = (
+            kwargs.get("query_param")
+            or self.config.get("query_param")
+            or QueryParam(mode="videorag", video_names=[video_name])
+        )
         response = videorag.query(query=question, param=query_param)
         if isinstance(response, str):
             summary_text = response
@@ -224,11 +230,12 @@ class VideoConverter(MultimodalConverter):
     def _ingest_video_with_progress(self, videorag: VideoRAG, video_path: str) -> Dict[str, Dict[str, Any]]:
         loop = always_get_an_event_loop()
         video_name = Path(video_path).stem
-        if video_name in videorag.video_segments._data:
-            stored_path = videorag.video_path_db._data.get(video_name)
+        stored_segments = loop.run_until_complete(videorag.video_segments.get_by_id(video_name))
+        if stored_segments is not None:
+            stored_path = loop.run_until_complete(videorag.video_path_db.get_by_id(video_name))
             if stored_path and os.path.exists(stored_path):
                 self._report_progress(0.7, f"视频 {video_name} 已存在，跳过重建")
-                return videorag.video_segments._data.get(video_name, {})
+                return stored_segments
             # 已有索引但原视频文件不存在，更新路径为本次提供的文件
             loop.run_until_complete(videorag.video_path_db.upsert({video_name: video_path}))
             self._report_progress(0.09, f"视频 {video_name} 重新绑定路径")
@@ -243,6 +250,12 @@ class VideoConverter(MultimodalConverter):
             videorag.video_segment_length,
             videorag.rough_num_frames_per_segment,
             videorag.audio_output_format,
+            segmentation=videorag.video_segmentation,
+            min_segment_length=videorag.min_video_segment_length,
+            scene_threshold=videorag.scene_threshold,
+            scene_detection_method=videorag.scene_detection_method,
+            export_segments=videorag.segment_export_mode == "copy",
+            video_output_format=videorag.video_output_format,
         )
 
         self._report_progress(0.2, "执行语音识别")
@@ -251,6 +264,11 @@ class VideoConverter(MultimodalConverter):
             videorag.working_dir,
             segment_index2name,
             videorag.audio_output_format,
+            model_path=videorag.asr_model_path,
+            device=videorag.asr_device,
+            compute_type=videorag.asr_compute_type,
+            num_workers=videorag.asr_num_workers,
+            use_cache=videorag.asr_cache,
         )
 
         manager = multiprocessing.Manager()
@@ -268,6 +286,7 @@ class VideoConverter(MultimodalConverter):
                 segment_times_info,
                 error_queue,
                 videorag.video_output_format,
+                videorag.segment_export_mode,
             ),
         )
 
@@ -281,6 +300,8 @@ class VideoConverter(MultimodalConverter):
                 segment_times_info,
                 captions,
                 error_queue,
+                videorag.caption_backend_spec(),
+                os.path.join(videorag.working_dir, "_caption_cache") if videorag.caption_cache else None,
             ),
         )
 
@@ -304,6 +325,7 @@ class VideoConverter(MultimodalConverter):
             languages,
         )
         manager.shutdown()
+        shutil.rmtree(os.path.join(segment_cache_dir(videorag.working_dir, video_name), "frames"), ignore_errors=True)
 
         # 直接返回片段信息，跳过embedding和持久化步骤
         return segments_information
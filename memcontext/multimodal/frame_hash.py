@@ -0,0 +1,70 @@
+"""Perceptual frame hashing used to spot near-duplicate video segments.
+
+Frames are sampled with ffmpeg, downscaled to ``(hash_size + 1) x hash_size``
+grey pixels and reduced to a difference hash (dHash): one bit per pixel
+pair telling whether brightness increases to the right. Hashes of two
+segments are compared frame by frame with the normalized Hamming distance,
+so ``0.0`` means visually identical and ``1.0`` completely different.
+"""
+
+from __future__ import annotations
+
+import shutil
+import subprocess
+from typing import List, Sequence
+
+
+def difference_hash(pixels: bytes, hash_size: int = 8) -> int:
+    """Compute a dHash from a ``(hash_size + 1) x hash_size`` grey frame."""
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def segment_frame_hashes(
+    video_path: str,
+    *,
+    start: float = 0.0,
+    duration: float,
+    num_frames: int = 4,
+    hash_size: int = 8,
+) -> List[int]:
+    """Return dHashes of ``num_frames`` frames evenly spaced over the segment."""
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg 未安装或不在 PATH 中。请先安装 ffmpeg。")
+    if duration <= 0 or num_frames <= 0:
+        return []
+    fps = num_frames / duration
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-ss", str(start), "-t", str(duration), "-i", video_path, "-an",
+        "-vf", f"fps={fps},scale={hash_size + 1}:{hash_size}",
+        "-pix_fmt", "gray", "-frames:v", str(num_frames),
+        "-f", "rawvideo", "-",
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 抽帧失败: {result.stderr.decode('utf-8', 'ignore')[-300:]}")
+    frame_size = (hash_size + 1) * hash_size
+    data = result.stdout
+    return [
+        difference_hash(data[i:i + frame_size], hash_size)
+        for i in range(0, len(data) - frame_size + 1, frame_size)
+    ]
+
+
+def hash_distance(first: Sequence[int], second: Sequence[int], hash_size: int = 8) -> float:
+    """Mean normalized Hamming distance between paired frame hashes.
+
+    Returns ``1.0`` when either side has no hashes so that missing data never
+    counts as a duplicate.
+    """
+    pairs = list(zip(first, second))
+    if not pairs:
+        return 1.0
+    bits = hash_size * hash_size
+    return sum(bin(a ^ b).count("1") for a, b in pairs) / (bits * len(pairs))
@@ -0,0 +1,221 @@
+"""Scene-change-aware segmentation for video conversion.
+
+Segment boundaries are placed at shot changes detected from cheap local
+signals instead of at fixed intervals:
+
+* ``ffmpeg``: per-frame ``scene`` scores from ffmpeg's ``select`` filter on a
+  downscaled, low-fps stream (no Python dependencies besides ffmpeg).
+* ``histogram``: grey-level histogram differences between consecutive
+  downscaled frames, computed with NumPy from an ffmpeg rawvideo pipe.
+
+Both produce a list of ``(time, score)`` samples in ``[0, 1]`` which
+``plan_segments`` turns into segments bounded by ``min_duration`` and
+``max_duration``. Segments without any motion above ``static_threshold``
+are flagged as static so callers can merge or skip them.
+"""
+
+from __future__ import annotations
+
+import re
+import shutil
+import subprocess
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+try:  # NumPy is only needed for the histogram method
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+SceneScores = List[Tuple[float, float]]
+
+_PTS_TIME_RE = re.compile(r"pts_time:([0-9.]+)")
+_SCENE_SCORE_RE = re.compile(r"lavfi\.scene_score=([0-9.]+)")
+
+
+@dataclass
+class SegmentPlan:
+    """A planned segment ``[start, end)`` in seconds."""
+
+    start: float
+    end: float
+    static: bool = False
+    peak_score: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def compute_scene_scores(
+    video_path: str,
+    *,
+    method: str = "ffmpeg",
+    sample_fps: float = 2.0,
+    downscale_width: int = 160,
+) -> SceneScores:
+    """Return ``(time, score)`` samples describing how much each sampled frame
+    differs from the previous one."""
+
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg 未安装或不在 PATH 中。请先安装 ffmpeg。")
+    if method == "ffmpeg":
+        return _ffmpeg_scene_scores(video_path, sample_fps, downscale_width)
+    if method == "histogram":
+        return _histogram_scene_scores(video_path, sample_fps, downscale_width)
+    raise ValueError(f"Unknown scene detection method: {method}")
+
+
+def _ffmpeg_scene_scores(video_path: str, sample_fps: float, downscale_width: int) -> SceneScores:
+    vf = (
+        f"fps={sample_fps},scale={downscale_width}:-2,"
+        "select='gte(scene,0)',metadata=print:file=-"
+    )
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", video_path, "-an", "-vf", vf, "-f", "null", "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 场景检测失败: {result.stderr[-500:]}")
+    scores: SceneScores = []
+    current_time = None
+    for line in result.stdout.splitlines():
+        time_match = _PTS_TIME_RE.search(line)
+        if time_match:
+            current_time = float(time_match.group(1))
+            continue
+        score_match = _SCENE_SCORE_RE.search(line)
+        if score_match and current_time is not None:
+            scores.append((current_time, float(score_match.group(1))))
+            current_time = None
+    return scores
+
+
+def _histogram_scene_scores(video_path: str, sample_fps: float, downscale_width: int) -> SceneScores:
+    if np is None:
+        raise ImportError("numpy is required for histogram scene detection")
+    height = max(2, int(downscale_width * 9 / 16) // 2 * 2)
+    frame_size = downscale_width * height
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", video_path, "-an",
+        "-vf", f"fps={sample_fps},scale={downscale_width}:{height}",
+        "-pix_fmt", "gray", "-f", "rawvideo", "-",
+    ]
+    scores: SceneScores = []
+    prev_hist = None
+    frame_index = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        while True:
+            buf = proc.stdout.read(frame_size)
+            if len(buf) < frame_size:
+                break
+            frame = np.frombuffer(buf, dtype=np.uint8)
+            hist = np.bincount(frame >> 2, minlength=64).astype(np.float32) / frame_size
+            if prev_hist is not None:
+                # Half the L1 distance between normalized histograms lies in [0, 1]
+                score = float(np.abs(hist - prev_hist).sum() / 2.0)
+                scores.append((frame_index / sample_fps, score))
+            prev_hist = hist
+            frame_index += 1
+    return scores
+
+
+def plan_segments(
+    scores: Sequence[Tuple[float, float]],
+    duration: float,
+    *,
+    min_duration: float = 10.0,
+    max_duration: float = 60.0,
+    scene_threshold: float = 0.3,
+    static_threshold: float = 0.02,
+    merge_static: bool = True,
+    max_static_duration: Optional[float] = None,
+) -> List[SegmentPlan]:
+    """Place boundaries at scene changes within ``[min_duration, max_duration]``.
+
+    Each segment is cut at the strongest change between ``min_duration`` and
+    ``max_duration`` after its start (or at ``max_duration`` if the stretch is
+    flat), so fast-cut footage does not produce more segments than fixed
+    ``max_duration`` slicing would. Consecutive static segments are
+    merged up to ``max_static_duration``. It defaults to ``max_duration`` so no
+    segment ever exceeds it; pass a larger value to opt in to longer merges.
+    """
+    if duration <= 0:
+        return []
+    if min_duration <= 0 or max_duration < min_duration:
+        raise ValueError("require 0 < min_duration <= max_duration")
+
+    samples = sorted((t, s) for t, s in scores if 0.0 < t < duration)
+
+    def best_cut(window_start: float, window_end: float) -> float:
+        candidates = [(s, t) for t, s in samples if window_start < t <= window_end]
+        if not candidates:
+            return window_end
+        score, t = max(candidates)
+        return t if score >= static_threshold else window_end
+
+    boundaries: List[float] = []
+    start = 0.0
+    while duration - start > max_duration:
+        # 不切在距结尾不足 min_duration 的位置，避免留下过短的尾段
+        window_end = max(start + min_duration, min(start + max_duration, duration - min_duration))
+        start = best_cut(start + min_duration, window_end)
+        boundaries.append(start)
+    # A tail shorter than min_duration is folded into the previous segment when it fits
+    if boundaries and duration - boundaries[-1] < min_duration:
+        previous = boundaries[-2] if len(boundaries) > 1 else 0.0
+        if duration - previous <= max_duration:
+            boundaries.pop()
+
+    edges = [0.0] + boundaries + [duration]
+    plans = []
+    for seg_start, seg_end in zip(edges, edges[1:]):
+        peak = max((s for t, s in samples if seg_start < t < seg_end), default=0.0)
+        plans.append(SegmentPlan(seg_start, seg_end, static=peak < static_threshold, peak_score=peak))
+
+    if merge_static:
+        # Only merge across forced cuts, never across a detected scene change
+        score_at = dict(samples)
+        limit = max_static_duration if max_static_duration is not None else max_duration
+        merged: List[SegmentPlan] = []
+        for plan in plans:
+            last = merged[-1] if merged else None
+            if (
+                last and last.static and plan.static
+                and score_at.get(plan.start, 0.0) < scene_threshold
+                and plan.end - last.start <= limit
+            ):
+                last.end = plan.end
+                last.peak_score = max(last.peak_score, plan.peak_score)
+            else:
+                merged.append(plan)
+        plans = merged
+    return plans
+
+
+def fixed_segments(duration: float, segment_length: float) -> List[SegmentPlan]:
+    """Fixed-length segmentation, used as the fallback when detection fails."""
+    plans = []
+    start = 0.0
+    while start < duration:
+        end = min(start + segment_length, duration)
+        plans.append(SegmentPlan(start, end))
+        start = end
+    return plans
+
+
+def adaptive_segments(
+    video_path: str,
+    duration: float,
+    *,
+    method: str = "ffmpeg",
+    sample_fps: float = 2.0,
+    **plan_kwargs,
+) -> List[SegmentPlan]:
+    """Detect scene changes in ``video_path`` and plan segments from them.
+
+    Raises ``RuntimeError`` when no frames could be scored so that callers can
+    fall back to ``fixed_segments`` instead of treating the video as static.
+    """
+    scores = compute_scene_scores(video_path, method=method, sample_fps=sample_fps)
+    if not scores:
+        raise RuntimeError(f"scene detection produced no samples for {video_path}")
+    return plan_segments(scores, duration, **plan_kwargs)
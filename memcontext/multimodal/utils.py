@@ -5,9 +5,16 @@ from __future__ import annotations
 import hashlib
 import mimetypes
 import os
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Iterator, Optional, Tuple
 
+# Process-wide cap on concurrent remote model calls (vision / ASR / LLM summary),
+# shared by all converters so parallel ingestion cannot exceed provider limits.
+_remote_call_semaphore: Optional[threading.BoundedSemaphore] = None
+_remote_call_limit: Optional[int] = None
+
 
 def guess_file_extension(name: str) -> str:
     """Return normalized file extension (without dot)."""
@@ -58,3 +65,34 @@ def ensure_directory(path: Path) -> None:
 
     os.makedirs(path, exist_ok=True)
 
+
+
+def set_remote_call_limit(limit: Optional[int]) -> None:
+    """Cap concurrent remote model calls across threads; ``None`` or ``0`` disables the cap."""
+
+    global _remote_call_semaphore, _remote_call_limit
+    if limit is not None and limit < 0:
+        raise ValueError("limit cannot be negative")
+    limit = limit or None
+    if limit == _remote_call_limit:
+        return
+    _remote_call_limit = limit
+    _remote_call_semaphore = threading.BoundedSemaphore(limit) if limit else None
+
+
+def get_remote_call_limit() -> Optional[int]:
+    """Return the current cap on concurrent remote model calls (``None`` = unlimited)."""
+
+    return _remote_call_limit
+
+
+@contextmanager
+def remote_call_slot() -> Iterator[None]:
+    """Hold one remote-call slot for the duration of the block."""
+
+    semaphore = _remote_call_semaphore
+    if semaphore is None:
+        yield
+        return
+    with semaphore:
+        yield
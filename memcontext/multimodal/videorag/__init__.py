@@ -1 +1 @@
-from .videorag import VideoRAG, QueryParam
\ No newline at end of file
+from .videorag import VideoRAG, QueryParam, RetrievalContext
\ No newline at end of file
@@ -78,6 +78,11 @@ class LLMConfig:
     cheap_model_max_token_size: int
     cheap_model_max_async: int
 
+    # Optional requests-per-minute limits, None means unlimited
+    embedding_func_max_rpm: int = None
+    best_model_max_rpm: int = None
+    cheap_model_max_rpm: int = None
+
     # Assigned in post init
     embedding_func: EmbeddingFunc  = None    
     best_model_func: callable = None    
@@ -132,7 +137,6 @@ async def openai_complete_if_cache(
         await hashing_kv.upsert(
             {args_hash: {"return": response.choices[0].message.content, "model": model}}
         )
-        await hashing_kv.index_done_callback()
     return response.choices[0].message.content
 
 
@@ -251,7 +255,6 @@ async def azure_openai_complete_if_cache(
                 }
             }
         )
-        await hashing_kv.index_done_callback()
     return response.choices[0].message.content
 
 
@@ -352,7 +355,6 @@ async def ollama_complete_if_cache(
         await hashing_kv.upsert(
             {args_hash: {"return": response['message']['content'], "model": model}}
         )
-        await hashing_kv.index_done_callback()
 
     return response['message']['content']
 
@@ -462,7 +464,6 @@ async def deepseek_complete_if_cache(
         await hashing_kv.upsert(
             {args_hash: {"return": content, "model": model}}
         )
-        await hashing_kv.index_done_callback()
 
     return content
 
@@ -561,7 +562,6 @@ async def doubao_complete_if_cache(
         await hashing_kv.upsert(
             {args_hash: {"return": response.choices[0].message.content, "model": model}}
         )
-        await hashing_kv.index_done_callback()
     return response.choices[0].message.content
 
 async def doubao_complete(
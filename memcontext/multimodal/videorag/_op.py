@@ -1,8 +1,8 @@
 import re
 import json
 import openai
+import numpy as np
 import asyncio
-import tiktoken
 from typing import Union
 from collections import Counter, defaultdict
 from ._splitter import SeparatorSplitter
@@ -12,6 +12,8 @@ from ._utils import (
     compute_mdhash_id,
     decode_tokens_by_tiktoken,
     encode_string_by_tiktoken,
+    encode_strings_by_tiktoken,
+    get_tiktoken_encoder,
     is_float_regex,
     list_of_list_to_csv,
     pack_user_ass_to_openai_messages,
@@ -26,6 +28,7 @@ from .base import (
     CommunitySchema,
     TextChunkSchema,
     QueryParam,
+    RetrievalContext,
 )
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
 from ._videoutil import (
@@ -66,6 +69,28 @@ def _time_str_to_seconds(t: Union[str, float, int]) -> float:
     except Exception:
         return 0.0
 
+async def _get_segment_infos(
+    segment_ids: list[str],
+    video_segments: BaseKVStorage,
+    video_path_db: BaseKVStorage = None,
+):
+    """Fetch the given ``{video_name}_{index}`` segments (and their video paths)
+    through the storage API, projecting only the needed indices per video."""
+    wanted = defaultdict(set)
+    for s_id in segment_ids:
+        wanted['_'.join(s_id.split('_')[:-1])].add(s_id.split('_')[-1])
+    video_names = list(wanted)
+    indices = set().union(*wanted.values()) if wanted else set()
+    segments_by_video = await video_segments.get_by_ids(video_names, fields=indices)
+    segment_infos = {}
+    for video_name, segments in zip(video_names, segments_by_video):
+        for index in wanted[video_name]:
+            segment_infos[f"{video_name}_{index}"] = (segments or {})[index]
+    video_paths = {}
+    if video_path_db is not None:
+        video_paths = dict(zip(video_names, await video_path_db.get_by_ids(video_names)))
+    return segment_infos, video_paths
+
 def chunking_by_token_size(
     tokens_list: list[list[int]],
     doc_keys,
@@ -189,22 +214,39 @@ def chunking_by_seperators(
     return results
 
 
-def get_chunks(new_videos, chunk_func=chunking_by_video_segments, **chunk_func_params):
+def get_chunks(
+    new_videos,
+    chunk_func=chunking_by_video_segments,
+    tiktoken_model_name="gpt-4o",
+    encode_num_threads=None,
+    **chunk_func_params,
+):
     inserting_chunks = {}
 
+    ENCODER = get_tiktoken_encoder(tiktoken_model_name)
     new_videos_list = list(new_videos.keys())
-    for video_name in new_videos_list:
-        segment_id_list = list(new_videos[video_name].keys())
-        docs = [new_videos[video_name][index]["content"] for index in segment_id_list]
+    segment_id_lists = [list(new_videos[video_name].keys()) for video_name in new_videos_list]
+    # 所有视频的片段一起编码，线程池能在批量入库时充分并行
+    all_tokens = encode_strings_by_tiktoken(
+        [
+            new_videos[video_name][index]["content"]
+            for video_name, segment_id_list in zip(new_videos_list, segment_id_lists)
+            for index in segment_id_list
+        ],
+        model_name=tiktoken_model_name,
+        num_threads=encode_num_threads,
+    )
+    offset = 0
+    for video_name, segment_id_list in zip(new_videos_list, segment_id_lists):
         doc_keys = [f'{video_name}_{index}' for index in segment_id_list]
-
-        ENCODER = tiktoken.encoding_for_model("gpt-4o")
-        tokens = ENCODER.encode_batch(docs, num_threads=16)
+        tokens = all_tokens[offset : offset + len(segment_id_list)]
+        offset += len(segment_id_list)
         chunks = chunk_func(
             tokens, doc_keys=doc_keys, tiktoken_model=ENCODER, **chunk_func_params
         )
 
         for chunk in chunks:
+            chunk["video_names"] = [video_name]
             inserting_chunks.update(
                 {compute_mdhash_id(chunk["content"], prefix="chunk-"): chunk}
             )
@@ -242,6 +284,7 @@ async def _handle_entity_relation_summary(
 async def _handle_single_entity_extraction(
     record_attributes: list[str],
     chunk_key: str,
+    video_names: list[str] = (),
 ):
     if len(record_attributes) < 4 or record_attributes[0] != '"entity"':
         return None
@@ -257,6 +300,7 @@ async def _handle_single_entity_extraction(
         entity_type=entity_type,
         description=entity_description,
         source_id=entity_source_id,
+        video_names=list(video_names),
     )
 
 
@@ -292,6 +336,7 @@ async def _merge_nodes_then_upsert(
     already_entitiy_types = []
     already_source_ids = []
     already_description = []
+    already_video_names = []
 
     already_node = await knowledge_graph_inst.get_node(entity_name)
     if already_node is not None:
@@ -300,6 +345,13 @@ async def _merge_nodes_then_upsert(
             split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
         )
         already_description.append(already_node["description"])
+        already_video_names.extend(
+            split_string_by_multi_markers(already_node.get("video_names", ""), [GRAPH_FIELD_SEP])
+        )
+        # 已合并过的 chunk 不再重复计入（中断后重新合并同一窗口时）
+        nodes_data = [dp for dp in nodes_data if dp["source_id"] not in already_source_ids]
+        if not nodes_data:
+            return dict(already_node, entity_name=entity_name, video_names=already_node.get("video_names", ""))
 
     entity_type = sorted(
         Counter(
@@ -317,10 +369,14 @@ async def _merge_nodes_then_upsert(
     description = await _handle_entity_relation_summary(
         entity_name, description, global_config
     )
+    video_names = GRAPH_FIELD_SEP.join(
+        sorted(set(already_video_names + [v for dp in nodes_data for v in dp.get("video_names", [])]))
+    )
     node_data = dict(
         entity_type=entity_type,
         description=description,
         source_id=source_id,
+        video_names=video_names,
     )
     await knowledge_graph_inst.upsert_node(
         entity_name,
@@ -349,6 +405,14 @@ async def _merge_edges_then_upsert(
         )
         already_description.append(already_edge["description"])
         already_order.append(already_edge.get("order", 1))
+        # 已合并过的 chunk 不再重复累加 weight（中断后重新合并同一窗口时）
+        edges_data = [dp for dp in edges_data if dp["source_id"] not in already_source_ids]
+        if not edges_data:
+            return dict(
+                src_tgt=(src_id, tgt_id),
+                description=already_edge["description"],
+                weight=already_edge["weight"],
+            )
 
     # [numberchiffre]: `Relationship.order` is only returned from DSPy's predictions
     order = min([dp.get("order", 1) for dp in edges_data] + already_order)
@@ -387,16 +451,75 @@ async def _merge_edges_then_upsert(
     return return_edge_data
 
 
+async def _merge_window_then_upsert(
+    results: list[tuple[dict, dict]],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    global_config: dict,
+):
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for m_nodes, m_edges in results:
+        for k, v in m_nodes.items():
+            maybe_nodes[k].extend(v)
+        for k, v in m_edges.items():
+            # it's undirected graph
+            maybe_edges[tuple(sorted(k))].extend(v)
+    entities_data = await asyncio.gather(
+        *[
+            _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
+            for k, v in maybe_nodes.items()
+        ]
+    )
+    edges_data = await asyncio.gather(
+        *[
+            _merge_edges_then_upsert(k[0], k[1], v, knowledge_graph_inst, global_config)
+            for k, v in maybe_edges.items()
+        ]
+    )
+    if entity_vdb is not None and len(entities_data):
+        data_for_vdb = {
+            compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
+                "content": dp["entity_name"] + dp["description"],
+                "entity_name": dp["entity_name"],
+                "video_names": split_string_by_multi_markers(dp["video_names"], [GRAPH_FIELD_SEP]),
+            }
+            for dp in entities_data
+        }
+        await entity_vdb.upsert(data_for_vdb)
+    return entities_data, edges_data
+
+
 async def extract_entities(
     chunks: dict[str, TextChunkSchema],
     knowledge_graph_inst: BaseGraphStorage,
     entity_vdb: BaseVectorStorage,
     global_config: dict,
-) -> Union[BaseGraphStorage, None]:
+    processed_chunks_kv: BaseKVStorage = None,
+) -> tuple[Union[BaseGraphStorage, None], list[dict], list[dict]]:
+    """Extract entities/relations window by window and merge each window into
+    the graph and ``entity_vdb`` before the next one starts.
+
+    When ``processed_chunks_kv`` is given, chunks recorded there are skipped and
+    every ``entity_extract_checkpoint_interval`` finished windows are
+    checkpointed (graph, entity vdb, processed ids), so an interrupted insert
+    resumes from the last checkpoint; the final save is left to the caller's
+    ``index_done_callback``. Merging skips contributions whose chunk is already
+    in a node's or edge's ``source_id``, so re-merging a window is harmless.
+    """
     use_llm_func: callable = global_config["llm"]["best_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
-    
+    window_size = max(1, global_config.get("entity_extract_window_size", 32))
+    checkpoint_interval = global_config.get("entity_extract_checkpoint_interval", 8)
+
     ordered_chunks = list(chunks.items())
+    resumed_chunks = 0
+    if processed_chunks_kv is not None:
+        pending_keys = await processed_chunks_kv.filter_keys(list(chunks.keys()))
+        resumed_chunks = len(ordered_chunks) - len(pending_keys)
+        ordered_chunks = [c for c in ordered_chunks if c[0] in pending_keys]
+        if resumed_chunks:
+            logger.info(f"Resume entity extraction, skip {resumed_chunks} already processed chunks")
 
     entity_extract_prompt = PROMPTS["entity_extraction"]
     context_base = dict(
@@ -452,7 +575,7 @@ async def extract_entities(
                 record, [context_base["tuple_delimiter"]]
             )
             if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
+                record_attributes, chunk_key, chunk_dp.get("video_names", [])
             )
             if if_entities is not None:
                 maybe_nodes[if_entities["entity_name"]].append(if_entities)
@@ -478,43 +601,40 @@ async def extract_entities(
         )
         return dict(maybe_nodes), dict(maybe_edges)
 
-    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
-    )
+    all_entities_data = {}
+    all_edges_data = {}
+    for window_index, window_start in enumerate(range(0, len(ordered_chunks), window_size)):
+        window = ordered_chunks[window_start : window_start + window_size]
+        # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
+        results = await asyncio.gather(*[_process_single_content(c) for c in window])
+        entities_data, edges_data = await _merge_window_then_upsert(
+            results, knowledge_graph_inst, entity_vdb, global_config
+        )
+        # 同一实体在后续窗口中再次出现时保留最新的合并结果
+        all_entities_data.update((dp["entity_name"], dp) for dp in entities_data)
+        all_edges_data.update((dp["src_tgt"], dp) for dp in edges_data)
+        if processed_chunks_kv is not None:
+            await processed_chunks_kv.upsert(
+                {
+                    chunk_key: {"entities": len(m_nodes), "relations": len(m_edges)}
+                    for (chunk_key, _), (m_nodes, m_edges) in zip(window, results)
+                }
+            )
+            # 每个 checkpoint 都要整体重写图和向量库，按窗口数间隔落盘
+            if checkpoint_interval and (window_index + 1) % checkpoint_interval == 0:
+                await asyncio.gather(
+                    *[
+                        storage_inst.index_checkpoint_callback()
+                        for storage_inst in [knowledge_graph_inst, entity_vdb, processed_chunks_kv]
+                        if storage_inst is not None
+                    ]
+                )
     print()  # clear the progress bar
-    maybe_nodes = defaultdict(list)
-    maybe_edges = defaultdict(list)
-    for m_nodes, m_edges in results:
-        for k, v in m_nodes.items():
-            maybe_nodes[k].extend(v)
-        for k, v in m_edges.items():
-            # it's undirected graph
-            maybe_edges[tuple(sorted(k))].extend(v)
-    all_entities_data = await asyncio.gather(
-        *[
-            _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
-            for k, v in maybe_nodes.items()
-        ]
-    )
-    all_edges_data = await asyncio.gather(
-        *[
-            _merge_edges_then_upsert(k[0], k[1], v, knowledge_graph_inst, global_config)
-            for k, v in maybe_edges.items()
-        ]
-    )
-    if not len(all_entities_data):
+    all_entities_data = list(all_entities_data.values())
+    all_edges_data = list(all_edges_data.values())
+    if not len(all_entities_data) and not resumed_chunks:
         logger.warning("Didn't extract any entities, maybe your LLM is not working")
-        return None
-    if entity_vdb is not None:
-        data_for_vdb = {
-            compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
-                "content": dp["entity_name"] + dp["description"],
-                "entity_name": dp["entity_name"],
-            }
-            for dp in all_entities_data
-        }
-        await entity_vdb.upsert(data_for_vdb)
+        return None, [], []
     return knowledge_graph_inst, all_entities_data, all_edges_data
 
 
@@ -523,42 +643,41 @@ async def _find_most_related_segments_from_entities(
     node_datas: list[dict],
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     knowledge_graph_inst: BaseGraphStorage,
+    video_names: list[str] = None,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
         for dp in node_datas
     ]
-    edges = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
-    )
+    edges = await knowledge_graph_inst.get_nodes_edges([dp["entity_name"] for dp in node_datas])
     all_one_hop_nodes = set()
     for this_edges in edges:
         if not this_edges:
             continue
         all_one_hop_nodes.update([e[1] for e in this_edges])
     all_one_hop_nodes = list(all_one_hop_nodes)
-    all_one_hop_nodes_data = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(e) for e in all_one_hop_nodes]
-    )
+    all_one_hop_nodes_data = await knowledge_graph_inst.get_nodes(all_one_hop_nodes)
     all_one_hop_text_units_lookup = {
         k: set(split_string_by_multi_markers(v["source_id"], [GRAPH_FIELD_SEP]))
         for k, v in zip(all_one_hop_nodes, all_one_hop_nodes_data)
         if v is not None
     }
+    chunk_ids = list(dict.fromkeys(c_id for this_text_units in text_units for c_id in this_text_units))
+    chunk_datas = dict(zip(chunk_ids, await text_chunks_db.get_by_ids(chunk_ids)))
     all_text_units_lookup = {}
     for index, (this_text_units, this_edges) in enumerate(zip(text_units, edges)):
         for c_id in this_text_units:
             if c_id in all_text_units_lookup:
                 continue
             relation_counts = 0
-            for e in this_edges:
+            for e in this_edges or []:
                 if (
                     e[1] in all_one_hop_text_units_lookup
                     and c_id in all_one_hop_text_units_lookup[e[1]]
                 ):
                     relation_counts += 1
             all_text_units_lookup[c_id] = {
-                "data": await text_chunks_db.get_by_id(c_id),
+                "data": chunk_datas[c_id],
                 "order": index,
                 "relation_counts": relation_counts,
             }
@@ -567,6 +686,14 @@ async def _find_most_related_segments_from_entities(
     all_text_units = [
         {"id": k, **v} for k, v in all_text_units_lookup.items() if v is not None
     ]
+    if video_names:
+        # 实体可能同时出现在其他视频中，只保留目标视频的 chunk
+        all_text_units = [
+            u for u in all_text_units
+            if u["data"] is not None and any(
+                '_'.join(s_id.split('_')[:-1]) in video_names for s_id in u["data"]["video_segment_id"]
+            )
+        ]
     sorted_text_units = sorted(
         all_text_units, key=lambda x: -x["relation_counts"]
     )[:topk_chunks]
@@ -611,100 +738,69 @@ async def _extract_keywords_query(
     final_result = await use_llm_func(keywords_prompt)
     return final_result
 
-async def videorag_query(
+async def _rank_segments_by_embedding(
     query,
-    entities_vdb,
-    text_chunks_db,
-    chunks_vdb,
-    video_path_db,
-    video_segments,
-    video_segment_feature_vdb,
-    knowledge_graph_inst,
-    caption_model,
-    caption_tokenizer,
-    query_param: QueryParam,
+    rough_captions: dict[str, str],
+    embedding_func,
     global_config: dict,
-) -> str:
+) -> list[str]:
+    """Order segments by cosine similarity between the query and their rough captions."""
+    segment_ids = list(rough_captions)
+    if embedding_func is None or len(segment_ids) <= 1:
+        return segment_ids
+    texts = [query] + [rough_captions[s_id] for s_id in segment_ids]
+    batch_size = global_config["llm"]["embedding_batch_num"]
+    try:
+        embeddings = np.concatenate(await asyncio.gather(
+            *[embedding_func(texts[i : i + batch_size]) for i in range(0, len(texts), batch_size)]
+        ))
+    except Exception as e:
+        logger.warning(f"Embedding pre-rank of segments failed, keep retrieval order: {e}")
+        return segment_ids
+    embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+    scores = embeddings[1:] @ embeddings[0]
+    return [segment_ids[i] for i in np.argsort(-scores, kind="stable")]
+
+
+async def _filter_segments(
+    query,
+    rough_captions: dict[str, str],
+    embedding_func,
+    global_config: dict,
+) -> list[str]:
+    """Pre-rank segments by embedding similarity and let the LLM judge the top ones.
+
+    Only the ``segment_filter_top_n`` best ranked segments are sent to the LLM,
+    ``segment_filter_batch_size`` captions per call (1 uses the single-caption
+    prompt). Returns the kept segments in ranked order.
+    """
     use_model_func = global_config["llm"]["best_model_func"]
-    query = query
-    
-    # naive chunks
-    results = await chunks_vdb.query(query, top_k=query_param.top_k)
-    if not len(results):
-        return PROMPTS["fail_response"]
-    chunks_ids = [r["id"] for r in results]
-    chunks = await text_chunks_db.get_by_ids(chunks_ids)
+    ranked = await _rank_segments_by_embedding(query, rough_captions, embedding_func, global_config)
+    top_n = global_config.get("segment_filter_top_n", 0)
+    candidates = ranked[:top_n] if top_n else ranked
+    batch_size = max(1, global_config.get("segment_filter_batch_size", 1))
 
-    maybe_trun_chunks = truncate_list_by_token_size(
-        chunks,
-        key=lambda x: x["content"],
-        max_token_size=query_param.naive_max_token_for_text_unit,
-    )
-    logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
-    section = "-----New Chunk-----\n".join([c["content"] for c in maybe_trun_chunks])
-    retreived_chunk_context = section
-    
-    # visual retrieval
-    query_for_entity_retrieval = await _refine_entity_retrieval_query(
-        query,
-        query_param,
-        global_config,
-    )
-    entity_results = await entities_vdb.query(query_for_entity_retrieval, top_k=query_param.top_k)
-    entity_retrieved_segments = set()
-    if len(entity_results):
-        node_datas = await asyncio.gather(
-            *[knowledge_graph_inst.get_node(r["entity_name"]) for r in entity_results]
-        )
-        if not all([n is not None for n in node_datas]):
-            logger.warning("Some nodes are missing, maybe the storage is damaged")
-        node_degrees = await asyncio.gather(
-            *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in entity_results]
-        )
-        node_datas = [
-            {**n, "entity_name": k["entity_name"], "rank": d}
-            for k, n, d in zip(entity_results, node_datas, node_degrees)
-            if n is not None
-        ]
-        entity_retrieved_segments = entity_retrieved_segments.union(await _find_most_related_segments_from_entities(
-            global_config["retrieval_topk_chunks"], node_datas, text_chunks_db, knowledge_graph_inst
-        ))
-    
-    # visual retrieval
-    query_for_visual_retrieval = await _refine_visual_retrieval_query(
-        query,
-        query_param,
-        global_config,
-    )
-    segment_results = await video_segment_feature_vdb.query(query_for_visual_retrieval)
-    visual_retrieved_segments = set()
-    if len(segment_results):
-        for n in segment_results:
-            visual_retrieved_segments.add(n['__id__'])
-    
-    # caption
-    retrieved_segments = list(entity_retrieved_segments.union(visual_retrieved_segments))
-    retrieved_segments = sorted(
-        retrieved_segments,
-        key=lambda x: (
-            '_'.join(x.split('_')[:-1]), # video_name
-            _safe_int(x.split('_')[-1]) # index
-        )
-    )
-    print(query_for_entity_retrieval)
-    print(f"Retrieved Text Segments {entity_retrieved_segments}")
-    print(query_for_visual_retrieval)
-    print(f"Retrieved Visual Segments {visual_retrieved_segments}")
-    
     already_processed = 0
-    async def _filter_single_segment(knowledge: str, segment_key_dp: tuple[str, str]):
-        nonlocal use_model_func, already_processed
-        segment_key = segment_key_dp[0]
-        segment_content = segment_key_dp[1]
-        filter_prompt = PROMPTS["filtering_segment"]
-        filter_prompt = filter_prompt.format(caption=segment_content, knowledge=knowledge)
-        result = await use_model_func(filter_prompt)
-        already_processed += 1
+    async def _filter_batch(batch: list[str]) -> list[str]:
+        nonlocal already_processed
+        if len(batch) == 1:
+            filter_prompt = PROMPTS["filtering_segment"].format(
+                caption=rough_captions[batch[0]], knowledge=query
+            )
+            result = await use_model_func(filter_prompt)
+            kept = batch if 'yes' in result.lower() else []
+        else:
+            captions = "\n\n".join(
+                f"[{i + 1}]\n{rough_captions[s_id]}" for i, s_id in enumerate(batch)
+            )
+            filter_prompt = PROMPTS["filtering_segment_batch"].format(captions=captions, knowledge=query)
+            result = await use_model_func(filter_prompt)
+            verdicts = {
+                int(number): answer.lower()
+                for number, answer in re.findall(r"\[?(\d+)\]?\s*[:：]\s*(yes|no)", result, re.IGNORECASE)
+            }
+            kept = [s_id for i, s_id in enumerate(batch) if verdicts.get(i + 1) == "yes"]
+        already_processed += len(batch)
         now_ticks = PROMPTS["process_tickers"][
             already_processed % len(PROMPTS["process_tickers"])
         ]
@@ -713,71 +809,68 @@ async def videorag_query(
             end="",
             flush=True,
         )
-        return (segment_key, result)
-    
-    rough_captions = {}
-    for s_id in retrieved_segments:
-        video_name = '_'.join(s_id.split('_')[:-1])
-        index = s_id.split('_')[-1]
-        rough_captions[s_id] = video_segments._data[video_name][index]["content"]
+        return kept
+
     results = await asyncio.gather(
-        *[_filter_single_segment(query, (s_id, rough_captions[s_id])) for s_id in rough_captions]
+        *[_filter_batch(candidates[i : i + batch_size]) for i in range(0, len(candidates), batch_size)]
     )
-    remain_segments = [x[0] for x in results if 'yes' in x[1].lower()]
-    print(f"{len(remain_segments)} Video Segments remain after filtering")
+    kept = set(s_id for batch in results for s_id in batch)
+    remain_segments = [s_id for s_id in candidates if s_id in kept]
+    print(f"{len(remain_segments)} of {len(candidates)} pre-ranked Video Segments remain after filtering")
     if len(remain_segments) == 0:
-        print("Since no segments remain after filtering, we utilized all the retrieved segments.")
-        remain_segments = retrieved_segments
-    print(f"Remain segments {remain_segments}")
-    
-    # visual retrieval
-    keywords_for_caption = await _extract_keywords_query(
-        query,
-        query_param,
-        global_config,
-    )
-    print(f"Keywords: {keywords_for_caption}")
-    caption_results = retrieved_segment_caption(
-        caption_model,
-        caption_tokenizer,
-        keywords_for_caption,
-        remain_segments,
-        video_path_db,
-        video_segments,
-        num_sampled_frames=global_config['fine_num_frames_per_segment']
-    )
+        print("Since no segments remain after filtering, we utilized the pre-ranked segments.")
+        remain_segments = candidates
+    return remain_segments
 
-    ## data table
-    text_units_section_list = [["video_name", "start_time", "end_time", "content"]]
-    for s_id in caption_results:
-        video_name = '_'.join(s_id.split('_')[:-1])
-        index = s_id.split('_')[-1]
-        start_time = _time_str_to_seconds(video_segments._data[video_name][index]["time"].split('-')[0])
-        end_time = _time_str_to_seconds(video_segments._data[video_name][index]["time"].split('-')[1])
-        start_time = f"{start_time // 3600}:{(start_time % 3600) // 60}:{start_time % 60}"
-        end_time = f"{end_time // 3600}:{(end_time % 3600) // 60}:{end_time % 60}"
-        text_units_section_list.append([video_name, start_time, end_time, caption_results[s_id]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
 
-    retreived_video_context = f"\n-----Retrieved Knowledge From Videos-----\n```csv\n{text_units_context}\n```\n"
-    
-    if query_param.wo_reference:
-        sys_prompt_temp = PROMPTS["videorag_response_wo_reference"]
-    else:
-        sys_prompt_temp = PROMPTS["videorag_response"]
-        
-    sys_prompt = sys_prompt_temp.format(
-        video_data=retreived_video_context,
-        chunk_data=retreived_chunk_context,
-        response_type=query_param.response_type
-    )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
-    return response
+async def _caption_segments(
+    caption_backend,
+    keywords: str,
+    segment_ids: list[str],
+    video_paths: dict,
+    segment_infos: dict,
+    global_config: dict,
+    fine_caption_cache: BaseKVStorage = None,
+) -> dict[str, str]:
+    """Fine-caption at most ``max_fine_caption_segments`` segments, reusing
+    captions cached for the same (segment, keywords, frames, caption backend)."""
+    limit = global_config.get("max_fine_caption_segments", 0)
+    if limit:
+        segment_ids = segment_ids[:limit]
+    num_frames = global_config['fine_num_frames_per_segment']
+    # 换用其他 caption backend / 模型时不复用旧模型的 caption
+    backend_tag = caption_backend.cache_tag if caption_backend is not None else ""
+    cache_keys = {
+        s_id: compute_mdhash_id(f"{s_id}|{num_frames}|{keywords}|{backend_tag}", prefix="fcap-")
+        for s_id in segment_ids
+    }
+    caption_results = {}
+    if fine_caption_cache is not None:
+        cached = await fine_caption_cache.get_by_ids([cache_keys[s_id] for s_id in segment_ids])
+        caption_results = {s_id: c["caption"] for s_id, c in zip(segment_ids, cached) if c is not None}
+    missing = [s_id for s_id in segment_ids if s_id not in caption_results]
+    if missing:
+        new_captions = retrieved_segment_caption(
+            caption_backend,
+            keywords,
+            missing,
+            video_paths,
+            segment_infos,
+            num_sampled_frames=num_frames,
+            max_open_videos=global_config.get("caption_max_open_videos", 2),
+        )
+        caption_results.update(new_captions)
+        if fine_caption_cache is not None:
+            await fine_caption_cache.upsert(
+                {cache_keys[s_id]: {"caption": caption} for s_id, caption in new_captions.items()}
+            )
+    print(f"Fine captioned {len(missing)} segments, {len(segment_ids) - len(missing)} from cache")
+    # 保持按视频与片段顺序输出
+    return {s_id: caption_results[s_id] for s_id in sorted(
+        caption_results, key=lambda x: ('_'.join(x.split('_')[:-1]), _safe_int(x.split('_')[-1]))
+    )}
 
-async def videorag_query_multiple_choice(
+async def build_retrieval_context(
     query,
     entities_vdb,
     text_chunks_db,
@@ -786,20 +879,21 @@ async def videorag_query_multiple_choice(
     video_segments,
     video_segment_feature_vdb,
     knowledge_graph_inst,
-    caption_model,
-    caption_tokenizer,
+    caption_backend,
     query_param: QueryParam,
     global_config: dict,
-) -> str:
-    """_summary_
-    A copy of the videorag_query function with several updates for handling multiple-choice queries.
+    fine_caption_cache: BaseKVStorage = None,
+    require_chunks: bool = False,
+) -> RetrievalContext:
+    """Run the retrieval half of videorag (chunk, entity and visual retrieval,
+    segment filtering, fine captioning) and return the prompt-ready context.
+
+    With ``require_chunks`` the pipeline stops right after an empty chunk
+    search and returns an incomplete context (``chunk_context is None``).
     """
-    use_model_func = global_config["llm"]["best_model_func"]
-    query = query
-    
     # naive chunks
-    results = await chunks_vdb.query(query, top_k=query_param.top_k)
-    # NOTE: I update here, not len results can also process
+    video_names = query_param.video_names or None
+    results = await chunks_vdb.query(query, top_k=query_param.top_k, video_names=video_names)
     if len(results):
         chunks_ids = [r["id"] for r in results]
         chunks = await text_chunks_db.get_by_ids(chunks_ids)
@@ -808,37 +902,40 @@ async def videorag_query_multiple_choice(
             chunks,
             key=lambda x: x["content"],
             max_token_size=query_param.naive_max_token_for_text_unit,
+            token_count=lambda x: x.get("tokens"),
         )
         logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
-        section = "-----New Chunk-----\n".join([c["content"] for c in maybe_trun_chunks])
-        retreived_chunk_context = section
+        retreived_chunk_context = "-----New Chunk-----\n".join([c["content"] for c in maybe_trun_chunks])
+    elif require_chunks:
+        return RetrievalContext(query=query, chunk_context=None, video_context=None)
     else:
-        retreived_chunk_context = "No Content"
-        
+        retreived_chunk_context = None
+
     # visual retrieval
     query_for_entity_retrieval = await _refine_entity_retrieval_query(
         query,
         query_param,
         global_config,
     )
-    entity_results = await entities_vdb.query(query_for_entity_retrieval, top_k=query_param.top_k)
+    entity_results = await entities_vdb.query(
+        query_for_entity_retrieval, top_k=query_param.top_k, video_names=video_names
+    )
     entity_retrieved_segments = set()
     if len(entity_results):
-        node_datas = await asyncio.gather(
-            *[knowledge_graph_inst.get_node(r["entity_name"]) for r in entity_results]
+        entity_names = [r["entity_name"] for r in entity_results]
+        node_datas, node_degrees = await asyncio.gather(
+            knowledge_graph_inst.get_nodes(entity_names),
+            knowledge_graph_inst.node_degrees(entity_names),
         )
         if not all([n is not None for n in node_datas]):
             logger.warning("Some nodes are missing, maybe the storage is damaged")
-        node_degrees = await asyncio.gather(
-            *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in entity_results]
-        )
         node_datas = [
             {**n, "entity_name": k["entity_name"], "rank": d}
             for k, n, d in zip(entity_results, node_datas, node_degrees)
             if n is not None
         ]
         entity_retrieved_segments = entity_retrieved_segments.union(await _find_most_related_segments_from_entities(
-            global_config["retrieval_topk_chunks"], node_datas, text_chunks_db, knowledge_graph_inst
+            global_config["retrieval_topk_chunks"], node_datas, text_chunks_db, knowledge_graph_inst, video_names
         ))
     
     # visual retrieval
@@ -847,7 +944,7 @@ async def videorag_query_multiple_choice(
         query_param,
         global_config,
     )
-    segment_results = await video_segment_feature_vdb.query(query_for_visual_retrieval)
+    segment_results = await video_segment_feature_vdb.query(query_for_visual_retrieval, video_names=video_names)
     visual_retrieved_segments = set()
     if len(segment_results):
         for n in segment_results:
@@ -867,38 +964,13 @@ async def videorag_query_multiple_choice(
     print(query_for_visual_retrieval)
     print(f"Retrieved Visual Segments {visual_retrieved_segments}")
     
-    already_processed = 0
-    async def _filter_single_segment(knowledge: str, segment_key_dp: tuple[str, str]):
-        nonlocal use_model_func, already_processed
-        segment_key = segment_key_dp[0]
-        segment_content = segment_key_dp[1]
-        filter_prompt = PROMPTS["filtering_segment"]
-        filter_prompt = filter_prompt.format(caption=segment_content, knowledge=knowledge)
-        result = await use_model_func(filter_prompt)
-        already_processed += 1
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
-        ]
-        print(
-            f"{now_ticks} Checked {already_processed} segments\r",
-            end="",
-            flush=True,
-        )
-        return (segment_key, result)
-    
-    rough_captions = {}
-    for s_id in retrieved_segments:
-        video_name = '_'.join(s_id.split('_')[:-1])
-        index = s_id.split('_')[-1]
-        rough_captions[s_id] = video_segments._data[video_name][index]["content"]
-    results = await asyncio.gather(
-        *[_filter_single_segment(query, (s_id, rough_captions[s_id])) for s_id in rough_captions]
+    segment_infos, video_paths = await _get_segment_infos(
+        retrieved_segments, video_segments, video_path_db
+    )
+    rough_captions = {s_id: segment_infos[s_id]["content"] for s_id in retrieved_segments}
+    remain_segments = await _filter_segments(
+        query, rough_captions, chunks_vdb.embedding_func if chunks_vdb is not None else None, global_config
     )
-    remain_segments = [x[0] for x in results if 'yes' in x[1].lower()]
-    print(f"{len(remain_segments)} Video Segments remain after filtering")
-    if len(remain_segments) == 0:
-        print("Since no segments remain after filtering, we utilized all the retrieved segments.")
-        remain_segments = retrieved_segments
     print(f"Remain segments {remain_segments}")
     
     # visual retrieval
@@ -908,14 +980,14 @@ async def videorag_query_multiple_choice(
         global_config,
     )
     print(f"Keywords: {keywords_for_caption}")
-    caption_results = retrieved_segment_caption(
-        caption_model,
-        caption_tokenizer,
+    caption_results = await _caption_segments(
+        caption_backend,
         keywords_for_caption,
         remain_segments,
-        video_path_db,
-        video_segments,
-        num_sampled_frames=global_config['fine_num_frames_per_segment']
+        video_paths,
+        segment_infos,
+        global_config,
+        fine_caption_cache,
     )
 
     ## data table
@@ -923,21 +995,65 @@ async def videorag_query_multiple_choice(
     for s_id in caption_results:
         video_name = '_'.join(s_id.split('_')[:-1])
         index = s_id.split('_')[-1]
-        start_time = _time_str_to_seconds(video_segments._data[video_name][index]["time"].split('-')[0])
-        end_time = _time_str_to_seconds(video_segments._data[video_name][index]["time"].split('-')[1])
+        start_time = _time_str_to_seconds(segment_infos[s_id]["time"].split('-')[0])
+        end_time = _time_str_to_seconds(segment_infos[s_id]["time"].split('-')[1])
         start_time = f"{start_time // 3600}:{(start_time % 3600) // 60}:{start_time % 60}"
         end_time = f"{end_time // 3600}:{(end_time % 3600) // 60}:{end_time % 60}"
         text_units_section_list.append([video_name, start_time, end_time, caption_results[s_id]])
     text_units_context = list_of_list_to_csv(text_units_section_list)
 
     retreived_video_context = f"\n-----Retrieved Knowledge From Videos-----\n```csv\n{text_units_context}\n```\n"
-    
+    return RetrievalContext(
+        query=query,
+        chunk_context=retreived_chunk_context,
+        video_context=retreived_video_context,
+        retrieved_segments=retrieved_segments,
+        caption_segments=list(caption_results),
+    )
+
+
+async def videorag_answer(
+    query,
+    retrieval_context: RetrievalContext,
+    query_param: QueryParam,
+    global_config: dict,
+) -> str:
+    """Free-form answer from an already built retrieval context."""
+    use_model_func = global_config["llm"]["best_model_func"]
+    if retrieval_context.chunk_context is None:
+        return PROMPTS["fail_response"]
+    if query_param.wo_reference:
+        sys_prompt_temp = PROMPTS["videorag_response_wo_reference"]
+    else:
+        sys_prompt_temp = PROMPTS["videorag_response"]
+        
+    sys_prompt = sys_prompt_temp.format(
+        video_data=retrieval_context.video_context,
+        chunk_data=retrieval_context.chunk_context,
+        response_type=query_param.response_type
+    )
+    response = await use_model_func(
+        query,
+        system_prompt=sys_prompt,
+    )
+    return response
+
+
+async def videorag_answer_multiple_choice(
+    query,
+    retrieval_context: RetrievalContext,
+    query_param: QueryParam,
+    global_config: dict,
+) -> dict:
+    """Multiple-choice answer (JSON with Answer/Explanation) from a retrieval context."""
+    use_model_func = global_config["llm"]["best_model_func"]
     # NOTE: I update here to use a different prompt
     sys_prompt_temp = PROMPTS["videorag_response_for_multiple_choice_question"]
         
     sys_prompt = sys_prompt_temp.format(
-        video_data=retreived_video_context,
-        chunk_data=retreived_chunk_context,
+        video_data=retrieval_context.video_context,
+        # NOTE: I update here, not len results can also process
+        chunk_data=retrieval_context.chunk_context or "No Content",
         response_type=query_param.response_type
     )
     response = await use_model_func(
@@ -957,4 +1073,74 @@ async def videorag_query_multiple_choice(
                 system_prompt=sys_prompt,
                 use_cache=False,
             )
-    
+
+
+async def videorag_query(
+    query,
+    entities_vdb,
+    text_chunks_db,
+    chunks_vdb,
+    video_path_db,
+    video_segments,
+    video_segment_feature_vdb,
+    knowledge_graph_inst,
+    caption_backend,
+    query_param: QueryParam,
+    global_config: dict,
+    fine_caption_cache: BaseKVStorage = None,
+    retrieval_context: RetrievalContext = None,
+) -> str:
+    if retrieval_context is None:
+        retrieval_context = await build_retrieval_context(
+            query,
+            entities_vdb,
+            text_chunks_db,
+            chunks_vdb,
+            video_path_db,
+            video_segments,
+            video_segment_feature_vdb,
+            knowledge_graph_inst,
+            caption_backend,
+            query_param,
+            global_config,
+            fine_caption_cache,
+            require_chunks=True,
+        )
+    return await videorag_answer(query, retrieval_context, query_param, global_config)
+
+
+async def videorag_query_multiple_choice(
+    query,
+    entities_vdb,
+    text_chunks_db,
+    chunks_vdb,
+    video_path_db,
+    video_segments,
+    video_segment_feature_vdb,
+    knowledge_graph_inst,
+    caption_backend,
+    query_param: QueryParam,
+    global_config: dict,
+    fine_caption_cache: BaseKVStorage = None,
+    retrieval_context: RetrievalContext = None,
+) -> dict:
+    """_summary_
+    videorag_query for multiple-choice questions: same retrieval, a different
+    response prompt and a JSON answer.
+    """
+    if retrieval_context is None:
+        retrieval_context = await build_retrieval_context(
+            query,
+            entities_vdb,
+            text_chunks_db,
+            chunks_vdb,
+            video_path_db,
+            video_segments,
+            video_segment_feature_vdb,
+            knowledge_graph_inst,
+            caption_backend,
+            query_param,
+            global_config,
+            fine_caption_cache,
+        )
+    return await videorag_answer_multiple_choice(query, retrieval_context, query_param, global_config)
@@ -10,6 +10,11 @@ class SeparatorSplitter:
         length_function: callable = len,
     ):
         self._separators = separators or []
+        # first token -> [(separator, remaining tokens)], in separator priority order
+        self._dispatch = {}
+        for separator in self._separators:
+            if separator:
+                self._dispatch.setdefault(separator[0], []).append((list(separator), list(separator[1:])))
         self._keep_separator = keep_separator
         self._chunk_size = chunk_size
         self._chunk_overlap = chunk_overlap
@@ -20,26 +25,34 @@ class SeparatorSplitter:
         return self._merge_splits(splits)
 
     def _split_tokens_with_separators(self, tokens: List[int]) -> List[List[int]]:
+        # 按分隔符首 token 分派，只在首 token 命中的位置比较其余部分，单次线性扫描
+        dispatch = self._dispatch
+        if not dispatch:
+            return [list(tokens)] if tokens else []
+        keep_end = self._keep_separator in [True, "end"]
+        keep_start = self._keep_separator == "start"
         splits = []
         current_split = []
-        i = 0
-        while i < len(tokens):
-            separator_found = False
-            for separator in self._separators:
-                if tokens[i:i+len(separator)] == separator:
-                    if self._keep_separator in [True, "end"]:
-                        current_split.extend(separator)
-                    if current_split:
-                        splits.append(current_split)
-                        current_split = []
-                    if self._keep_separator == "start":
-                        current_split.extend(separator)
-                    i += len(separator)
-                    separator_found = True
+        start = 0
+        for i in [i for i, token in enumerate(tokens) if token in dispatch]:
+            if i < start:
+                # 位于上一个分隔符内部
+                continue
+            for separator, tail in dispatch[tokens[i]]:
+                if not tail or tokens[i + 1 : i + 1 + len(tail)] == tail:
                     break
-            if not separator_found:
-                current_split.append(tokens[i])
-                i += 1
+            else:
+                continue
+            current_split.extend(tokens[start:i])
+            if keep_end:
+                current_split.extend(separator)
+            if current_split:
+                splits.append(current_split)
+                current_split = []
+            if keep_start:
+                current_split.extend(separator)
+            start = i + len(separator)
+        current_split.extend(tokens[start:])
         if current_split:
             splits.append(current_split)
         return [s for s in splits if s]
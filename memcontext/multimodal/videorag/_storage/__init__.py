@@ -3,3 +3,5 @@ from .gdb_neo4j import Neo4jStorage
 from .vdb_hnswlib import HNSWVectorStorage
 from .vdb_nanovectordb import NanoVectorDBStorage, NanoVectorDBVideoSegmentStorage
 from .kv_json import JsonKVStorage
+from .kv_log import AppendLogKVStorage
+from .kv_sqlite import SqliteKVStorage
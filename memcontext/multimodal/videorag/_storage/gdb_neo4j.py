@@ -117,6 +117,10 @@ class Neo4jStorage(BaseGraphStorage):
             )
             record = await result.single()
             raw_node_data = record["node_data"] if record else None
+        return self._format_node_data(raw_node_data)
+
+    @staticmethod
+    def _format_node_data(raw_node_data: Union[dict, None]) -> Union[dict, None]:
         if raw_node_data is None:
             return None
         raw_node_data["clusters"] = json.dumps(
@@ -132,6 +136,47 @@ class Neo4jStorage(BaseGraphStorage):
         )
         return raw_node_data
 
+    async def get_nodes(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"UNWIND $node_ids AS node_id "
+                f"MATCH (n:{self.namespace}) WHERE n.id = node_id "
+                "RETURN node_id, properties(n) AS node_data",
+                node_ids=list(node_ids),
+            )
+            found = {}
+            async for record in result:
+                found[record["node_id"]] = record["node_data"]
+        return [self._format_node_data(found.get(node_id)) for node_id in node_ids]
+
+    async def node_degrees(self, node_ids: list[str]) -> list[int]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"UNWIND $node_ids AS node_id "
+                f"MATCH (n:{self.namespace}) WHERE n.id = node_id "
+                f"RETURN node_id, COUNT {{(n)-[]-(:{self.namespace})}} AS degree",
+                node_ids=list(node_ids),
+            )
+            degrees = {}
+            async for record in result:
+                degrees[record["node_id"]] = record["degree"]
+        return [degrees.get(node_id, 0) for node_id in node_ids]
+
+    async def get_nodes_edges(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        async with self.async_driver.session() as session:
+            result = await session.run(
+                f"UNWIND $node_ids AS source_id "
+                f"MATCH (s:{self.namespace})-[r]->(t:{self.namespace}) WHERE s.id = source_id "
+                "RETURN s.id AS source, t.id AS target",
+                node_ids=list(node_ids),
+            )
+            edges = {node_id: [] for node_id in node_ids}
+            async for record in result:
+                edges[record["source"]].append((record["source"], record["target"]))
+        return [edges[node_id] for node_id in node_ids]
+
     async def get_edge(
         self, source_node_id: str, target_node_id: str
     ) -> Union[dict, None]:
@@ -313,6 +358,10 @@ class Neo4jStorage(BaseGraphStorage):
     async def index_done_callback(self):
         await self.async_driver.close()
 
+    async def index_checkpoint_callback(self):
+        # Neo4j 的写入已经落盘，这里不能关闭 driver
+        pass
+
     async def _debug_delete_all_node_edges(self):
         async with self.async_driver.session() as session:
             try:
@@ -1,6 +1,9 @@
 import html
 import json
 import os
+import pickle
+import re
+import uuid
 from collections import defaultdict
 from dataclasses import dataclass
 from typing import Any, Union, cast
@@ -77,15 +80,30 @@ class NetworkXStorage(BaseGraphStorage):
         return fixed_graph
 
     def __post_init__(self):
-        self._graphml_xml_file = os.path.join(
-            self.global_config["working_dir"], f"graph_{self.namespace}.graphml"
-        )
-        preloaded_graph = NetworkXStorage.load_nx_graph(self._graphml_xml_file)
-        if preloaded_graph is not None:
-            logger.info(
-                f"Loaded graph from {self._graphml_xml_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
-            )
-        self._graph = preloaded_graph or nx.Graph()
+        working_dir = self.global_config["working_dir"]
+        self._graphml_xml_file = os.path.join(working_dir, f"graph_{self.namespace}.graphml")
+        # 拓扑（节点 id + 边下标）和属性列分开存放，查询时只读拓扑就能算度数和邻居
+        self._working_dir = working_dir
+        self._topology_file = os.path.join(working_dir, f"graph_{self.namespace}.topology.pkl")
+        # 旧版本固定文件名的属性文件；新版本按 token 命名，由拓扑文件指向
+        self._attributes_file = os.path.join(working_dir, f"graph_{self.namespace}.attributes.pkl")
+        self._export_graphml = self.global_config.get("graph_export_graphml", False)
+        # 只有图被修改过才在 index_done_callback 中落盘
+        self._dirty = False
+        self._pending_attributes = None
+        # 实际加载过的属性文件，只有它被新文件取代后才能删除
+        self._loaded_attributes_file = None
+
+        self._graph = self._load_binary_graph()
+        if self._graph is None:
+            preloaded_graph = NetworkXStorage.load_nx_graph(self._graphml_xml_file)
+            if preloaded_graph is not None:
+                logger.info(
+                    f"Loaded graph from {self._graphml_xml_file} with {preloaded_graph.number_of_nodes()} nodes, {preloaded_graph.number_of_edges()} edges"
+                )
+                # 旧版本只有 graphml，下一次 index_done_callback 时转成二进制格式
+                self._dirty = True
+            self._graph = preloaded_graph or nx.Graph()
         self._clustering_algorithms = {
             "leiden": self._leiden_clustering,
         }
@@ -93,8 +111,118 @@ class NetworkXStorage(BaseGraphStorage):
             "node2vec": self._node2vec_embed,
         }
 
+    def _load_binary_graph(self) -> Union[nx.Graph, None]:
+        if not os.path.exists(self._topology_file):
+            return None
+        with open(self._topology_file, "rb") as f:
+            topology = pickle.load(f)
+        nodes = topology["nodes"]
+        graph = nx.Graph()
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from((nodes[src], nodes[tgt]) for src, tgt in topology["edges"])
+        attributes_file = topology.get("attributes_file")
+        attributes_file = os.path.join(self._working_dir, attributes_file) if attributes_file else self._attributes_file
+        # 属性在第一次被读写时才加载
+        self._pending_attributes = (topology["token"], attributes_file, nodes, topology["edges"])
+        logger.info(
+            f"Loaded graph from {self._topology_file} with {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges"
+        )
+        return graph
+
+    def _ensure_attributes(self):
+        if self._pending_attributes is None:
+            return
+        token, attributes_file, nodes, edges = self._pending_attributes
+        # 没有属性的图无法合并实体（缺 entity_type / source_id），宁可报错也不能继续使用或落盘
+        if not os.path.exists(attributes_file):
+            raise RuntimeError(f"{attributes_file} is missing, graph {self.namespace} cannot be loaded")
+        with open(attributes_file, "rb") as f:
+            attributes = pickle.load(f)
+        if attributes["token"] != token:
+            raise RuntimeError(
+                f"{attributes_file} does not belong to {self._topology_file}, "
+                f"the graph was not saved completely"
+            )
+        for key, values in attributes["nodes"].items():
+            for node_id, value in zip(nodes, values):
+                if value is not None:
+                    self._graph.nodes[node_id][key] = value
+        for key, values in attributes["edges"].items():
+            for (src, tgt), value in zip(edges, values):
+                if value is not None:
+                    self._graph.edges[nodes[src], nodes[tgt]][key] = value
+        self._pending_attributes = None
+        self._loaded_attributes_file = attributes_file
+
+    @staticmethod
+    def _columns(items: list[dict]) -> dict[str, list]:
+        columns = {}
+        for position, item in enumerate(items):
+            for key, value in item.items():
+                columns.setdefault(key, [None] * len(items))[position] = value
+        return columns
+
+    @staticmethod
+    def _dump(obj, file_name):
+        tmp_file = f"{file_name}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, file_name)
+
+    def _write_binary_graph(self):
+        self._ensure_attributes()
+        logger.info(
+            f"Writing graph with {self._graph.number_of_nodes()} nodes, {self._graph.number_of_edges()} edges"
+        )
+        nodes = list(self._graph.nodes)
+        node_index = {node_id: i for i, node_id in enumerate(nodes)}
+        edges = list(self._graph.edges(data=True))
+        edge_index = np.array(
+            [(node_index[src], node_index[tgt]) for src, tgt, _ in edges], dtype=np.int64
+        ).reshape(-1, 2)
+        token = uuid.uuid4().hex
+        # 属性写到按 token 命名的新文件，再原子替换指向它的拓扑文件：替换前旧拓扑仍指向完好的旧属性，
+        # 中途失败只会留下一个孤立的属性文件，下次保存时清理
+        attributes_name = f"graph_{self.namespace}.attributes.{token}.pkl"
+        NetworkXStorage._dump(
+            {
+                "token": token,
+                "nodes": NetworkXStorage._columns([data for _, data in self._graph.nodes(data=True)]),
+                "edges": NetworkXStorage._columns([data for _, _, data in edges]),
+            },
+            os.path.join(self._working_dir, attributes_name),
+        )
+        NetworkXStorage._dump(
+            {"token": token, "nodes": nodes, "edges": edge_index, "attributes_file": attributes_name},
+            self._topology_file,
+        )
+        self._remove_stale_attributes(attributes_name)
+
+    def _remove_stale_attributes(self, current_name):
+        # 只删除按 token 命名的旧文件（之前加载的或中断保存留下的孤立文件）；
+        # 旧版本固定文件名的属性文件只有在已经成功加载并迁移后才删除
+        pattern = re.compile(rf"graph_{re.escape(self.namespace)}\.attributes\.[0-9a-f]{{32}}\.pkl")
+        for file_name in os.listdir(self._working_dir):
+            if file_name != current_name and pattern.fullmatch(file_name):
+                os.remove(os.path.join(self._working_dir, file_name))
+        if self._loaded_attributes_file == self._attributes_file and os.path.exists(self._attributes_file):
+            os.remove(self._attributes_file)
+        self._loaded_attributes_file = os.path.join(self._working_dir, current_name)
+
+    def export_graphml(self, file_name: str = None) -> str:
+        """Write the graph as GraphML (for Gephi and other tools) and return the path."""
+        self._ensure_attributes()
+        file_name = file_name or self._graphml_xml_file
+        NetworkXStorage.write_nx_graph(self._graph, file_name)
+        return file_name
+
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        if not self._dirty:
+            return
+        self._write_binary_graph()
+        if self._export_graphml:
+            self.export_graphml()
+        self._dirty = False
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -103,6 +231,7 @@ class NetworkXStorage(BaseGraphStorage):
         return self._graph.has_edge(source_node_id, target_node_id)
 
     async def get_node(self, node_id: str) -> Union[dict, None]:
+        self._ensure_attributes()
         return self._graph.nodes.get(node_id)
 
     async def node_degree(self, node_id: str) -> int:
@@ -117,6 +246,7 @@ class NetworkXStorage(BaseGraphStorage):
     async def get_edge(
         self, source_node_id: str, target_node_id: str
     ) -> Union[dict, None]:
+        self._ensure_attributes()
         return self._graph.edges.get((source_node_id, target_node_id))
 
     async def get_node_edges(self, source_node_id: str):
@@ -124,12 +254,31 @@ class NetworkXStorage(BaseGraphStorage):
             return list(self._graph.edges(source_node_id))
         return None
 
+    async def get_nodes(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        self._ensure_attributes()
+        nodes = self._graph.nodes
+        return [nodes.get(node_id) for node_id in node_ids]
+
+    async def node_degrees(self, node_ids: list[str]) -> list[int]:
+        degrees = dict(self._graph.degree([n for n in node_ids if self._graph.has_node(n)]))
+        return [degrees.get(node_id, 0) for node_id in node_ids]
+
+    async def get_nodes_edges(self, node_ids: list[str]):
+        return [
+            list(self._graph.edges(node_id)) if self._graph.has_node(node_id) else None
+            for node_id in node_ids
+        ]
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
+        self._ensure_attributes()
+        self._dirty = True
         self._graph.add_node(node_id, **node_data)
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
+        self._ensure_attributes()
+        self._dirty = True
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
 
     async def clustering(self, algorithm: str):
@@ -151,6 +300,7 @@ class NetworkXStorage(BaseGraphStorage):
         )
         max_num_ids = 0
         levels = defaultdict(set)
+        self._ensure_attributes()
         for node_id, node_data in self._graph.nodes(data=True):
             if "clusters" not in node_data:
                 continue
@@ -194,12 +344,15 @@ class NetworkXStorage(BaseGraphStorage):
         return dict(results)
 
     def _cluster_data_to_subgraphs(self, cluster_data: dict[str, list[dict[str, str]]]):
+        self._ensure_attributes()
+        self._dirty = True
         for node_id, clusters in cluster_data.items():
             self._graph.nodes[node_id]["clusters"] = json.dumps(clusters)
 
     async def _leiden_clustering(self):
         from graspologic.partition import hierarchical_leiden
 
+        self._ensure_attributes()
         graph = NetworkXStorage.stable_largest_connected_component(self._graph)
         community_mapping = hierarchical_leiden(
             graph,
@@ -229,6 +382,7 @@ class NetworkXStorage(BaseGraphStorage):
     async def _node2vec_embed(self):
         from graspologic import embed
 
+        self._ensure_attributes()
         embeddings, nodes = embed.node2vec_embed(
             self._graph,
             **self.global_config["node2vec_params"],
@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .._utils import load_json, logger
+from ..base import (
+    BaseKVStorage,
+)
+
+# 所有实例共用一个 atexit hook；弱引用不会让实例常驻内存，退出时按创建顺序落盘
+_open_storages = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _flush_open_storages():
+    for storage in list(_open_storages.values()):
+        storage._flush()
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@dataclass
+class AppendLogKVStorage(BaseKVStorage):
+    """KV storage backed by an append-only JSON-lines log.
+
+    Upserts are kept in memory and appended to the log in batches, once
+    ``kv_log_flush_batch_size`` records are pending or ``kv_log_flush_interval``
+    seconds have passed since the last flush, and on ``index_done_callback``.
+    Each write is O(batch) instead of rewriting the whole file, which makes it
+    suitable for the LLM response cache that is hit by many concurrent calls.
+    """
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.jsonl")
+        self._flush_batch_size = self.global_config.get("kv_log_flush_batch_size", 64)
+        self._flush_interval = self.global_config.get("kv_log_flush_interval", 5.0)
+        self._lock = threading.RLock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._data = {}
+        self._load()
+        _open_storages[id(self)] = self
+        logger.info(f"Load KV {self.namespace} with {len(self._data)} data")
+
+    def _load(self):
+        if not os.path.exists(self._file_name):
+            # 兼容旧版本的 kv_store_{namespace}.json
+            legacy = load_json(os.path.join(os.path.dirname(self._file_name), f"kv_store_{self.namespace}.json"))
+            if legacy:
+                self._compact(initial=legacy)
+            return
+        with open(self._file_name, encoding="utf-8") as f:
+            lines = self._replay(f)
+        if lines > 1000 and lines > 2 * len(self._data):
+            self._compact()
+
+    def _replay(self, f) -> int:
+        lines = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程中断时最后一行可能没写完整
+                logger.warning(f"Skip a broken record in {self._file_name}")
+                continue
+            if record.get("drop"):
+                self._data = {}
+            elif record.get("del"):
+                self._data.pop(record["k"], None)
+            else:
+                self._data[record["k"]] = record["v"]
+            lines += 1
+        return lines
+
+    def _is_current(self, f) -> bool:
+        # 等锁期间日志可能已被其他进程压缩替换，此时打开的是旧 inode
+        return fcntl is None or os.fstat(f.fileno()).st_ino == os.stat(self._file_name).st_ino
+
+    def _compact(self, initial=None):
+        """Rewrite the log with one record per key, holding the same flock as
+        ``_append`` and replaying the log under it so concurrent appends are kept."""
+        while True:
+            with open(self._file_name, "a+", encoding="utf-8") as f:
+                _lock_file(f)
+                try:
+                    if not self._is_current(f):
+                        continue
+                    self._data = dict(initial or {})
+                    f.seek(0)
+                    self._replay(f)
+                    tmp_file = f"{self._file_name}.tmp"
+                    with open(tmp_file, "w", encoding="utf-8") as tmp:
+                        for k, v in self._data.items():
+                            tmp.write(json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n")
+                    os.replace(tmp_file, self._file_name)
+                    return
+                finally:
+                    _unlock_file(f)
+
+    def _append(self, lines: list[str]):
+        while True:
+            with open(self._file_name, "a", encoding="utf-8") as f:
+                # 多个进程共用同一个 working_dir 时避免行交错
+                _lock_file(f)
+                try:
+                    if not self._is_current(f):
+                        continue
+                    f.write("".join(lines))
+                    f.flush()
+                    return
+                finally:
+                    _unlock_file(f)
+
+    def _flush(self):
+        with self._lock:
+            if self._pending:
+                self._append(self._pending)
+                self._pending = []
+            self._last_flush = time.monotonic()
+
+    def __del__(self):
+        # 被回收的实例不会再被 atexit hook 看到，回收时把剩余记录写入
+        try:
+            self._flush()
+        except Exception:
+            pass
+
+    async def all_keys(self) -> list[str]:
+        return list(self._data.keys())
+
+    async def index_done_callback(self):
+        self._flush()
+
+    async def get_by_id(self, id):
+        return self._data.get(id, None)
+
+    async def get_by_ids(self, ids, fields=None):
+        if fields is None:
+            return [self._data.get(id, None) for id in ids]
+        return [
+            (
+                {k: v for k, v in self._data[id].items() if k in fields}
+                if self._data.get(id, None)
+                else None
+            )
+            for id in ids
+        ]
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        return set([s for s in data if s not in self._data])
+
+    async def upsert(self, data: dict[str, dict]):
+        with self._lock:
+            self._data.update(data)
+            self._pending.extend(
+                json.dumps({"k": k, "v": v}, ensure_ascii=False) + "\n" for k, v in data.items()
+            )
+            if (
+                len(self._pending) >= self._flush_batch_size
+                or time.monotonic() - self._last_flush >= self._flush_interval
+            ):
+                self._flush()
+
+    async def delete(self, ids: list[str]):
+        with self._lock:
+            for id in ids:
+                self._data.pop(id, None)
+            self._pending.extend(json.dumps({"k": id, "del": True}, ensure_ascii=False) + "\n" for id in ids)
+
+    async def drop(self):
+        with self._lock:
+            self._data = {}
+            self._pending.append(json.dumps({"drop": True}) + "\n")
+            self._flush()
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+from .._utils import load_json, logger
+from ..base import (
+    BaseKVStorage,
+)
+
+# SQLite 默认最多 999 个绑定参数
+_MAX_VARIABLES = 900
+
+_PROJECT_SQL = """
+SELECT kv.id, json_group_object(j.key, CASE
+    WHEN j.type IN ('true', 'false') THEN json(j.type)
+    WHEN j.type IN ('object', 'array') THEN json(j.value)
+    ELSE j.value END) FILTER (WHERE j.key IS NOT NULL)
+FROM kv LEFT JOIN json_each(kv.value) j ON j.key IN ({fields})
+WHERE kv.id IN ({ids}) GROUP BY kv.id
+"""
+
+
+def _project(value, fields):
+    if not value:
+        return None
+    if not isinstance(value, dict):
+        return {}
+    return {k: v for k, v in value.items() if k in fields}
+
+
+@dataclass
+class SqliteKVStorage(BaseKVStorage):
+    """Disk-backed KV storage in ``kv_store_{namespace}.sqlite``.
+
+    Values are read on demand instead of being kept in memory, upserts are
+    buffered and written in one transaction per ``kv_sqlite_batch_size``
+    records (or on ``index_done_callback``), and ``get_by_ids(fields=...)``
+    projects top-level keys inside SQLite so large values are not decoded.
+    """
+
+    def __post_init__(self):
+        working_dir = self.global_config["working_dir"]
+        self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.sqlite")
+        self._batch_size = self.global_config.get("kv_sqlite_batch_size", 256)
+        self._lock = threading.RLock()
+        self._pending = {}
+        is_new = not os.path.exists(self._file_name)
+        self._conn = sqlite3.connect(self._file_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (id TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        try:
+            self._conn.execute("SELECT json_each.key FROM json_each('{}')")
+            self._json1 = True
+        except sqlite3.OperationalError:
+            self._json1 = False
+        if is_new:
+            # 从 JsonKVStorage 的文件迁移
+            legacy = load_json(os.path.join(working_dir, f"kv_store_{self.namespace}.json"))
+            if legacy:
+                self._pending.update(legacy)
+                self._flush()
+        count = self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        logger.info(f"Load KV {self.namespace} with {count} data")
+
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [(k, json.dumps(v, ensure_ascii=False)) for k, v in self._pending.items()]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO kv (id, value) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET value = excluded.value",
+                    rows,
+                )
+            self._pending = {}
+
+    def _select(self, ids: list[str], fields=None) -> dict:
+        found = {}
+        for i in range(0, len(ids), _MAX_VARIABLES):
+            batch = ids[i : i + _MAX_VARIABLES]
+            id_marks = ",".join("?" * len(batch))
+            if fields is not None and self._json1:
+                field_list = list(fields)
+                sql = _PROJECT_SQL.format(fields=",".join("?" * len(field_list)), ids=id_marks)
+                rows = self._conn.execute(sql, [*field_list, *batch])
+            else:
+                rows = self._conn.execute(f"SELECT id, value FROM kv WHERE id IN ({id_marks})", batch)
+            found.update((k, json.loads(v)) for k, v in rows)
+        if fields is not None and not self._json1:
+            found = {k: _project(v, fields) for k, v in found.items()}
+        return found
+
+    async def all_keys(self) -> list[str]:
+        with self._lock:
+            keys = dict.fromkeys(row[0] for row in self._conn.execute("SELECT id FROM kv"))
+            keys.update(dict.fromkeys(self._pending))
+            return list(keys)
+
+    async def index_done_callback(self):
+        self._flush()
+
+    async def get_by_id(self, id):
+        return (await self.get_by_ids([id]))[0]
+
+    async def get_by_ids(self, ids, fields=None):
+        with self._lock:
+            pending = {id: self._pending[id] for id in ids if id in self._pending}
+            stored = self._select([id for id in dict.fromkeys(ids) if id not in pending], fields)
+        if fields is not None:
+            pending = {k: _project(v, fields) for k, v in pending.items()}
+        stored.update(pending)
+        return [stored.get(id, None) for id in ids]
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        with self._lock:
+            missing = set(data) - set(self._pending)
+            candidates = list(missing)
+            for i in range(0, len(candidates), _MAX_VARIABLES):
+                batch = candidates[i : i + _MAX_VARIABLES]
+                rows = self._conn.execute(
+                    f"SELECT id FROM kv WHERE id IN ({','.join('?' * len(batch))})", batch
+                )
+                missing.difference_update(row[0] for row in rows)
+        return missing
+
+    async def upsert(self, data: dict[str, dict]):
+        with self._lock:
+            self._pending.update(data)
+            if len(self._pending) >= self._batch_size:
+                self._flush()
+
+    async def delete(self, ids: list[str]):
+        with self._lock:
+            for id in ids:
+                self._pending.pop(id, None)
+            with self._conn:
+                for i in range(0, len(ids), _MAX_VARIABLES):
+                    batch = ids[i : i + _MAX_VARIABLES]
+                    self._conn.execute(f"DELETE FROM kv WHERE id IN ({','.join('?' * len(batch))})", batch)
+
+    async def drop(self):
+        with self._lock:
+            self._pending = {}
+            with self._conn:
+                self._conn.execute("DELETE FROM kv")
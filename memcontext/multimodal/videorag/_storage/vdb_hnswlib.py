@@ -1,35 +1,60 @@
 import asyncio
+import json
 import os
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Union
 import pickle
 import hnswlib
 import numpy as np
 import xxhash
 
-from .._utils import logger
+from .._utils import logger, load_json, write_json
 from ..base import BaseVectorStorage
 
+# 64 位哈希冲突时最多重新探测的次数
+_MAX_LABEL_PROBES = 16
+
 
 @dataclass
 class HNSWVectorStorage(BaseVectorStorage):
+    """hnswlib index with on-disk, memory-mapped metadata.
+
+    Keys are mapped to 64-bit xxh64 labels; a collision (different key, same
+    label) is detected against the stored ``id`` and resolved by re-hashing with
+    another seed, recorded in ``{namespace}_hnsw_aliases.json``. The index grows
+    automatically, ``delete`` marks labels as deleted, and ``query`` can be
+    restricted to the elements whose ``video_names`` intersect the given ones.
+
+    Metadata is kept in ``{namespace}_hnsw_metadata.jsonl`` (one
+    ``label<TAB>json`` line per element) with sorted labels and line offsets in
+    ``.npy`` files that are opened with ``mmap_mode="r"``; only the records of
+    returned neighbours are decoded. Records upserted since the last save live
+    in memory until ``index_done_callback``, which appends them to the records
+    file; the file is only rewritten once it holds more stale lines than live
+    ones.
+    """
+
     ef_construction: int = 100
     M: int = 16
-    max_elements: int = 1000000
+    max_elements: int = 10000
     ef_search: int = 50
     num_threads: int = -1
+    filter_brute_force_threshold: int = 2048
+    cosine_better_than_threshold: float = 0.2
     _index: Any = field(init=False)
-    _metadata: dict[str, dict] = field(default_factory=dict)
-    _current_elements: int = 0
+    _metadata: dict[int, dict] = field(default_factory=dict)
 
     def __post_init__(self):
-        self._index_file_name = os.path.join(
-            self.global_config["working_dir"], f"{self.namespace}_hnsw.index"
-        )
-        self._metadata_file_name = os.path.join(
-            self.global_config["working_dir"], f"{self.namespace}_hnsw_metadata.pkl"
-        )
-        self._embedding_batch_num = self.global_config.get("embedding_batch_num", 100)
+        working_dir = self.global_config["working_dir"]
+        self._index_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw.index")
+        self._records_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_metadata.jsonl")
+        self._labels_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_labels.npy")
+        self._offsets_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_offsets.npy")
+        self._videos_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_videos.pkl")
+        self._aliases_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_aliases.json")
+        self._records_state_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_records_state.json")
+        legacy_metadata_file_name = os.path.join(working_dir, f"{self.namespace}_hnsw_metadata.pkl")
+        self._embedding_batch_num = self.global_config["llm"]["embedding_batch_num"]
 
         hnsw_params = self.global_config.get("vector_db_storage_cls_kwargs", {})
         self.ef_construction = hnsw_params.get("ef_construction", self.ef_construction)
@@ -37,31 +62,149 @@ class HNSWVectorStorage(BaseVectorStorage):
         self.max_elements = hnsw_params.get("max_elements", self.max_elements)
         self.ef_search = hnsw_params.get("ef_search", self.ef_search)
         self.num_threads = hnsw_params.get("num_threads", self.num_threads)
-        self._index = hnswlib.Index(
-            space="cosine", dim=self.embedding_func.embedding_dim
+        self.filter_brute_force_threshold = hnsw_params.get(
+            "filter_brute_force_threshold", self.filter_brute_force_threshold
         )
+        self.cosine_better_than_threshold = self.global_config.get(
+            "query_better_than_threshold", self.cosine_better_than_threshold
+        )
+        self._index = hnswlib.Index(space="cosine", dim=self.embedding_func.embedding_dim)
 
-        if os.path.exists(self._index_file_name) and os.path.exists(
-            self._metadata_file_name
-        ):
-            self._index.load_index(
-                self._index_file_name, max_elements=self.max_elements
-            )
-            with open(self._metadata_file_name, "rb") as f:
-                self._metadata, self._current_elements = pickle.load(f)
-            logger.info(
-                f"Loaded existing index for {self.namespace} with {self._current_elements} elements"
-            )
+        self._metadata = {}  # label -> record, upserted since the last save
+        self._deleted = set()  # labels on disk deleted since the last save
+        self._aliases = load_json(self._aliases_file_name) or {}
+        self._video_labels: dict[str, set[int]] = {}
+        self._disk_labels = np.zeros(0, dtype=np.uint64)
+        self._disk_offsets = np.zeros(0, dtype=np.int64)
+        self._records_file = None
+        # 记录文件中已被覆盖或删除的行数（追加写入后留下的旧行）
+        self._stale_records = 0
+        self._dirty = False
+
+        if os.path.exists(self._index_file_name) and os.path.exists(self._labels_file_name):
+            self._index.load_index(self._index_file_name, max_elements=self.max_elements)
+            self._open_records()
+            with open(self._videos_file_name, "rb") as f:
+                self._video_labels = {k: set(v.tolist()) for k, v in pickle.load(f).items()}
+            self._live_count = len(self._disk_labels)
+            self._stale_records = (load_json(self._records_state_file_name) or {}).get("stale_records", 0)
+            logger.info(f"Loaded existing index for {self.namespace} with {self._live_count} elements")
+        elif os.path.exists(self._index_file_name) and os.path.exists(legacy_metadata_file_name):
+            self._migrate_legacy_index(legacy_metadata_file_name)
         else:
-            self._index.init_index(
-                max_elements=self.max_elements,
-                ef_construction=self.ef_construction,
-                M=self.M,
-            )
-            self._index.set_ef(self.ef_search)
-            self._metadata = {}
-            self._current_elements = 0
+            self._init_index(self.max_elements)
+            self._live_count = 0
             logger.info(f"Created new index for {self.namespace}")
+        self._index.set_ef(self.ef_search)
+
+    def _init_index(self, max_elements):
+        self._index.init_index(
+            max_elements=max_elements,
+            ef_construction=self.ef_construction,
+            M=self.M,
+        )
+
+    def _migrate_legacy_index(self, legacy_metadata_file_name):
+        # 旧版本使用 32 位 xxh32 label + pickle 元数据，取回向量后按 64 位 label 重建
+        legacy_index = hnswlib.Index(space="cosine", dim=self.embedding_func.embedding_dim)
+        legacy_index.load_index(self._index_file_name)
+        with open(legacy_metadata_file_name, "rb") as f:
+            legacy_metadata, _ = pickle.load(f)
+        legacy_labels = [label for label in legacy_metadata]
+        self._init_index(max(self.max_elements, len(legacy_labels)))
+        self._live_count = 0
+        if legacy_labels:
+            vectors = np.asarray(legacy_index.get_items(legacy_labels), dtype=np.float32)
+            records = [legacy_metadata[label] for label in legacy_labels]
+            labels, _ = self._assign_labels([r["id"] for r in records])
+            self._index.add_items(data=vectors, ids=labels, num_threads=self.num_threads)
+            for label, record in zip(labels.tolist(), records):
+                self._put_record(label, record)
+            self._live_count = len(records)
+        self._dirty = True
+        logger.info(f"Migrated legacy index for {self.namespace} with {self._live_count} elements")
+
+    def _open_records(self):
+        if self._records_file is not None:
+            self._records_file.close()
+        self._disk_labels = np.load(self._labels_file_name, mmap_mode="r")
+        self._disk_offsets = np.load(self._offsets_file_name, mmap_mode="r")
+        self._records_file = open(self._records_file_name, "rb")
+
+    def _disk_position(self, label: int) -> Union[int, None]:
+        position = int(np.searchsorted(self._disk_labels, np.uint64(label)))
+        if position < len(self._disk_labels) and int(self._disk_labels[position]) == label:
+            return position
+        return None
+
+    def _get_record(self, label: int) -> Union[dict, None]:
+        if label in self._metadata:
+            return self._metadata[label]
+        if label in self._deleted:
+            return None
+        position = self._disk_position(label)
+        if position is None:
+            return None
+        self._records_file.seek(int(self._disk_offsets[position]))
+        return json.loads(self._records_file.readline().split(b"\t", 1)[1])
+
+    def _has_label(self, label: int) -> bool:
+        return self._get_record(label) is not None
+
+    def _label_for(self, key: str, allocate: bool) -> Union[int, None]:
+        if key in self._aliases:
+            return self._aliases[key]
+        for seed in range(_MAX_LABEL_PROBES):
+            label = xxhash.xxh64_intdigest(key.encode(), seed=seed)
+            record = self._get_record(label)
+            if record is None:
+                if not allocate:
+                    return None
+                if seed:
+                    logger.warning(f"Label collision for {key} in {self.namespace}, re-hashed with seed {seed}")
+                    self._aliases[key] = label
+                return label
+            if record["id"] == key:
+                return label
+            if not allocate and seed == 0:
+                # 冲突的 key 一定记录在 aliases 中
+                return None
+        raise RuntimeError(f"Could not find a free label for {key} after {_MAX_LABEL_PROBES} probes")
+
+    def _assign_labels(self, keys: list[str]) -> tuple[np.ndarray, list[int]]:
+        """Labels for ``keys`` and the newly allocated ones among them."""
+        labels, new_labels = [], []
+        for key in keys:
+            label = self._label_for(key, allocate=True)
+            # 占位，避免同一批内的 key 互相冲突时拿到相同 label
+            if not self._has_label(label):
+                self._metadata[label] = {"id": key}
+                new_labels.append(label)
+            labels.append(label)
+        return np.array(labels, dtype=np.uint64), new_labels
+
+    def _unindex_videos(self, label: int, record: Union[dict, None]):
+        for video_name in (record or {}).get("video_names", []):
+            labels = self._video_labels.get(video_name)
+            if labels is not None:
+                labels.discard(label)
+                if not labels:
+                    del self._video_labels[video_name]
+
+    def _put_record(self, label: int, record: dict):
+        self._unindex_videos(label, self._get_record(label))
+        self._metadata[label] = record
+        self._deleted.discard(label)
+        for video_name in record.get("video_names", []):
+            self._video_labels.setdefault(video_name, set()).add(label)
+
+    def _ensure_capacity(self, extra: int):
+        needed = self._index.get_current_count() + extra
+        capacity = self._index.get_max_elements()
+        if needed > capacity:
+            new_capacity = max(needed, capacity * 2)
+            logger.info(f"Resizing {self.namespace} index from {capacity} to {new_capacity} elements")
+            self._index.resize_index(new_capacity)
 
     async def upsert(self, data: dict[str, dict]) -> np.ndarray:
         logger.info(f"Inserting {len(data)} vectors to {self.namespace}")
@@ -69,15 +212,11 @@ class HNSWVectorStorage(BaseVectorStorage):
             logger.warning("You insert an empty data to vector DB")
             return []
 
-        if self._current_elements + len(data) > self.max_elements:
-            raise ValueError(
-                f"Cannot insert {len(data)} elements. Current: {self._current_elements}, Max: {self.max_elements}"
-            )
-
-        list_data = [
+        records = [
             {
                 "id": k,
                 **{k1: v1 for k1, v1 in v.items() if k1 in self.meta_fields},
+                **({"video_names": sorted(set(v["video_names"]))} if v.get("video_names") else {}),
             }
             for k, v in data.items()
         ]
@@ -92,50 +231,161 @@ class HNSWVectorStorage(BaseVectorStorage):
             )
         )
 
-        ids = np.fromiter(
-            (xxhash.xxh32_intdigest(d["id"].encode()) for d in list_data),
-            dtype=np.uint32,
-            count=len(list_data),
-        )
-        self._metadata.update(
-            {
-                id_int: {
-                    k: v for k, v in d.items() if k in self.meta_fields or k == "id"
-                }
-                for id_int, d in zip(ids, list_data)
-            }
-        )
-        self._index.add_items(data=embeddings, ids=ids, num_threads=self.num_threads)
-        self._current_elements = self._index.get_current_count()
+        aliases = dict(self._aliases)
+        ids, new_labels = self._assign_labels(list(data.keys()))
+        try:
+            self._ensure_capacity(len(new_labels))
+            self._index.add_items(data=embeddings, ids=ids, num_threads=self.num_threads)
+        except Exception:
+            # 回滚占位记录和新分配的别名，否则重试时这些 key 会被当作已存在，_live_count 和扩容都会少算
+            for label in new_labels:
+                self._metadata.pop(label, None)
+                try:
+                    self._index.mark_deleted(label)
+                except RuntimeError:
+                    pass
+            self._aliases = aliases
+            raise
+        for label, record in zip(ids.tolist(), records):
+            self._put_record(label, record)
+        self._live_count += len(new_labels)
+        self._dirty = True
         return ids
 
-    async def query(self, query: str, top_k: int = 5) -> list[dict]:
-        if self._current_elements == 0:
+    async def delete(self, ids: list[str]):
+        for key in ids:
+            label = self._label_for(key, allocate=False)
+            if label is None:
+                continue
+            record = self._get_record(label)
+            self._index.mark_deleted(label)
+            self._unindex_videos(label, record)
+            self._metadata.pop(label, None)
+            if self._disk_position(label) is not None:
+                self._deleted.add(label)
+            self._aliases.pop(key, None)
+            self._live_count -= 1
+            self._dirty = True
+
+    def _allowed_labels(self, video_names) -> Union[set[int], None]:
+        if not video_names:
+            return None
+        allowed = set()
+        for video_name in video_names:
+            allowed |= self._video_labels.get(video_name, set())
+        return allowed
+
+    def _exact_query(self, embedding: np.ndarray, labels: list[int], top_k: int):
+        # 候选很少时直接精确计算，hnswlib 的过滤搜索在候选稀疏时可能凑不满 top_k
+        vectors = np.asarray(self._index.get_items(labels), dtype=np.float32)
+        query = embedding / (np.linalg.norm(embedding) or 1.0)
+        distances = 1 - vectors @ query
+        order = np.argsort(distances)[:top_k]
+        return [labels[i] for i in order], distances[order]
+
+    async def query(self, query: str, top_k: int = 5, video_names: list[str] = None) -> list[dict]:
+        allowed = self._allowed_labels(video_names)
+        candidates = self._live_count if allowed is None else len(allowed)
+        if candidates == 0:
             return []
+        top_k = min(top_k, candidates)
 
-        top_k = min(top_k, self._current_elements)
+        embedding = (await self.embedding_func([query]))[0]
+        if allowed is not None and len(allowed) <= self.filter_brute_force_threshold:
+            labels, distances = self._exact_query(embedding, list(allowed), top_k)
+        else:
+            self._index.set_ef(max(self.ef_search, top_k))
+            try:
+                labels, distances = self._index.knn_query(
+                    data=embedding,
+                    k=top_k,
+                    num_threads=self.num_threads,
+                    filter=None if allowed is None else allowed.__contains__,
+                )
+                labels, distances = labels[0].tolist(), distances[0]
+            except RuntimeError:
+                if allowed is None:
+                    raise
+                labels, distances = self._exact_query(embedding, list(allowed), top_k)
 
-        if top_k > self.ef_search:
-            logger.warning(
-                f"Setting ef_search to {top_k} because top_k is larger than ef_search"
+        results = []
+        for label, distance in zip(labels, distances):
+            similarity = 1 - float(distance)
+            if similarity < self.cosine_better_than_threshold:
+                continue
+            results.append(
+                {
+                    **(self._get_record(int(label)) or {}),
+                    "distance": float(distance),
+                    "similarity": similarity,
+                }
             )
-            self._index.set_ef(top_k)
+        return results
 
-        embedding = await self.embedding_func([query])
-        labels, distances = self._index.knn_query(
-            data=embedding[0], k=top_k, num_threads=self.num_threads
-        )
+    def _write_record_line(self, out, label: int, record: dict) -> int:
+        offset = out.tell()
+        out.write(f"{label}\t{json.dumps(record, ensure_ascii=False)}\n".encode("utf-8"))
+        return offset
 
-        return [
-            {
-                **self._metadata.get(label, {}),
-                "distance": distance,
-                "similarity": 1 - distance,
-            }
-            for label, distance in zip(labels[0], distances[0])
-        ]
+    def _write_records(self):
+        # 改动或删除的记录在磁盘上的旧行作废，新记录追加到文件末尾
+        keep = np.ones(len(self._disk_labels), dtype=bool)
+        replaced = [self._disk_position(label) for label in [*self._deleted, *self._metadata]]
+        replaced = [position for position in replaced if position is not None]
+        keep[replaced] = False
+        kept_labels = np.asarray(self._disk_labels[keep])
+        kept_offsets = np.asarray(self._disk_offsets[keep])
+        stale_records = self._stale_records + len(replaced)
+        new_labels, new_offsets = [], []
+
+        if stale_records > len(kept_labels) + len(self._metadata):
+            # 作废行多于有效行时整体重写，按偏移顺序拷贝有效行，不做 JSON 解码
+            tmp_records = f"{self._records_file_name}.tmp"
+            with open(tmp_records, "wb") as out:
+                order = np.argsort(kept_offsets)
+                copied_offsets = np.zeros(len(kept_offsets), dtype=np.int64)
+                for i in order.tolist():
+                    self._records_file.seek(int(kept_offsets[i]))
+                    copied_offsets[i] = out.tell()
+                    out.write(self._records_file.readline())
+                kept_offsets = copied_offsets
+                for label, record in self._metadata.items():
+                    new_labels.append(label)
+                    new_offsets.append(self._write_record_line(out, label, record))
+            os.replace(tmp_records, self._records_file_name)
+            stale_records = 0
+        else:
+            with open(self._records_file_name, "ab") as out:
+                for label, record in self._metadata.items():
+                    new_labels.append(label)
+                    new_offsets.append(self._write_record_line(out, label, record))
+
+        labels = np.concatenate([kept_labels, np.array(new_labels, dtype=np.uint64)])
+        offsets = np.concatenate([kept_offsets, np.array(new_offsets, dtype=np.int64)])
+        order = np.argsort(labels)
+        # np.save 会自动补 .npy 后缀，临时文件名需以 .npy 结尾
+        for file_name, array in [(self._labels_file_name, labels[order]), (self._offsets_file_name, offsets[order])]:
+            tmp_file = f"{file_name[:-4]}.tmp.npy"
+            np.save(tmp_file, array)
+            os.replace(tmp_file, file_name)
+        self._stale_records = stale_records
+        write_json({"stale_records": stale_records}, self._records_state_file_name)
 
     async def index_done_callback(self):
-        self._index.save_index(self._index_file_name)
-        with open(self._metadata_file_name, "wb") as f:
-            pickle.dump((self._metadata, self._current_elements), f)
+        if not self._dirty:
+            return
+        tmp_index = f"{self._index_file_name}.tmp"
+        self._index.save_index(tmp_index)
+        os.replace(tmp_index, self._index_file_name)
+        self._write_records()
+        with open(self._videos_file_name, "wb") as f:
+            pickle.dump(
+                {k: np.fromiter(v, dtype=np.uint64, count=len(v)) for k, v in self._video_labels.items()},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        write_json(self._aliases, self._aliases_file_name)
+        self._metadata = {}
+        self._deleted = set()
+        self._open_records()
+        self._dirty = False
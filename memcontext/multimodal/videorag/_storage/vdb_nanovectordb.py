@@ -1,15 +1,16 @@
 import asyncio
+import base64
 import os
 import torch
+from collections import OrderedDict
 from dataclasses import dataclass
 import numpy as np
 from nano_vectordb import NanoVectorDB
 from tqdm import tqdm
-from imagebind.models import imagebind_model
 
-from .._utils import logger
+from .._utils import logger, compute_mdhash_id, load_json, write_json
 from ..base import BaseVectorStorage
-from .._videoutil import encode_video_segments, encode_string_query
+from .._videoutil import encode_video_segments, encode_video_ranges, encode_string_query, get_imagebind_embedder, resolve_imagebind_model_path, segment_cache_dir
 
 
 @dataclass
@@ -38,6 +39,7 @@ class NanoVectorDBStorage(BaseVectorStorage):
             {
                 "__id__": k,
                 **{k1: v1 for k1, v1 in v.items() if k1 in self.meta_fields},
+                **({"video_names": sorted(set(v["video_names"]))} if v.get("video_names") else {}),
             }
             for k, v in data.items()
         ]
@@ -55,19 +57,28 @@ class NanoVectorDBStorage(BaseVectorStorage):
         results = self._client.upsert(datas=list_data)
         return results
 
-    async def query(self, query: str, top_k=5):
+    async def query(self, query: str, top_k=5, video_names: list[str] = None):
         embedding = await self.embedding_func([query])
         embedding = embedding[0]
+        # NanoVectorDB 先按 filter_lambda 取出子矩阵再计算相似度
+        filter_lambda = None
+        if video_names:
+            video_names = set(video_names)
+            filter_lambda = lambda dp: not video_names.isdisjoint(dp.get("video_names", ()))
         results = self._client.query(
             query=embedding,
             top_k=top_k,
             better_than_threshold=self.cosine_better_than_threshold,
+            filter_lambda=filter_lambda,
         )
         results = [
             {**dp, "id": dp["__id__"], "distance": dp["__metrics__"]} for dp in results
         ]
         return results
 
+    async def delete(self, ids: list[str]):
+        self._client.delete(ids)
+
     async def index_done_callback(self):
         self._client.save()
 
@@ -89,24 +100,37 @@ class NanoVectorDBVideoSegmentStorage(BaseVectorStorage):
         self.top_k = self.global_config.get(
             "segment_retrieval_top_k", self.segment_retrieval_top_k
         )
+        # refined query -> ImageBind text embedding (LRU)
+        self._query_cache_file = os.path.join(
+            self.global_config["working_dir"], f"vdb_{self.namespace}_query_cache.json"
+        )
+        self._query_cache_size = self.global_config.get("query_embedding_cache_size", 1024)
+        self._query_cache = OrderedDict()
+        self._query_cache_dirty = False
+        self._query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "precomputed": 0}
+        self._load_query_cache()
+
+    def _get_embedder(self):
+        # 进程内共享同一个常驻的 ImageBind 模型，只在首次使用时加载
+        return get_imagebind_embedder(
+            self.global_config.get("imagebind_model_path"),
+            device=self.global_config.get("imagebind_device", "auto"),
+            dtype=self.global_config.get("imagebind_dtype", "fp32"),
+        )
     
-    async def upsert(self, video_name, segment_index2name, video_output_format):
-        # 使用本地模型文件，不重新下载
-        model_path = "/root/models/imagebind_huge.pth"
-        device = torch.device("cuda")
-        embedder = imagebind_model.imagebind_huge(pretrained=False)
-        state_dict = torch.load(model_path, map_location=device)
-        embedder.load_state_dict(state_dict)
-        embedder.to(device)
-        embedder.eval()
-        
+    async def upsert(self, video_name, segment_index2name, video_output_format, video_path=None, segment_times_info=None):
+        """Embed the segments of one video.
+
+        Segment files are read from the video's segment directory; when they
+        were not materialised (segment_export_mode "none") and ``video_path`` /
+        ``segment_times_info`` are given, clips are decoded from the original.
+        """
         logger.info(f"Inserting {len(segment_index2name)} segments to {self.namespace}")
         if not len(segment_index2name):
             logger.warning("You insert an empty data to vector DB")
             return []
         list_data, video_paths = [], []
-        # 使用 working_dir/segments 目录（与 FileStorageManager 兼容）
-        cache_path = os.path.join(self.global_config["working_dir"], 'segments')
+        cache_path = segment_cache_dir(self.global_config["working_dir"], video_name)
         index_list = list(segment_index2name.keys())
         for index in index_list:
             list_data.append({
@@ -117,13 +141,25 @@ class NanoVectorDBVideoSegmentStorage(BaseVectorStorage):
             segment_name = segment_index2name[index]
             video_file = os.path.join(cache_path, f"{segment_name}.{video_output_format}")
             video_paths.append(video_file)
+        from_source = (
+            video_path is not None
+            and segment_times_info is not None
+            and not all(os.path.exists(p) for p in video_paths)
+        )
+        if from_source:
+            # 片段文件未落盘，直接按时间戳从原视频取帧
+            video_paths = [segment_times_info[index]["timestamp"] for index in index_list]
         batches = [
             video_paths[i: i + self._max_batch_size]
             for i in range(0, len(video_paths), self._max_batch_size)
         ]
         embeddings = []
+        embedder = self._get_embedder()
         for _batch in tqdm(batches, desc=f"Encoding Video Segments {video_name}"):
-            batch_embeddings = encode_video_segments(_batch, embedder)
+            if from_source:
+                batch_embeddings = encode_video_ranges(video_path, _batch, embedder)
+            else:
+                batch_embeddings = encode_video_segments(_batch, embedder)
             embeddings.append(batch_embeddings)
         embeddings = torch.concat(embeddings, dim=0)
         embeddings = embeddings.numpy()
@@ -132,20 +168,95 @@ class NanoVectorDBVideoSegmentStorage(BaseVectorStorage):
         results = self._client.upsert(datas=list_data)
         return results
     
-    async def query(self, query: str):
-        # 使用本地模型文件，不重新下载
-        model_path = "/root/models/imagebind_huge.pth"
-        embedder = imagebind_model.imagebind_huge(pretrained=False).cuda()
-        state_dict = torch.load(model_path, map_location="cuda")
-        embedder.load_state_dict(state_dict)
-        embedder.eval()
-        
-        embedding = encode_string_query(query, embedder)
-        embedding = embedding[0]
+    def _query_cache_model_tag(self):
+        # 换了 checkpoint 之后旧的向量不再可用
+        return os.path.basename(resolve_imagebind_model_path(self.global_config.get("imagebind_model_path")))
+
+    def _load_query_cache(self):
+        if self._query_cache_size <= 0:
+            return
+        cached = load_json(self._query_cache_file)
+        if not cached:
+            return
+        if cached.get("model") != self._query_cache_model_tag():
+            logger.info(f"Dropping {self.namespace} query cache built with {cached.get('model')}")
+            return
+        for key, entry in cached.get("entries", {}).items():
+            vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32)
+            self._query_cache[key] = (entry["query"], vector)
+        while len(self._query_cache) > self._query_cache_size:
+            self._query_cache.popitem(last=False)
+        logger.info(f"Load {len(self._query_cache)} cached query embeddings for {self.namespace}")
+
+    def _save_query_cache(self):
+        if not self._query_cache_dirty:
+            return
+        write_json(
+            {
+                "model": self._query_cache_model_tag(),
+                "entries": {
+                    key: {
+                        "query": query,
+                        "vector": base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii"),
+                    }
+                    for key, (query, vector) in self._query_cache.items()
+                },
+            },
+            self._query_cache_file,
+        )
+        self._query_cache_dirty = False
+
+    def _embed_query(self, query: str):
+        if self._query_cache_size <= 0:
+            return encode_string_query(query, self._get_embedder())[0].numpy()
+        key = compute_mdhash_id(query.strip(), prefix="q-")
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            self._query_cache.move_to_end(key)
+            self._query_cache_stats["hits"] += 1
+            return cached[1]
+        self._query_cache_stats["misses"] += 1
+        return self._cache_query_embedding(key, query)
+
+    def _cache_query_embedding(self, key: str, query: str):
+        vector = encode_string_query(query, self._get_embedder())[0].numpy().astype(np.float32)
+        self._query_cache[key] = (query, vector)
+        self._query_cache_dirty = True
+        if len(self._query_cache) > self._query_cache_size:
+            self._query_cache.popitem(last=False)
+            self._query_cache_stats["evictions"] += 1
+        return vector
+
+    def query_cache_stats(self) -> dict:
+        stats = dict(self._query_cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["size"] = len(self._query_cache)
+        stats["capacity"] = self._query_cache_size
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    async def precompute_query_embeddings(self, queries: list[str]):
+        """Embed expected (already refined) queries ahead of time so that the
+        first real query does not pay for the ImageBind text tower."""
+        for query in queries:
+            key = compute_mdhash_id(query.strip(), prefix="q-")
+            if self._query_cache_size <= 0 or key in self._query_cache:
+                continue
+            self._cache_query_embedding(key, query)
+            self._query_cache_stats["precomputed"] += 1
+        self._save_query_cache()
+
+    async def query(self, query: str, video_names: list[str] = None):
+        embedding = self._embed_query(query)
+        filter_lambda = None
+        if video_names:
+            video_names = set(video_names)
+            filter_lambda = lambda dp: dp["__video_name__"] in video_names
         results = self._client.query(
             query=embedding,
             top_k=self.top_k,
             better_than_threshold=-1,
+            filter_lambda=filter_lambda,
         )
         results = [
             {**dp, "id": dp["__id__"], "distance": dp["__metrics__"]} for dp in results
@@ -154,3 +265,7 @@ class NanoVectorDBVideoSegmentStorage(BaseVectorStorage):
     
     async def index_done_callback(self):
         self._client.save()
+        self._save_query_cache()
+
+    async def query_done_callback(self):
+        self._save_query_cache()
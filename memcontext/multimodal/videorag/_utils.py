@@ -4,9 +4,13 @@ import json
 import logging
 import os
 import re
+import threading
+import time
+import weakref
 import numbers
-from dataclasses import dataclass
-from functools import wraps
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from functools import lru_cache, wraps
 from hashlib import md5
 from typing import Any, Union
 
@@ -14,7 +18,11 @@ import numpy as np
 import tiktoken
 
 logger = logging.getLogger("nano-graphrag")
-ENCODER = None
+
+# content md5 -> token ids, shared by all inserts in the process
+_TOKEN_CACHE_SIZE = 8192
+_token_cache: "OrderedDict[str, list[int]]" = OrderedDict()
+_token_cache_lock = threading.Lock()
 
 
 def always_get_an_event_loop() -> asyncio.AbstractEventLoop:
@@ -49,29 +57,66 @@ def convert_response_to_json(response: str) -> dict:
         raise e from None
 
 
+@lru_cache(maxsize=None)
+def get_tiktoken_encoder(model_name: str = "gpt-4o") -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(model_name)
+
+
 def encode_string_by_tiktoken(content: str, model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    tokens = ENCODER.encode(content)
+    tokens = get_tiktoken_encoder(model_name).encode(content)
     return tokens
 
 
 def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    content = ENCODER.decode(tokens)
+    content = get_tiktoken_encoder(model_name).decode(tokens)
     return content
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+def encode_strings_by_tiktoken(
+    contents: list[str], model_name: str = "gpt-4o", num_threads: int = None
+) -> list[list[int]]:
+    """Encode many strings, reusing tokens of contents seen before (by md5).
+
+    Misses are encoded with ``encode_batch`` on a thread pool; tiktoken releases
+    the GIL while encoding, so this scales with ``num_threads``.
+    """
+    keys = [f"{model_name}:{md5(c.encode()).hexdigest()}" for c in contents]
+    results = [None] * len(contents)
+    with _token_cache_lock:
+        for i, key in enumerate(keys):
+            cached = _token_cache.get(key)
+            if cached is not None:
+                _token_cache.move_to_end(key)
+                results[i] = cached
+    missing = [i for i, tokens in enumerate(results) if tokens is None]
+    if missing:
+        encoded = get_tiktoken_encoder(model_name).encode_batch(
+            [contents[i] for i in missing], num_threads=num_threads or os.cpu_count() or 8
+        )
+        with _token_cache_lock:
+            for i, tokens in zip(missing, encoded):
+                results[i] = tokens
+                _token_cache[keys[i]] = tokens
+            while len(_token_cache) > _TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    # 调用方可能原地修改 token 列表（例如截断），返回副本
+    return [list(tokens) for tokens in results]
+
+
+def truncate_list_by_token_size(
+    list_data: list, key: callable, max_token_size: int, token_count: callable = None
+):
+    """Truncate a list of data by token size.
+
+    ``token_count(data)`` may return a stored token count (e.g. a chunk's
+    ``tokens`` field) to skip re-encoding; ``None`` falls back to tiktoken.
+    """
     if max_token_size <= 0:
         return []
     tokens = 0
     for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
+        count = token_count(data) if token_count is not None else None
+        tokens += count if count is not None else len(encode_string_by_tiktoken(key(data)))
         if tokens > max_token_size:
             return list_data[:i]
     return list_data
@@ -174,23 +219,102 @@ class EmbeddingFunc:
 
 
 # Decorators ------------------------------------------------------------------------
-def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
-    """Add restriction of maximum async calling times for a async func"""
+@dataclass
+class AsyncCallStats:
+    """Counters exposed by ``limit_async_func_call`` wrappers."""
+
+    max_async: int
+    max_per_minute: Union[int, None] = None
+    in_flight: int = 0
+    queued: int = 0
+    max_queued: int = 0
+    total_calls: int = 0
+    failed_calls: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+    def to_dict(self) -> dict:
+        started = self.total_calls
+        return {
+            **asdict(self),
+            "avg_wait_time": self.total_wait_time / started if started else 0.0,
+        }
+
+
+class _RequestRate:
+    """Spaces calls evenly so that at most ``per_minute`` start in any minute.
+
+    Slots are reserved under a thread lock and awaited with ``asyncio.sleep``,
+    so the limit holds across event loops and threads.
+    """
+
+    def __init__(self, per_minute: int):
+        self._interval = 60.0 / per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def limit_async_func_call(max_size: int, max_per_minute: int = None):
+    """Add restriction of maximum async calling times for a async func
+
+    Concurrency is bounded by an ``asyncio.Semaphore`` per event loop (VideoRAG
+    runs through ``always_get_an_event_loop`` so one wrapper may see several
+    loops), optionally combined with a process-wide requests-per-minute limit. The wrapper exposes an ``AsyncCallStats`` as
+    ``.limiter_stats``.
+    """
 
     def final_decro(func):
-        """Not using async.Semaphore to aovid use nest-asyncio"""
-        __current_size = 0
+        stats = AsyncCallStats(max_async=max_size, max_per_minute=max_per_minute)
+        rate = _RequestRate(max_per_minute) if max_per_minute else None
+        semaphores = weakref.WeakKeyDictionary()
+
+        def _semaphore():
+            loop = asyncio.get_running_loop()
+            semaphore = semaphores.get(loop)
+            if semaphore is None:
+                semaphore = semaphores[loop] = asyncio.Semaphore(max_size)
+            return semaphore
 
         @wraps(func)
         async def wait_func(*args, **kwargs):
-            nonlocal __current_size
-            while __current_size >= max_size:
-                await asyncio.sleep(waitting_time)
-            __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
-
+            semaphore = _semaphore()
+            enqueued_at = time.monotonic()
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+            try:
+                await semaphore.acquire()
+                try:
+                    if rate is not None:
+                        await rate.acquire()
+                except BaseException:
+                    semaphore.release()
+                    raise
+            finally:
+                stats.queued -= 1
+            waited = time.monotonic() - enqueued_at
+            stats.total_wait_time += waited
+            stats.max_wait_time = max(stats.max_wait_time, waited)
+            stats.total_calls += 1
+            stats.in_flight += 1
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                stats.failed_calls += 1
+                raise
+            finally:
+                # 出错时同样释放名额，避免限流器被耗尽
+                stats.in_flight -= 1
+                semaphore.release()
+
+        wait_func.limiter_stats = stats
         return wait_func
 
     return final_decro
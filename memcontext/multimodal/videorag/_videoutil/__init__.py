@@ -1,4 +1,6 @@
-from .split import split_video, saving_video_segments
+from .split import split_video, saving_video_segments, segment_cache_dir
 from .asr import speech_to_text
 from .caption import segment_caption, merge_segment_information, retrieved_segment_caption
-from .feature import encode_video_segments, encode_string_query
\ No newline at end of file
+from .caption_backend import CAPTION_BACKENDS, BaseCaptionBackend, CaptionRequest, build_caption_backend
+from .feature import encode_video_segments, encode_video_ranges, encode_string_query, get_imagebind_embedder, release_imagebind_embedders, resolve_imagebind_model_path
+from .extract import extract_segment_media
@@ -1,84 +1,176 @@
 import os
 import re
+import json
+import hashlib
+import threading
 import torch
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from faster_whisper import WhisperModel
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
-
-def speech_to_text(video_name, working_dir, segment_index2name, audio_output_format):
-    model = WhisperModel("/root/models/faster-whisper-large-v3-turbo")
-    model.logger.setLevel(logging.WARNING)
-    
-    cache_path = os.path.join(working_dir, '_cache', video_name)
-    
+from faster_whisper.audio import decode_audio
+
+from .._utils import logger
+from .split import segment_cache_dir
+
+DEFAULT_WHISPER_MODEL_PATH = "/root/models/faster-whisper-large-v3-turbo"
+LANGUAGE_DETECTION_SECONDS = 30
+
+# process-wide WhisperModel instances keyed by (model_path, device, compute_type, num_workers)
+_whisper_models = {}
+_whisper_models_lock = threading.Lock()
+
+
+def _resolve_whisper_config(model_path=None, device="auto", compute_type=None):
+    model_path = model_path or os.environ.get("WHISPER_MODEL_PATH", DEFAULT_WHISPER_MODEL_PATH)
+    if device in (None, "", "auto"):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    elif device.startswith("cuda") and not torch.cuda.is_available():
+        logger.warning("CUDA requested for faster-whisper but not available, falling back to CPU")
+        device = "cpu"
+    compute_type = compute_type or ("float16" if device.startswith("cuda") else "int8")
+    return model_path, device, compute_type
+
+
+def get_whisper_model(model_path=None, device="auto", compute_type=None, num_workers=2) -> WhisperModel:
+    """Return a faster-whisper model that stays loaded for the whole process.
+
+    ``compute_type`` defaults to float16 on CUDA and int8 on CPU. ``num_workers``
+    lets several segments be transcribed concurrently by the same model.
+    """
+    model_path, device, compute_type = _resolve_whisper_config(model_path, device, compute_type)
+
+    key = (model_path, device, compute_type, num_workers)
+    model = _whisper_models.get(key)
+    if model is not None:
+        return model
+    with _whisper_models_lock:
+        model = _whisper_models.get(key)
+        if model is None:
+            logger.info(f"Loading faster-whisper from {model_path} on {device} ({compute_type})")
+            model = WhisperModel(model_path, device=device, compute_type=compute_type, num_workers=num_workers)
+            model.logger.setLevel(logging.WARNING)
+            _whisper_models[key] = model
+    return model
+
+
+def _audio_hash(audio_file, cache_tag=""):
+    digest = hashlib.md5(cache_tag.encode("utf-8"))
+    with open(audio_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _detect_language(model, audio_file):
+    # 只取前 30 秒做语言检测
+    sampling_rate = model.feature_extractor.sampling_rate
+    audio = decode_audio(audio_file, sampling_rate=sampling_rate)[: LANGUAGE_DETECTION_SECONDS * sampling_rate]
+    if not len(audio):
+        return None
+    _, info = model.transcribe(audio, task="transcribe", language=None, beam_size=1, vad_filter=False)
+    return getattr(info, 'language', None) if info else None
+
+
+def _segment_language(detected_lang, result):
+    # 双重验证：检查 transcript 文本内容中的中文字符
+    has_chinese = False
+    if result.strip():
+        # 移除时间戳标记后检查
+        clean_text = re.sub(r'\[\d+\.\d+s\s*->\s*\d+\.\d+s\]', '', result)
+        has_chinese = bool(re.search(r'[\u4e00-\u9fff]', clean_text))
+
+    if detected_lang:
+        # Map Whisper language codes to our format
+        # Whisper uses ISO 639-1 codes (e.g., 'en', 'zh', 'ja', etc.)
+        if detected_lang == 'zh' or detected_lang.startswith('zh'):
+            return "zh"
+        # 如果 Whisper 识别为英文或其他语言，但文本中包含中文字符，则改为中文
+        return "zh" if has_chinese else detected_lang
+    # If no language detected, check text content
+    if not result.strip():
+        return "unknown"
+    return "zh" if has_chinese else "en"
+
+
+def speech_to_text(
+    video_name,
+    working_dir,
+    segment_index2name,
+    audio_output_format,
+    model_path=None,
+    device="auto",
+    compute_type=None,
+    num_workers=2,
+    use_cache=True,
+):
+    model_path, device, compute_type = _resolve_whisper_config(model_path, device, compute_type)
+    model = get_whisper_model(model_path, device=device, compute_type=compute_type, num_workers=num_workers)
+    # 换用其他模型或精度时不复用旧模型的转写结果
+    cache_tag = f"{os.path.basename(os.path.normpath(model_path))}|{compute_type}"
+
+    audio_dir = segment_cache_dir(working_dir, video_name)
+    asr_cache_dir = os.path.join(working_dir, '_asr_cache')
+    os.makedirs(asr_cache_dir, exist_ok=True)
+
     transcripts = {}
     languages = {}
-    
-    # 第一步：先检测第一个有效片段的语言，以便后续明确指定
-    detected_video_language = None
-    for index in segment_index2name:
-        segment_name = segment_index2name[index]
-        audio_file = os.path.join(cache_path, f"{segment_name}.{audio_output_format}")
-        if os.path.exists(audio_file):
-            # 快速检测语言（只检测，不完整转录）
-            _, info = model.transcribe(audio_file, task="transcribe", language=None, beam_size=1, vad_filter=False)
-            detected_video_language = getattr(info, 'language', None) if info else None
-            if detected_video_language:
-                break
-    
-    # 第二步：使用检测到的语言明确指定参数进行转录
-    for index in tqdm(segment_index2name, desc=f"Speech Recognition {video_name}"):
-        segment_name = segment_index2name[index]
-        audio_file = os.path.join(cache_path, f"{segment_name}.{audio_output_format}")
 
+    audio_files = {}
+    for index, segment_name in segment_index2name.items():
+        audio_file = os.path.join(audio_dir, f"{segment_name}.{audio_output_format}")
         # if the audio file does not exist, skip it
         if not os.path.exists(audio_file):
             transcripts[index] = ""
             languages[index] = "unknown"
             continue
-        
-        # 明确设置 task="transcribe" 确保只转录不翻译，language=None 让模型自动检测语言
+        audio_files[index] = audio_file
+
+    # 命中缓存的片段（按模型与音频内容哈希），重新入库同一视频时跳过 ASR
+    cache_files = {}
+    for index, audio_file in audio_files.items():
+        cache_files[index] = os.path.join(asr_cache_dir, f"{_audio_hash(audio_file, cache_tag)}.json")
+        if use_cache and os.path.exists(cache_files[index]):
+            with open(cache_files[index], encoding="utf-8") as f:
+                cached = json.load(f)
+            transcripts[index] = cached["transcript"]
+            languages[index] = cached["language"]
+    todo = [index for index in audio_files if index not in transcripts]
+    if not todo:
+        return transcripts, languages
+
+    # 第一步：用第一个有效片段的前 30 秒检测语言，后续转录明确指定该语言
+    detected_video_language = None
+    for index in todo:
+        detected_video_language = _detect_language(model, audio_files[index])
+        if detected_video_language:
+            break
+
+    def _transcribe(index):
+        # 明确设置 task="transcribe" 确保只转录不翻译
         segments, info = model.transcribe(
-            audio_file,
+            audio_files[index],
             task="transcribe",  # 只转录，不翻译
-            language=None,  # 自动检测语言
+            language=detected_video_language,  # None 时由模型自动检测
             condition_on_previous_text=False,  # 避免上下文影响
         )
         result = ""
         for segment in segments:
             result += "[%.2fs -> %.2fs] %s\n" % (segment.start, segment.end, segment.text)
-        transcripts[index] = result
-        
-        # Extract language from Whisper info object
-        # faster-whisper returns info as a named tuple with language attribute
-        detected_lang = getattr(info, 'language', None) if info else None
-        
-        # 双重验证：检查 transcript 文本内容中的中文字符
-        has_chinese = False
-        if result.strip():
-            # 移除时间戳标记后检查
-            clean_text = re.sub(r'\[\d+\.\d+s\s*->\s*\d+\.\d+s\]', '', result)
-            has_chinese = bool(re.search(r'[\u4e00-\u9fff]', clean_text))
-        
-        if detected_lang:
-            # Map Whisper language codes to our format
-            # Whisper uses ISO 639-1 codes (e.g., 'en', 'zh', 'ja', etc.)
-            if detected_lang == 'zh' or detected_lang.startswith('zh'):
-                languages[index] = "zh"
-            elif detected_lang == 'en':
-                # 如果 Whisper 识别为英文，但文本中包含中文字符，则改为中文
-                languages[index] = "zh" if has_chinese else "en"
-            else:
-                # 对于其他语言，如果包含中文，也认为是中文
-                languages[index] = "zh" if has_chinese else detected_lang
-        else:
-            # If no language detected, check text content
-            if not result.strip():
-                languages[index] = "unknown"
-            elif has_chinese:
-                languages[index] = "zh"
-            else:
-                languages[index] = "en"
-    
-    return transcripts, languages
\ No newline at end of file
+        return index, result, getattr(info, 'language', None) if info else None
+
+    # 第二步：多个片段并发提交给同一个模型（由 num_workers 个 worker 处理）
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        for index, result, detected_lang in tqdm(
+            executor.map(_transcribe, todo), total=len(todo), desc=f"Speech Recognition {video_name}"
+        ):
+            transcripts[index] = result
+            languages[index] = _segment_language(detected_lang, result)
+            if use_cache:
+                # 先写临时文件再替换，中断时不会留下半截的缓存文件
+                tmp_file = f"{cache_files[index]}.{os.getpid()}.tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump({"transcript": result, "language": languages[index]}, f, ensure_ascii=False)
+                os.replace(tmp_file, cache_files[index])
+
+    return transcripts, languages
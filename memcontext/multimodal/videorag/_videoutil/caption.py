@@ -1,13 +1,16 @@
 import json
 import os
 import re
-import torch
+from collections import OrderedDict, defaultdict
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
-from transformers import AutoModel, AutoTokenizer
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
+from .._utils import logger
+from .extract import frame_file_map
+from .caption_backend import BaseCaptionBackend, CaptionRequest, build_caption_backend, run_caption_requests
+
 # time parsing helper to avoid eval on strings like "00:30"
 def _to_seconds(t):
     if isinstance(t, (int, float)):
@@ -51,6 +54,38 @@ def encode_video(video, frame_times):
     frames = [Image.fromarray(v.astype('uint8')).resize((1280, 720)) for v in frames]
     return frames
 
+class _LazyVideoClip:
+    """VideoFileClip that is only opened when a frame has to be decoded."""
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self._clip = None
+
+    def get_frame(self, t):
+        if self._clip is None:
+            self._clip = VideoFileClip(self.video_path)
+        return self._clip.get_frame(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._clip is not None:
+            self._clip.close()
+
+
+def _extracted_frames(segment_info, frame_times):
+    """Frames written by the single-pass extraction, or None if any is missing."""
+    files = frame_file_map(segment_info)
+    paths = [files.get(round(float(t), 3)) for t in frame_times]
+    if not paths or not all(paths) or not all(os.path.exists(p) for p in paths):
+        return None
+    frames = []
+    for path in paths:
+        with Image.open(path) as image:
+            frames.append(image.convert("RGB").resize((1280, 720)))
+    return frames
+
 def _format_time_intervals(frame_times):
     """Return list of '[start -> end]' strings from frame sampling points."""
     times = list(frame_times)
@@ -228,185 +263,167 @@ def _ensure_metadata_defaults(metadata: dict, fallback_summary: str) -> dict:
     return metadata
 
 
-def segment_caption(video_name, video_path, segment_index2name, transcripts, segment_times_info, caption_result, error_queue):
-    try:
-        if not torch.cuda.is_available():
-            raise RuntimeError("CUDA is required for MiniCPM-V captioning but no GPU is available.")
-        model = AutoModel.from_pretrained(
-            '/root/models/MiniCPM-V-2_6-int4',
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="cuda",
-        )
-        tokenizer = AutoTokenizer.from_pretrained(
-            '/root/models/MiniCPM-V-2_6-int4', 
-            trust_remote_code=True,
+def _segment_requests(video_frames, frame_times, segment_transcript, max_frames):
+    """Split a segment's frames into caption requests of at most ``max_frames``
+    frames each, returning the requests and the frame times of every batch."""
+    num_frames = len(video_frames)
+    num_batches = max(1, (num_frames + max_frames - 1) // max_frames)
+    requests = []
+    batch_times = []
+    for batch_idx in range(num_batches):
+        start_idx = batch_idx * max_frames
+        end_idx = min((batch_idx + 1) * max_frames, num_frames)
+        batch_frames = video_frames[start_idx:end_idx]
+        batch_frame_times = frame_times[start_idx:end_idx]
+        # 对于非第一批，添加上下文提示
+        if batch_idx > 0:
+            focus_clause = f" 这是视频片段的一部分（第{batch_idx+1}/{num_batches}批），请结合之前的上下文。"
+        else:
+            focus_clause = ""
+        query = STRUCTURED_PROMPT_TEMPLATE.format(
+            intervals="\n".join(_format_time_intervals(batch_frame_times)),
+            transcript=segment_transcript or "",
+            focus_clause=focus_clause,
         )
-        model.eval()
-        
-        with VideoFileClip(video_path) as video:
+        requests.append(CaptionRequest(
+            frames=batch_frames,
+            prompt=query,
+            max_slice_nums=min(10, max(2, len(batch_frames) // 2)),
+        ))
+        batch_times.append(batch_frame_times)
+    return requests, batch_times
+
+
+def _fallback_caption_entry(index, transcripts, segment_times_info):
+    # 使用 transcript 作为 fallback
+    segment_transcript = transcripts.get(index, "")
+    start_time, end_time = segment_times_info[index]["timestamp"]
+    fallback_text = f"[{start_time:.2f}s -> {end_time:.2f}s] {segment_transcript}" if segment_transcript else f"[{start_time:.2f}s -> {end_time:.2f}s] 视频片段内容"
+    return {
+        "raw": fallback_text,
+        "metadata": _ensure_metadata_defaults({}, fallback_text),
+    }
+
+
+def _segment_caption_entry(index, answers, batch_times, segment_transcript, error_queue):
+    """Merge the answers of one segment's requests into a caption entry."""
+    if len(answers) == 1:
+        if isinstance(answers[0], Exception):
+            raise answers[0]
+        segment_caption = answers[0]
+        raw_text, parsed_metadata = _extract_json_from_response(segment_caption)
+    else:
+        # 帧数较多时分批处理，合并所有批次的 caption
+        all_captions = []
+        for batch_idx, (answer, batch_frame_times) in enumerate(zip(answers, batch_times)):
+            if isinstance(answer, Exception):
+                error_queue.put(f"Warning: Segment {index} batch {batch_idx+1} failed, using transcript fallback: {str(answer)[:200]}")
+                all_captions.append(f"[{batch_frame_times[0]:.2f}s -> {batch_frame_times[-1]:.2f}s] {segment_transcript}")
+            else:
+                all_captions.append(answer)
+        segment_caption = "\n\n".join(all_captions)
+        # 分批处理的结果是多个 caption 的合并，可能不是标准 JSON 格式
+        # 尝试从最后一个批次提取 metadata（如果有）
+        raw_text = segment_caption
+        try:
+            _, parsed_metadata = _extract_json_from_response(all_captions[-1])
+        except Exception:
+            parsed_metadata = {}
+
+    # Debug: 打印实际发送的 prompt 和 LLM 的原始响应
+    if index == 0:  # 只打印第一个 segment 的调试信息
+        print("=" * 80)
+        print(f"DEBUG: Processed {sum(len(t) for t in batch_times)} frames in {len(answers)} batch(es)")
+        print("DEBUG: LLM raw response (first 1000 chars):")
+        print(segment_caption[:1000] if isinstance(segment_caption, str) else str(segment_caption)[:1000])
+        print("=" * 80)
+
+    # Perform inline dedupe/merge of adjacent identical timestamped lines
+    try:
+        raw_text = _merge_adjacent_identical_lines(raw_text)
+        if isinstance(parsed_metadata, dict) and isinstance(parsed_metadata.get("chunk_summary"), str):
+            parsed_metadata["chunk_summary"] = _merge_adjacent_identical_lines(parsed_metadata["chunk_summary"])
+    except Exception:
+        # In case merging fails, keep the original raw_text
+        pass
+
+    # Debug: 打印解析后的 metadata
+    if index == 0:
+        print("DEBUG: Parsed metadata chunk_summary type:", type(parsed_metadata.get("chunk_summary")))
+        if "chunk_summary" in parsed_metadata:
+            chunk_summary_value = parsed_metadata["chunk_summary"]
+            print("DEBUG: chunk_summary value (first 200 chars):", str(chunk_summary_value)[:200])
+            if isinstance(chunk_summary_value, str) and chunk_summary_value.strip().startswith("{"):
+                print("DEBUG: WARNING! chunk_summary is a JSON string!")
+        print("=" * 80)
+
+    normalized_metadata = _ensure_metadata_defaults(parsed_metadata, raw_text)
+    return {
+        "raw": normalized_metadata["chunk_summary"],
+        "metadata": normalized_metadata,
+    }
+
+
+def segment_caption(
+    video_name,
+    video_path,
+    segment_index2name,
+    transcripts,
+    segment_times_info,
+    caption_result,
+    error_queue,
+    caption_backend=("minicpm", {}),
+    cache_dir=None,
+):
+    """Caption every segment with the backend described by ``caption_backend``
+    (``(name, kwargs)``, built inside this process).
+
+    Frames of consecutive segments are batched into requests until the
+    backend's ``concurrency`` is filled; answers are cached under
+    ``cache_dir`` by (backend, prompt, frames).
+    """
+    try:
+        backend_name, backend_kwargs = caption_backend
+        backend = build_caption_backend(backend_name, **backend_kwargs)
+
+        def _flush(pending, requests):
+            answers = run_caption_requests(backend, requests, cache_dir=cache_dir)
+            for index, (begin, end, batch_times) in pending.items():
+                try:
+                    caption_result[index] = _segment_caption_entry(
+                        index, answers[begin:end], batch_times, transcripts.get(index, ""), error_queue
+                    )
+                except Exception as e:
+                    error_queue.put(f"Warning: Segment {index} caption failed, using transcript fallback: {str(e)[:200]}")
+                    caption_result[index] = _fallback_caption_entry(index, transcripts, segment_times_info)
+
+        # 帧通常已由 split_video 抽取到磁盘，只有缺帧时才重新解码原视频
+        pending, requests = {}, []
+        with _LazyVideoClip(video_path) as video:
             for index in tqdm(segment_index2name, desc=f"Captioning Video {video_name}"):
                 try:
                     frame_times = segment_times_info[index]["frame_times"]
-                    # 允许更多帧采样，但通过分批处理避免张量大小不匹配
-                    # 如果 rough_num_frames_per_segment 较大，可以采样更多帧
+                    # 允许更多帧采样，超过 backend 单次上限的帧分批处理
                     max_samples = min(50, len(frame_times))  # 最多50帧，但不超过实际帧数
                     frame_times = _coarsen_frame_times(frame_times, max_samples=max_samples)
-                    video_frames = encode_video(video, frame_times)
-                    segment_transcript = transcripts.get(index, "")
-                    start_time, end_time = segment_times_info[index]["timestamp"]
-                    
-                    # 分批处理图像，避免张量大小不匹配
-                    num_frames = len(video_frames)
-                    batch_size = 8  # 每批最多8帧，这是模型能稳定处理的帧数
-                    num_batches = (num_frames + batch_size - 1) // batch_size if num_frames > batch_size else 1
-                    all_captions = []  # 用于存储分批处理的结果
-                    
-                    if num_frames <= batch_size:
-                        # 帧数较少，直接处理
-                        intervals = "\n".join(_format_time_intervals(frame_times))
-                        query = STRUCTURED_PROMPT_TEMPLATE.format(
-                            intervals=intervals,
-                            transcript=segment_transcript or "",
-                            focus_clause="",
-                        )
-                        msgs = [{'role': 'user', 'content': video_frames + [query]}]
-                        params = {}
-                        params["use_image_id"] = False
-                        params["max_slice_nums"] = min(10, max(2, num_frames // 2))
-                        
-                        segment_caption = model.chat(
-                            image=None,
-                            msgs=msgs,
-                            tokenizer=tokenizer,
-                            **params
-                        )
-                    else:
-                        # 帧数较多，分批处理并合并结果
-                        
-                        for batch_idx in range(num_batches):
-                            start_idx = batch_idx * batch_size
-                            end_idx = min((batch_idx + 1) * batch_size, num_frames)
-                            batch_frames = video_frames[start_idx:end_idx]
-                            batch_frame_times = frame_times[start_idx:end_idx]
-                            
-                            intervals = "\n".join(_format_time_intervals(batch_frame_times))
-                            # 对于非第一批，添加上下文提示
-                            if batch_idx > 0:
-                                focus_clause = f" 这是视频片段的一部分（第{batch_idx+1}/{num_batches}批），请结合之前的上下文。"
-                            else:
-                                focus_clause = ""
-                            
-                            query = STRUCTURED_PROMPT_TEMPLATE.format(
-                                intervals=intervals,
-                                transcript=segment_transcript or "",
-                                focus_clause=focus_clause,
-                            )
-                            msgs = [{'role': 'user', 'content': batch_frames + [query]}]
-                            params = {}
-                            params["use_image_id"] = False
-                            params["max_slice_nums"] = min(10, max(2, len(batch_frames) // 2))
-                            
-                            try:
-                                batch_caption = model.chat(
-                                    image=None,
-                                    msgs=msgs,
-                                    tokenizer=tokenizer,
-                                    **params
-                                )
-                                all_captions.append(batch_caption)
-                            except RuntimeError as e:
-                                if "Sizes of tensors must match" in str(e):
-                                    # 即使分批也失败，使用更小的批次或 transcript
-                                    error_queue.put(f"Warning: Segment {index} batch {batch_idx+1} failed, using transcript fallback")
-                                    batch_intervals = "\n".join(_format_time_intervals(batch_frame_times))
-                                    all_captions.append(f"[{batch_frame_times[0]:.2f}s -> {batch_frame_times[-1]:.2f}s] {segment_transcript}")
-                                else:
-                                    raise
-                            
-                            if torch.cuda.is_available():
-                                torch.cuda.empty_cache()
-                        
-                        # 合并所有批次的 caption
-                        segment_caption = "\n\n".join(all_captions)
-                    
-                    # Debug: 打印实际发送的 prompt 和 LLM 的原始响应
-                    if index == 0:  # 只打印第一个 segment 的调试信息
-                        print("=" * 80)
-                        print(f"DEBUG: Processed {num_frames} frames in {num_batches if num_frames > batch_size else 1} batch(es)")
-                        print("DEBUG: LLM raw response (first 1000 chars):")
-                        print(segment_caption[:1000] if isinstance(segment_caption, str) else str(segment_caption)[:1000])
-                        print("=" * 80)
-                    
-                    # 对于分批处理的结果，需要特殊处理 JSON 提取
-                    if num_frames > batch_size:
-                        # 分批处理的结果是多个 caption 的合并，可能不是标准 JSON 格式
-                        # 尝试提取所有批次的文本内容
-                        raw_text = segment_caption
-                        # 尝试从最后一个批次提取 metadata（如果有）
-                        try:
-                            if all_captions and len(all_captions) > 0:
-                                _, parsed_metadata = _extract_json_from_response(all_captions[-1])
-                            else:
-                                parsed_metadata = {}
-                        except:
-                            parsed_metadata = {}
-                    else:
-                        raw_text, parsed_metadata = _extract_json_from_response(segment_caption)
-                    
-                    # Perform inline dedupe/merge of adjacent identical timestamped lines
-                    try:
-                        raw_text = _merge_adjacent_identical_lines(raw_text)
-                        if isinstance(parsed_metadata, dict) and isinstance(parsed_metadata.get("chunk_summary"), str):
-                            parsed_metadata["chunk_summary"] = _merge_adjacent_identical_lines(parsed_metadata["chunk_summary"])
-                    except Exception:
-                        # In case merging fails, keep the original raw_text
-                        pass
-                    
-                    # Debug: 打印解析后的 metadata
-                    if index == 0:
-                        print("DEBUG: Parsed metadata chunk_summary type:", type(parsed_metadata.get("chunk_summary")))
-                        if "chunk_summary" in parsed_metadata:
-                            chunk_summary_value = parsed_metadata["chunk_summary"]
-                            print("DEBUG: chunk_summary value (first 200 chars):", str(chunk_summary_value)[:200])
-                            if isinstance(chunk_summary_value, str) and chunk_summary_value.strip().startswith("{"):
-                                print("DEBUG: WARNING! chunk_summary is a JSON string!")
-                        print("=" * 80)
-                    
-                    normalized_metadata = _ensure_metadata_defaults(parsed_metadata, raw_text)
-                    caption_result[index] = {
-                        "raw": normalized_metadata["chunk_summary"],
-                        "metadata": normalized_metadata,
-                    }
-                except RuntimeError as e:
-                    # 处理张量大小不匹配等运行时错误
-                    error_msg = str(e)
-                    if "Sizes of tensors must match" in error_msg or "tensor" in error_msg.lower():
-                        # 使用 transcript 作为 fallback
-                        segment_transcript = transcripts.get(index, "")
-                        start_time, end_time = segment_times_info[index]["timestamp"]
-                        fallback_text = f"[{start_time:.2f}s -> {end_time:.2f}s] {segment_transcript}" if segment_transcript else f"[{start_time:.2f}s -> {end_time:.2f}s] 视频片段内容"
-                        error_queue.put(f"Warning: Segment {index} caption failed (tensor size mismatch), using transcript fallback: {error_msg[:200]}")
-                        caption_result[index] = {
-                            "raw": fallback_text,
-                            "metadata": _ensure_metadata_defaults({}, fallback_text),
-                        }
-                    else:
-                        # 其他运行时错误，重新抛出
-                        raise
+                    video_frames = _extracted_frames(segment_times_info[index], frame_times)
+                    if video_frames is None:
+                        video_frames = encode_video(video, frame_times)
+                    segment_requests, batch_times = _segment_requests(
+                        video_frames, frame_times, transcripts.get(index, ""), backend.max_frames_per_request
+                    )
                 except Exception as e:
-                    # 其他错误，使用 transcript 作为 fallback
-                    segment_transcript = transcripts.get(index, "")
-                    start_time, end_time = segment_times_info[index]["timestamp"]
-                    fallback_text = f"[{start_time:.2f}s -> {end_time:.2f}s] {segment_transcript}" if segment_transcript else f"[{start_time:.2f}s -> {end_time:.2f}s] 视频片段内容"
                     error_queue.put(f"Warning: Segment {index} caption failed, using transcript fallback: {str(e)[:200]}")
-                    caption_result[index] = {
-                        "raw": fallback_text,
-                        "metadata": _ensure_metadata_defaults({}, fallback_text),
-                    }
-                finally:
-                    if torch.cuda.is_available():
-                        torch.cuda.empty_cache()
+                    caption_result[index] = _fallback_caption_entry(index, transcripts, segment_times_info)
+                    continue
+                pending[index] = (len(requests), len(requests) + len(segment_requests), batch_times)
+                requests.extend(segment_requests)
+                # 攒够 backend 可同时处理的请求数再提交
+                if len(requests) >= backend.concurrency:
+                    _flush(pending, requests)
+                    pending, requests = {}, []
+            if requests:
+                _flush(pending, requests)
     except Exception as e:
         error_queue.put(f"Error in segment_caption:\n {str(e)}")
         raise RuntimeError
@@ -487,52 +504,94 @@ def merge_segment_information(segment_index2name, segment_times_info, transcript
         }
     return inserting_segments
         
-def retrieved_segment_caption(caption_model, caption_tokenizer, refine_knowledge, retrieved_segments, video_path_db, video_segments, num_sampled_frames):
-    # model = AutoModel.from_pretrained('./MiniCPM-V-2_6-int4', trust_remote_code=True)
-    # tokenizer = AutoTokenizer.from_pretrained('./MiniCPM-V-2_6-int4', trust_remote_code=True)
-    # model.eval()
-    if not torch.cuda.is_available():
-        raise RuntimeError("CUDA is required for MiniCPM-V captioning but no GPU is available.")
-    if caption_model is None:
-        raise RuntimeError("caption_model is not initialized for retrieved_segment_caption.")
-    caption_result = {}
-    
-    for this_segment in tqdm(retrieved_segments, desc='Captioning Segments for Given Query'):
+class _VideoHandlePool:
+    """Keeps at most ``max_open`` VideoFileClip handles open, closing the least
+    recently used one first and all of them on exit."""
+
+    def __init__(self, max_open=2):
+        self.max_open = max(1, max_open)
+        self._clips = OrderedDict()
+
+    def get(self, video_path):
+        clip = self._clips.pop(video_path, None)
+        if clip is None:
+            if len(self._clips) >= self.max_open:
+                _, oldest = self._clips.popitem(last=False)
+                oldest.close()
+            clip = VideoFileClip(video_path)
+        self._clips[video_path] = clip
+        return clip
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        while self._clips:
+            _, clip = self._clips.popitem()
+            clip.close()
+
+
+def retrieved_segment_caption(caption_backend: BaseCaptionBackend, refine_knowledge, retrieved_segments, video_paths, segment_infos, num_sampled_frames, max_open_videos=2):
+    """video_paths: video_name -> path, segment_infos: segment id -> stored segment information.
+
+    Segments are grouped by source video; each source is opened once (at most
+    ``max_open_videos`` at a time) and its frames are read in one forward pass.
+    """
+    if caption_backend is None:
+        raise RuntimeError("caption backend is not initialized for retrieved_segment_caption, call load_caption_model first.")
+    # Clamp requested samples and coarsen to a small number to reduce repetitive captions
+    try:
+        num_sampled_frames = max(1, min(int(num_sampled_frames), 3))
+    except Exception:
+        num_sampled_frames = 3
+
+    segments_by_video = defaultdict(list)
+    segment_frame_times = {}
+    for this_segment in retrieved_segments:
         video_name = '_'.join(this_segment.split('_')[:-1])
-        index = this_segment.split('_')[-1]
-        video_path = video_path_db._data[video_name]
-        timestamp = video_segments._data[video_name][index]["time"].split('-')
+        segments_by_video[video_name].append(this_segment)
+        timestamp = segment_infos[this_segment]["time"].split('-')
         start, end = _to_seconds(timestamp[0]), _to_seconds(timestamp[1])
-        video = VideoFileClip(video_path)
-        # Clamp requested samples and coarsen to a small number to reduce repetitive captions
-        try:
-            num_sampled_frames = max(1, min(int(num_sampled_frames), 3))
-        except Exception:
-            num_sampled_frames = 3
         frame_times = np.linspace(start, end, num_sampled_frames, endpoint=False).tolist()
-        frame_times = _coarsen_frame_times(frame_times, max_samples=30)
-        video_frames = encode_video(video, frame_times)
-        segment_transcript = video_segments._data[video_name][index].get("transcript", "")
-        intervals = "\n".join(_format_time_intervals(frame_times))
-        focus_clause = f" 并重点提取：{refine_knowledge}。" if refine_knowledge else ""
+        segment_frame_times[this_segment] = _coarsen_frame_times(frame_times, max_samples=30)
+
+    segment_frames = {}
+    with _VideoHandlePool(max_open_videos) as pool:
+        for video_name, segment_ids in tqdm(segments_by_video.items(), desc='Sampling Frames for Given Query'):
+            video = pool.get(video_paths[video_name])
+            # 按时间顺序一次性向前读取该视频所有需要的帧
+            requests = sorted(
+                (t, this_segment, position)
+                for this_segment in segment_ids
+                for position, t in enumerate(segment_frame_times[this_segment])
+            )
+            for this_segment in segment_ids:
+                segment_frames[this_segment] = [None] * len(segment_frame_times[this_segment])
+            for t, this_segment, position in requests:
+                frame = video.get_frame(t)
+                segment_frames[this_segment][position] = Image.fromarray(frame.astype('uint8')).resize((1280, 720))
+
+    focus_clause = f" 并重点提取：{refine_knowledge}。" if refine_knowledge else ""
+    caption_requests = []
+    for this_segment in retrieved_segments:
+        segment_transcript = segment_infos[this_segment].get("transcript", "")
+        intervals = "\n".join(_format_time_intervals(segment_frame_times[this_segment]))
         query = STRUCTURED_PROMPT_TEMPLATE.format(
             intervals=intervals,
             transcript=segment_transcript or "",
             focus_clause=focus_clause,
         )
-        msgs = [{'role': 'user', 'content': video_frames + [query]}]
-        params = {}
-        params["use_image_id"] = False
-        params["max_slice_nums"] = 2
-        segment_caption = caption_model.chat(
-            image=None,
-            msgs=msgs,
-            tokenizer=caption_tokenizer,
-            **params
-        )
+        caption_requests.append(CaptionRequest(frames=segment_frames[this_segment], prompt=query, max_slice_nums=2))
+    answers = run_caption_requests(caption_backend, caption_requests)
+
+    caption_result = {}
+    for this_segment, segment_caption in zip(retrieved_segments, answers):
+        if isinstance(segment_caption, Exception):
+            # 单个片段失败时跳过（也不会写入 fine caption 缓存），不影响其他片段
+            logger.warning(f"Fine caption of segment {this_segment} failed: {str(segment_caption)[:200]}")
+            continue
+        segment_transcript = segment_infos[this_segment].get("transcript", "")
         this_caption = segment_caption.replace("\n", "").replace("<|endoftext|>", "")
         caption_result[this_segment] = f"Caption:\n{this_caption}\nTranscript:\n{segment_transcript}\n\n"
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
     
     return caption_result
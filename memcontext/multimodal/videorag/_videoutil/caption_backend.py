@@ -0,0 +1,274 @@
+import io
+import os
+import json
+import base64
+import hashlib
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import torch
+from openai import OpenAI
+from transformers import AutoModel, AutoTokenizer, AutoProcessor, AutoModelForVision2Seq
+
+from .._utils import logger
+
+DEFAULT_MINICPM_MODEL_PATH = "/root/models/MiniCPM-V-2_6-int4"
+DEFAULT_LOCAL_CPU_MODEL_PATH = "/root/models/SmolVLM-256M-Instruct"
+DEFAULT_CAPTION_API_MODEL = "gpt-4o-mini"
+
+
+@dataclass
+class CaptionRequest:
+    """One caption call: frames (PIL images) followed by the text prompt."""
+    frames: list
+    prompt: str
+    max_slice_nums: int = 2
+
+
+class BaseCaptionBackend:
+    """Vision-language model that turns ``CaptionRequest``s into caption text.
+
+    Frame batching and the caption cache live in ``caption.py`` and work the
+    same for every backend; a backend only answers requests.
+    """
+    name = "base"
+    # 单次请求最多携带的帧数，更多的帧由 caption.py 分批
+    max_frames_per_request = 8
+    # 值得同时提交的请求数（批量推理或并发请求）
+    concurrency = 1
+
+    @property
+    def cache_tag(self) -> str:
+        """Identifies the model in caption cache keys."""
+        return self.name
+
+    def caption(self, request: CaptionRequest) -> str:
+        raise NotImplementedError
+
+    def caption_many(self, requests: list[CaptionRequest]) -> list:
+        """Answer ``requests`` in order; a failed request yields its exception."""
+        results = []
+        for request in requests:
+            try:
+                results.append(self.caption(request))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class MiniCPMCaptionBackend(BaseCaptionBackend):
+    """MiniCPM-V 2.6 int4 on CUDA (the original captioner)."""
+    name = "minicpm"
+
+    def __init__(self, model_path=None, batch_size=4):
+        if not torch.cuda.is_available():
+            raise RuntimeError(
+                "CUDA is required for MiniCPM-V captioning but no GPU is available, "
+                "use caption_backend='openai' or 'local_cpu' instead."
+            )
+        self.model_path = model_path or DEFAULT_MINICPM_MODEL_PATH
+        self.concurrency = max(1, batch_size)
+        logger.info(f"Loading MiniCPM-V from {self.model_path}")
+        self.model = AutoModel.from_pretrained(
+            self.model_path,
+            trust_remote_code=True,
+            torch_dtype=torch.float16,
+            device_map="cuda",
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            self.model_path,
+            trust_remote_code=True,
+            use_fast=False  # 显式指定使用慢速处理器，消除警告
+        )
+        self.model.eval()
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.name}:{os.path.basename(os.path.normpath(self.model_path))}"
+
+    def _chat(self, msgs, max_slice_nums):
+        return self.model.chat(
+            image=None,
+            msgs=msgs,
+            tokenizer=self.tokenizer,
+            use_image_id=False,
+            max_slice_nums=max_slice_nums,
+        )
+
+    def caption(self, request: CaptionRequest) -> str:
+        return self._chat([{'role': 'user', 'content': request.frames + [request.prompt]}], request.max_slice_nums)
+
+    def caption_many(self, requests: list[CaptionRequest]) -> list:
+        """Caption several requests per ``chat`` call (MiniCPM-V 2.6 accepts a
+        batch of conversations), one by one when batching is not possible."""
+        try:
+            return self._caption_batches(requests)
+        finally:
+            # 显存缓存每轮只释放一次，逐条释放会让分配器反复重新申请显存
+            torch.cuda.empty_cache()
+
+    def _caption_batches(self, requests: list[CaptionRequest]) -> list:
+        results = []
+        for i in range(0, len(requests), self.concurrency):
+            batch = requests[i : i + self.concurrency]
+            if len(batch) > 1 and len({r.max_slice_nums for r in batch}) == 1:
+                try:
+                    answers = self._chat(
+                        [[{'role': 'user', 'content': r.frames + [r.prompt]}] for r in batch],
+                        batch[0].max_slice_nums,
+                    )
+                    if isinstance(answers, (list, tuple)) and len(answers) == len(batch):
+                        results.extend(answers)
+                        continue
+                except Exception:
+                    # 模型不支持批量对话时逐个处理
+                    torch.cuda.empty_cache()
+            results.extend(super().caption_many(batch))
+        return results
+
+
+class OpenAICaptionBackend(BaseCaptionBackend):
+    """Any OpenAI-compatible vision chat endpoint; frames are sent as inline
+    JPEGs and up to ``max_concurrency`` requests are in flight at once."""
+    name = "openai"
+
+    def __init__(
+        self,
+        model=None,
+        base_url=None,
+        api_key=None,
+        max_concurrency=8,
+        max_tokens=1024,
+        image_max_side=768,
+        jpeg_quality=85,
+        timeout=120,
+    ):
+        self.model = model or os.environ.get("CAPTION_API_MODEL", DEFAULT_CAPTION_API_MODEL)
+        api_key = api_key or os.environ.get("CAPTION_API_KEY") or os.environ.get("LLM_API_KEY")
+        base_url = base_url or os.environ.get("CAPTION_BASE_URL") or os.environ.get("LLM_BASE_URL")
+        if not api_key:
+            raise ValueError("caption_api_key (or CAPTION_API_KEY / LLM_API_KEY) is required for the openai caption backend")
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout)
+        self.concurrency = max(1, max_concurrency)
+        self.max_tokens = max_tokens
+        self.image_max_side = image_max_side
+        self.jpeg_quality = jpeg_quality
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.name}:{self.model}:{self.image_max_side}"
+
+    def _image_url(self, frame):
+        image = frame.convert("RGB")
+        image.thumbnail((self.image_max_side, self.image_max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=self.jpeg_quality)
+        return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    def caption(self, request: CaptionRequest) -> str:
+        content = [{"type": "image_url", "image_url": {"url": self._image_url(f)}} for f in request.frames]
+        content.append({"type": "text", "text": request.prompt})
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": content}],
+            max_tokens=self.max_tokens,
+        )
+        return response.choices[0].message.content or ""
+
+    def caption_many(self, requests: list[CaptionRequest]) -> list:
+        def _safe_caption(request):
+            try:
+                return self.caption(request)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, max(1, len(requests)))) as executor:
+            return list(executor.map(_safe_caption, requests))
+
+
+class LocalCPUCaptionBackend(BaseCaptionBackend):
+    """Small Vision2Seq model (SmolVLM by default) running on CPU in fp32."""
+    name = "local_cpu"
+    max_frames_per_request = 4
+
+    def __init__(self, model_path=None, num_threads=None, max_new_tokens=512, image_max_side=512):
+        self.model_path = model_path or DEFAULT_LOCAL_CPU_MODEL_PATH
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.max_new_tokens = max_new_tokens
+        self.image_max_side = image_max_side
+        logger.info(f"Loading caption model {self.model_path} on cpu")
+        self.processor = AutoProcessor.from_pretrained(self.model_path)
+        self.model = AutoModelForVision2Seq.from_pretrained(self.model_path, torch_dtype=torch.float32)
+        self.model.to("cpu")
+        self.model.eval()
+
+    @property
+    def cache_tag(self) -> str:
+        return f"{self.name}:{os.path.basename(os.path.normpath(self.model_path))}:{self.image_max_side}"
+
+    def caption(self, request: CaptionRequest) -> str:
+        images = []
+        for frame in request.frames:
+            image = frame.convert("RGB")
+            image.thumbnail((self.image_max_side, self.image_max_side))
+            images.append(image)
+        messages = [{
+            "role": "user",
+            "content": [{"type": "image"} for _ in images] + [{"type": "text", "text": request.prompt}],
+        }]
+        text = self.processor.apply_chat_template(messages, add_generation_prompt=True)
+        inputs = self.processor(text=text, images=images, return_tensors="pt")
+        with torch.inference_mode():
+            generated = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, do_sample=False)
+        # 只解码新生成的部分
+        new_tokens = generated[:, inputs["input_ids"].shape[1]:]
+        return self.processor.batch_decode(new_tokens, skip_special_tokens=True)[0].strip()
+
+
+# caption_backend 可以在配置中用名字指定
+CAPTION_BACKENDS = {
+    "minicpm": MiniCPMCaptionBackend,
+    "openai": OpenAICaptionBackend,
+    "local_cpu": LocalCPUCaptionBackend,
+}
+
+
+def build_caption_backend(name, **kwargs) -> BaseCaptionBackend:
+    """Instantiate a caption backend by name. Backends hold loaded models, so
+    subprocesses receive ``(name, kwargs)`` and build their own."""
+    if name not in CAPTION_BACKENDS:
+        raise ValueError(f"Unknown caption backend {name}, expected one of {list(CAPTION_BACKENDS)}")
+    return CAPTION_BACKENDS[name](**kwargs)
+
+
+def _request_key(cache_tag, request: CaptionRequest):
+    digest = hashlib.md5()
+    digest.update(f"{cache_tag}|{request.max_slice_nums}|{request.prompt}".encode("utf-8"))
+    for frame in request.frames:
+        digest.update(f"{frame.size}{frame.mode}".encode("utf-8"))
+        digest.update(frame.tobytes())
+    return digest.hexdigest()
+
+
+def run_caption_requests(backend: BaseCaptionBackend, requests: list[CaptionRequest], cache_dir=None) -> list:
+    """Answer ``requests`` with ``backend``, reusing answers cached under
+    ``cache_dir`` for identical (backend, prompt, frames). Failed requests
+    yield their exception and are not cached."""
+    results = [None] * len(requests)
+    cache_files = {}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        for i, request in enumerate(requests):
+            cache_files[i] = os.path.join(cache_dir, f"{_request_key(backend.cache_tag, request)}.json")
+            if os.path.exists(cache_files[i]):
+                with open(cache_files[i], encoding="utf-8") as f:
+                    results[i] = json.load(f)["caption"]
+    todo = [i for i in range(len(requests)) if results[i] is None]
+    if not todo:
+        return results
+    for i, answer in zip(todo, backend.caption_many([requests[i] for i in todo])):
+        results[i] = answer
+        if i in cache_files and isinstance(answer, str):
+            with open(cache_files[i], "w", encoding="utf-8") as f:
+                json.dump({"caption": answer}, f, ensure_ascii=False)
+    return results
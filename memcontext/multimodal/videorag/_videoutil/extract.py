@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+from .._utils import logger
+
+# caption 模型使用的帧尺寸（与 caption.encode_video 的 resize 保持一致）
+CAPTION_FRAME_SIZE = (1280, 720)
+# 抽帧帧率上限，片段很短时避免解码出过多帧
+MAX_FRAME_SAMPLE_FPS = 5.0
+
+_AUDIO_CODECS = {"mp3": "libmp3lame", "wav": "pcm_s16le"}
+
+
+def _has_audio_stream(video_path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index", "-of", "csv=p=0", video_path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    return bool(result.stdout.strip())
+
+
+def _frame_sample_fps(segment_times_info):
+    fps = 0.0
+    for info in segment_times_info.values():
+        start, end = info["timestamp"]
+        if end > start and len(info["frame_times"]):
+            fps = max(fps, len(info["frame_times"]) / (end - start))
+    return min(fps, MAX_FRAME_SAMPLE_FPS) or 1.0
+
+
+def frame_file_map(segment_info):
+    """Map rounded frame time -> extracted frame file for one segment."""
+    return {
+        round(float(t), 3): path
+        for t, path in zip(segment_info.get("frame_times", []), segment_info.get("frame_files", []))
+    }
+
+
+def extract_segment_media(
+    video_name,
+    video_path,
+    segment_dir,
+    segment_index2name,
+    segment_times_info,
+    audio_output_format='mp3',
+    export_segments=False,
+    video_output_format='mp4',
+    frame_size=CAPTION_FRAME_SIZE,
+):
+    """Decode ``video_path`` once and fan the result out to every consumer.
+
+    A single ffmpeg run writes one audio file per segment (for ASR), the frames
+    sampled at ``segment_times_info[index]["frame_times"]`` as JPEG files (for
+    captioning) and, with ``export_segments``, keyframe-aligned stream-copied
+    segment files (for ImageBind). Frame paths are stored in
+    ``segment_times_info[index]["frame_files"]``. Returns whether the
+    segment files were exported and the indices whose audio the muxer did
+    not produce (e.g. an audio track shorter than the video), which the
+    caller has to extract another way.
+    """
+    if not shutil.which("ffmpeg"):
+        raise RuntimeError("ffmpeg is not available")
+    indices = list(segment_index2name)
+    split_points = ",".join(f"{segment_times_info[index]['timestamp'][0]:.3f}" for index in indices[1:])
+    segment_args = ["-f", "segment", "-reset_timestamps", "1"]
+    if split_points:
+        segment_args += ["-segment_times", split_points]
+
+    tmp_dir = tempfile.mkdtemp(prefix="extract_", dir=segment_dir)
+    frame_dir = os.path.join(segment_dir, "frames")
+    os.makedirs(frame_dir, exist_ok=True)
+
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", video_path]
+    has_audio = _has_audio_stream(video_path)
+    if has_audio:
+        codec = _AUDIO_CODECS.get(audio_output_format)
+        cmd += ["-map", "0:a:0", "-vn", *(["-c:a", codec] if codec else []), *segment_args,
+                os.path.join(tmp_dir, f"audio_%05d.{audio_output_format}")]
+    else:
+        logger.warning(f"Video {video_name} has no audio track, skip audio extraction.")
+    if export_segments:
+        cmd += ["-map", "0:v:0", *(["-map", "0:a:0"] if has_audio else []), "-c", "copy", *segment_args,
+                os.path.join(tmp_dir, f"clip_%05d.{video_output_format}")]
+    sample_fps = _frame_sample_fps(segment_times_info)
+    width, height = frame_size
+    cmd += ["-map", "0:v:0", "-an", "-vf", f"fps={sample_fps},scale={width}:{height}",
+            "-pix_fmt", "rgb24", "-f", "rawvideo", "pipe:1"]
+
+    # frame index (at sample_fps) -> [(segment index, position in frame_times)]
+    wanted = {}
+    for index in indices:
+        info = segment_times_info[index]
+        info["frame_files"] = [None] * len(info["frame_times"])
+        for position, t in enumerate(info["frame_times"]):
+            wanted.setdefault(int(round(float(t) * sample_fps)), []).append((index, position))
+    last_wanted = max(wanted) if wanted else -1
+
+    frame_bytes = width * height * 3
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        frame_index = 0
+        last_file = None
+        while True:
+            buf = process.stdout.read(frame_bytes)
+            if len(buf) < frame_bytes:
+                break
+            if frame_index in wanted:
+                last_file = os.path.join(frame_dir, f"{frame_index:07d}.jpg")
+                Image.fromarray(np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)).save(last_file, quality=90)
+                for index, position in wanted[frame_index]:
+                    segment_times_info[index]["frame_files"][position] = last_file
+            frame_index += 1
+        process.stdout.close()
+        returncode = process.wait()
+        if returncode != 0:
+            stderr_file.seek(0)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise RuntimeError(f"ffmpeg extraction failed: {stderr_file.read().decode('utf-8', 'ignore')[-500:]}")
+    if frame_index <= last_wanted:
+        # 末尾时间点可能超出解码到的最后一帧，用最后一帧补齐
+        for index in indices:
+            files = segment_times_info[index]["frame_files"]
+            segment_times_info[index]["frame_files"] = [f or last_file for f in files]
+
+    def _collect(pattern, extension):
+        produced = [os.path.join(tmp_dir, pattern % position) for position in range(len(indices))]
+        if not all(os.path.exists(path) for path in produced):
+            return False
+        for index, path in zip(indices, produced):
+            os.replace(path, os.path.join(segment_dir, f"{segment_index2name[index]}.{extension}"))
+        return True
+
+    missing_audio = []
+    if has_audio:
+        # 音轨可能比视频短，只缺末尾的几个片段，逐个移动已生成的音频
+        for position, index in enumerate(indices):
+            path = os.path.join(tmp_dir, f"audio_{position:05d}.{audio_output_format}")
+            if os.path.exists(path):
+                os.replace(path, os.path.join(segment_dir, f"{segment_index2name[index]}.{audio_output_format}"))
+            else:
+                missing_audio.append(index)
+        if missing_audio:
+            logger.warning(f"Audio of video {video_name} is missing for {len(missing_audio)} of {len(indices)} segments.")
+    segments_exported = False
+    if export_segments:
+        # stream copy 只能在关键帧处切分，关键帧过稀时片段数对不上，交给重新编码处理
+        segments_exported = _collect(f"clip_%05d.{video_output_format}", video_output_format)
+        if not segments_exported:
+            logger.warning(f"Stream copy could not split video {video_name} at every boundary, segments need re-encoding.")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return segments_exported, missing_audio
@@ -1,20 +1,135 @@
 import os
+import threading
 import torch
 import pickle
 from tqdm import tqdm
 from imagebind import data
 from imagebind.models import imagebind_model
 from imagebind.models.imagebind_model import ImageBindModel, ModalityType
+from pytorchvideo import transforms as pv_transforms
+from pytorchvideo.data.clip_sampling import ConstantClipsPerVideoSampler
+from pytorchvideo.data.encoded_video import EncodedVideo
+from torchvision import transforms
+from torchvision.transforms._transforms_video import NormalizeVideo
+
+from .._utils import logger
+
+DEFAULT_IMAGEBIND_MODEL_PATH = "/root/models/imagebind_huge.pth"
+
+_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+# process-wide ImageBind instances keyed by (model_path, device, dtype)
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def _resolve_device(device):
+    if device in (None, "", "auto"):
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device = torch.device(device)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        logger.warning("CUDA requested for ImageBind but not available, falling back to CPU")
+        return torch.device("cpu")
+    return device
+
+
+def resolve_imagebind_model_path(model_path=None) -> str:
+    """Explicit path, then ``$IMAGEBIND_MODEL_PATH``, then the default checkpoint."""
+    return model_path or os.environ.get("IMAGEBIND_MODEL_PATH", DEFAULT_IMAGEBIND_MODEL_PATH)
+
+
+def get_imagebind_embedder(model_path=None, device="auto", dtype="fp32") -> ImageBindModel:
+    """Return a lazily loaded ImageBind model shared by the whole process.
+
+    The checkpoint is loaded once per (model_path, device, dtype); later calls
+    reuse the resident model. Half precision is only applied on CUDA.
+    """
+    model_path = resolve_imagebind_model_path(model_path)
+    device = _resolve_device(device)
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unsupported ImageBind dtype {dtype}, expected one of {list(_DTYPES)}")
+    if device.type == "cpu" and dtype != "fp32":
+        logger.warning(f"ImageBind {dtype} is not supported on CPU, using fp32")
+        dtype = "fp32"
+
+    key = (os.path.abspath(model_path), str(device), dtype)
+    embedder = _embedders.get(key)
+    if embedder is not None:
+        return embedder
+    with _embedders_lock:
+        embedder = _embedders.get(key)
+        if embedder is None:
+            logger.info(f"Loading ImageBind from {model_path} on {device} ({dtype})")
+            embedder = imagebind_model.imagebind_huge(pretrained=False)
+            state_dict = torch.load(model_path, map_location="cpu")
+            embedder.load_state_dict(state_dict)
+            del state_dict
+            embedder.to(device=device, dtype=_DTYPES[dtype])
+            embedder.eval()
+            _embedders[key] = embedder
+    return embedder
+
+
+def release_imagebind_embedders():
+    """Drop all resident ImageBind models (e.g. before loading the caption model)."""
+    with _embedders_lock:
+        _embedders.clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
 
 
 def encode_video_segments(video_paths, embedder: ImageBindModel):
-    device = next(embedder.parameters()).device
+    param = next(embedder.parameters())
+    inputs = {
+        ModalityType.VISION: data.load_and_transform_video_data(video_paths, param.device).to(param.dtype),
+    }
+    with torch.no_grad():
+        embeddings = embedder(inputs)[ModalityType.VISION]
+    embeddings = embeddings.float().cpu()
+    return embeddings
+
+def load_and_transform_video_ranges(video_path, time_ranges, device, clip_duration=2, clips_per_video=5):
+    """Same preprocessing as ``data.load_and_transform_video_data`` but for
+    ``[(start, end), ...]`` ranges of one source video, opened only once."""
+    video_transform = transforms.Compose([
+        pv_transforms.ShortSideScale(224),
+        NormalizeVideo(
+            mean=(0.48145466, 0.4578275, 0.40821073),
+            std=(0.26862954, 0.26130258, 0.27577711),
+        ),
+    ])
+    clip_sampler = ConstantClipsPerVideoSampler(clip_duration=clip_duration, clips_per_video=clips_per_video)
+    frame_sampler = pv_transforms.UniformTemporalSubsample(num_samples=clip_duration)
+
+    video = EncodedVideo.from_path(video_path, decoder="decord", decode_audio=False)
+    video_outputs = []
+    for start, end in time_ranges:
+        all_video = []
+        for clip_start, clip_end in data.get_clip_timepoints(clip_sampler, end - start):
+            clip = video.get_clip(start + clip_start, start + clip_end)
+            if clip is None or clip["video"] is None:
+                raise ValueError(f"No clip found in {video_path} at {start + clip_start}")
+            all_video.append(frame_sampler(clip["video"]) / 255.0)
+        all_video = [video_transform(clip) for clip in all_video]
+        all_video = data.SpatialCrop(224, num_crops=3)(all_video)
+        video_outputs.append(torch.stack(all_video, dim=0))
+    video.close()
+    return torch.stack(video_outputs, dim=0).to(device)
+
+
+def encode_video_ranges(video_path, time_ranges, embedder: ImageBindModel):
+    """Embed segments straight from the original video, without segment files."""
+    param = next(embedder.parameters())
     inputs = {
-        ModalityType.VISION: data.load_and_transform_video_data(video_paths, device),
+        ModalityType.VISION: load_and_transform_video_ranges(video_path, time_ranges, param.device).to(param.dtype),
     }
     with torch.no_grad():
         embeddings = embedder(inputs)[ModalityType.VISION]
-    embeddings = embeddings.cpu()
+    embeddings = embeddings.float().cpu()
     return embeddings
 
 def encode_string_query(query:str, embedder: ImageBindModel):
@@ -24,5 +139,5 @@ def encode_string_query(query:str, embedder: ImageBindModel):
     }
     with torch.no_grad():
         embeddings = embedder(inputs)[ModalityType.TEXT]
-    embeddings = embeddings.cpu()
-    return embeddings
\ No newline at end of file
+    embeddings = embeddings.float().cpu()
+    return embeddings
@@ -1,11 +1,67 @@
 import os
 import time
 import shutil
+import subprocess
 import numpy as np
 from tqdm import tqdm
 from moviepy.video import fx as vfx
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from .._utils import logger
+from ...segmentation import adaptive_segments
+from .extract import extract_segment_media
+
+
+def segment_cache_dir(working_dir, video_name):
+    """Per-video directory for segment clips and audio, so videos never clobber each other."""
+    # 位于 working_dir/segments 下（与 FileStorageManager 兼容），每个视频一个子目录
+    return os.path.join(working_dir, 'segments', video_name)
+
+
+def _segment_ranges(video_path, total_video_length, segment_length, segmentation, min_segment_length, scene_threshold, scene_detection_method):
+    """Return [(start, end), ...] for the segments of a video.
+
+    "scene" places boundaries at shot changes within [min_segment_length, segment_length]
+    and merges static stretches; "fixed" (or a detection failure) cuts every segment_length seconds.
+    """
+    if segmentation == "scene":
+        try:
+            plans = adaptive_segments(
+                video_path,
+                total_video_length,
+                method=scene_detection_method,
+                min_duration=min_segment_length,
+                max_duration=segment_length,
+                scene_threshold=scene_threshold,
+            )
+            return [(round(p.start, 2), round(p.end, 2)) for p in plans]
+        except Exception as e:
+            logger.warning(f"Scene detection failed for {video_path}, falling back to fixed segments: {e}")
+
+    start_times = list(range(0, int(total_video_length), segment_length))
+    # if the last segment is shorter than 5 seconds, we merged it to the last segment
+    if len(start_times) > 1 and (int(total_video_length) - start_times[-1]) < 5:
+        start_times = start_times[:-1]
+    ranges = []
+    for start in start_times:
+        if start != start_times[-1]:
+            end = min(start + segment_length, int(total_video_length))
+        else:
+            end = int(total_video_length)
+        ranges.append((start, end))
+    return ranges
+
+
+def _write_segment_audio(video_path, video_name, video_segment_cache_path, segment_index2name, segment_times_info, audio_output_format):
+    with VideoFileClip(video_path) as video:
+        for index in tqdm(segment_index2name, desc=f"Extracting Audio {video_name}"):
+            start, end = segment_times_info[index]["timestamp"]
+            audio_file = f'{segment_index2name[index]}.{audio_output_format}'
+            try:
+                subaudio = video.subclip(start, end).audio
+                subaudio.write_audiofile(os.path.join(video_segment_cache_path, audio_file), codec='mp3', verbose=False, logger=None)
+            except Exception as e:
+                logger.warning(f"Warning: Failed to extract audio for video {video_name} ({start}-{end}). Probably due to lack of audio track.")
+
 
 def split_video(
     video_path,
@@ -13,52 +69,97 @@ def split_video(
     segment_length,
     num_frames_per_segment,
     audio_output_format='mp3',
+    segmentation='fixed',
+    min_segment_length=10,
+    scene_threshold=0.3,
+    scene_detection_method='ffmpeg',
+    export_segments=False,
+    video_output_format='mp4',
 ):  
+    """Plan the segments of a video and extract their media in one decoding pass.
+
+    Audio files and caption frames are always extracted; with ``export_segments``
+    stream-copied segment files are written as well, so ``saving_video_segments``
+    only has to re-encode the ones stream copy could not produce.
+    """
     unique_timestamp = str(int(time.time() * 1000))
     video_name = os.path.basename(video_path).split('.')[0]
-    # 使用 working_dir/segments 目录存储片段（与 FileStorageManager 兼容）
-    video_segment_cache_path = os.path.join(working_dir, 'segments')
+    # 只清理当前视频的片段目录，其他视频的片段保持不变
+    video_segment_cache_path = segment_cache_dir(working_dir, video_name)
     if os.path.exists(video_segment_cache_path):
         shutil.rmtree(video_segment_cache_path)
     os.makedirs(video_segment_cache_path, exist_ok=False)
     
-    segment_index = 0
     segment_index2name, segment_times_info = {}, {}
     with VideoFileClip(video_path) as video:
+        total_video_length = video.duration if segmentation == "scene" else int(video.duration)
+    segment_ranges = _segment_ranges(
+        video_path,
+        total_video_length,
+        segment_length,
+        segmentation,
+        min_segment_length,
+        scene_threshold,
+        scene_detection_method,
+    )
     
-        total_video_length = int(video.duration)
-        start_times = list(range(0, total_video_length, segment_length))
-        # if the last segment is shorter than 5 seconds, we merged it to the last segment
-        if len(start_times) > 1 and (total_video_length - start_times[-1]) < 5:
-            start_times = start_times[:-1]
-        
-        for start in tqdm(start_times, desc=f"Spliting Video {video_name}"):
-            if start != start_times[-1]:
-                end = min(start + segment_length, total_video_length)
-            else:
-                end = total_video_length
-            
-            subvideo = video.subclip(start, end)
-            subvideo_length = subvideo.duration
-            frame_times = np.linspace(0, subvideo_length, num_frames_per_segment, endpoint=False)
-            frame_times += start
-            
-            segment_index2name[f"{segment_index}"] = f"{unique_timestamp}-{segment_index}-{start}-{end}"
-            segment_times_info[f"{segment_index}"] = {"frame_times": frame_times, "timestamp": (start, end)}
-            
-            # save audio
-            audio_file_base_name = segment_index2name[f"{segment_index}"]
-            audio_file = f'{audio_file_base_name}.{audio_output_format}'
-            try:
-                subaudio = subvideo.audio
-                subaudio.write_audiofile(os.path.join(video_segment_cache_path, audio_file), codec='mp3', verbose=False, logger=None)
-            except Exception as e:
-                logger.warning(f"Warning: Failed to extract audio for video {video_name} ({start}-{end}). Probably due to lack of audio track.")
-
-            segment_index += 1
+    for segment_index, (start, end) in enumerate(segment_ranges):
+        frame_times = np.linspace(0, end - start, num_frames_per_segment, endpoint=False)
+        frame_times += start
+        segment_index2name[f"{segment_index}"] = f"{unique_timestamp}-{segment_index}-{start}-{end}"
+        segment_times_info[f"{segment_index}"] = {"frame_times": frame_times, "timestamp": (start, end)}
+    
+    # 一次解码同时产出音频、caption 帧以及（可选）stream copy 的片段文件
+    try:
+        _, missing_audio = extract_segment_media(
+            video_name,
+            video_path,
+            video_segment_cache_path,
+            segment_index2name,
+            segment_times_info,
+            audio_output_format,
+            export_segments=export_segments,
+            video_output_format=video_output_format,
+        )
+    except Exception as e:
+        logger.warning(f"Single-pass extraction failed for {video_name}, falling back to MoviePy audio extraction: {e}")
+        for info in segment_times_info.values():
+            info.pop("frame_files", None)
+        _write_segment_audio(
+            video_path, video_name, video_segment_cache_path, segment_index2name, segment_times_info, audio_output_format
+        )
+    else:
+        # 分段器没有产出的音频（如音轨短于视频）逐段用 MoviePy 补齐
+        if missing_audio:
+            _write_segment_audio(
+                video_path,
+                video_name,
+                video_segment_cache_path,
+                {index: segment_index2name[index] for index in missing_audio},
+                segment_times_info,
+                audio_output_format,
+            )
 
     return segment_index2name, segment_times_info
 
+def _stream_copy_segment(video_path, start, end, output_file):
+    """Cut [start, end) without re-encoding; the clip starts at the keyframe before ``start``."""
+    if not shutil.which("ffmpeg"):
+        return False
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+        "-ss", f"{start:.3f}", "-i", video_path, "-t", f"{end - start:.3f}",
+        "-c", "copy", "-avoid_negative_ts", "make_zero", output_file,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode == 0 and os.path.exists(output_file) and os.path.getsize(output_file) > 0:
+        return True
+    logger.warning(f"Stream copy failed for {output_file}: {result.stderr.decode('utf-8', 'ignore')[-300:]}")
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    return False
+
+
 def saving_video_segments(
     video_name,
     video_path,
@@ -67,17 +168,49 @@ def saving_video_segments(
     segment_times_info,
     error_queue,
     video_output_format='mp4',
+    export_mode='reencode',
 ):
+    """Materialise segment files for ImageBind.
+
+    export_mode: "copy" stream-copies each segment with ffmpeg and re-encodes
+    only when that fails, "reencode" always re-encodes with libx264, "none"
+    writes nothing (features are then encoded from the original video).
+    """
+    if export_mode == "none":
+        return
     try:
-        with VideoFileClip(video_path) as video:
-            # 使用 working_dir/segments 目录存储片段（与 FileStorageManager 兼容）
-            video_segment_cache_path = os.path.join(working_dir, 'segments')
+        # 只有需要重新编码时才打开原视频
+        with _LazySubclips(video_path) as video:
+            video_segment_cache_path = segment_cache_dir(working_dir, video_name)
             
             for index in tqdm(segment_index2name, desc=f"Saving Video Segments {video_name}"):
                 start, end = segment_times_info[index]["timestamp"][0], segment_times_info[index]["timestamp"][1]
-                video_file = f'{segment_index2name[index]}.{video_output_format}'
+                video_file = os.path.join(video_segment_cache_path, f'{segment_index2name[index]}.{video_output_format}')
+                if os.path.exists(video_file):
+                    # 已由 split_video 的单次解码阶段导出
+                    continue
+                if export_mode == "copy" and _stream_copy_segment(video_path, start, end, video_file):
+                    continue
                 subvideo = video.subclip(start, end)
-                subvideo.write_videofile(os.path.join(video_segment_cache_path, video_file), codec='libx264', verbose=False, logger=None)
+                subvideo.write_videofile(video_file, codec='libx264', verbose=False, logger=None)
     except Exception as e:
         error_queue.put(f"Error in saving_video_segments:\n {str(e)}")
-        raise RuntimeError
\ No newline at end of file
+        raise RuntimeError
+
+
+class _LazySubclips:
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self._clip = None
+
+    def subclip(self, start, end):
+        if self._clip is None:
+            self._clip = VideoFileClip(self.video_path)
+        return self._clip.subclip(start, end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._clip is not None:
+            self._clip.close()
@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass, field
 from typing import TypedDict, Union, Literal, Generic, TypeVar
 
@@ -17,11 +18,30 @@ class QueryParam:
     # videorag search
     only_need_context: bool = False
     wo_reference: bool = False
+    # restrict retrieval to these videos, empty means the whole library
+    video_names: list[str] = field(default_factory=list)
+
+
+@dataclass
+class RetrievalContext:
+    """Output of the videorag retrieval stage, shared by all response modes.
+
+    ``chunk_context is None`` means the chunk search found nothing.
+    """
+    query: str
+    chunk_context: Union[str, None]
+    video_context: Union[str, None]
+    retrieved_segments: list[str] = field(default_factory=list)
+    caption_segments: list[str] = field(default_factory=list)
+
+    @property
+    def complete(self) -> bool:
+        return self.video_context is not None
 
 
 TextChunkSchema = TypedDict(
     "TextChunkSchema",
-    {"tokens": int, "content": str, "video_segment_id": str, "chunk_order_index": int},
+    {"tokens": int, "content": str, "video_segment_id": str, "chunk_order_index": int, "video_names": list[str]},
 )
 
 SingleCommunitySchema = TypedDict(
@@ -63,13 +83,19 @@ class StorageNameSpace:
         """commit the storage operations after querying"""
         pass
 
+    async def index_checkpoint_callback(self):
+        """persist the storage in the middle of indexing, it must stay usable afterwards"""
+        await self.index_done_callback()
+
 
 @dataclass
 class BaseVectorStorage(StorageNameSpace):
     embedding_func: EmbeddingFunc
     meta_fields: set = field(default_factory=set)
 
-    async def query(self, query: str, top_k: int) -> list[dict]:
+    async def query(self, query: str, top_k: int, video_names: list[str] = None) -> list[dict]:
+        """``video_names`` restricts the search to elements of those videos
+        (matched against their ``video_names`` metadata) before ranking."""
         raise NotImplementedError
 
     async def upsert(self, data: dict[str, dict]):
@@ -78,6 +104,9 @@ class BaseVectorStorage(StorageNameSpace):
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -99,6 +128,9 @@ class BaseKVStorage(Generic[T], StorageNameSpace):
     async def upsert(self, data: dict[str, T]):
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
     async def drop(self):
         raise NotImplementedError
 
@@ -130,6 +162,20 @@ class BaseGraphStorage(StorageNameSpace):
     ) -> Union[list[tuple[str, str]], None]:
         raise NotImplementedError
 
+    async def get_nodes(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        """Batched ``get_node``; storages override it to fetch all nodes at once."""
+        return await asyncio.gather(*[self.get_node(node_id) for node_id in node_ids])
+
+    async def node_degrees(self, node_ids: list[str]) -> list[int]:
+        """Batched ``node_degree``."""
+        return await asyncio.gather(*[self.node_degree(node_id) for node_id in node_ids])
+
+    async def get_nodes_edges(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        """Batched ``get_node_edges``."""
+        return await asyncio.gather(*[self.get_node_edges(node_id) for node_id in node_ids])
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         raise NotImplementedError
 
@@ -321,6 +321,28 @@ Answer:
 
 
 
+PROMPTS[
+    "filtering_segment_batch"
+] = """---Role---
+
+You are a helpful assistant to determine whether each video segment may contain information relevant to the knowledge based on its rough caption.
+Please note that these are rough captions of the video segments, which means they may not directly contain the answer but may indicate that a video segment is likely to contain information relevant to answering the question. 
+
+---Video Captions---
+
+{captions}
+
+---Knowledge We Need---
+
+{knowledge}
+
+---Answer---
+Judge every numbered caption independently. Output one line per caption in the form "<number>: yes" or "<number>: no", without explanations.
+Answer:
+"""
+
+
+
 PROMPTS[
     "videorag_response"
 ] = """---Role---
@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import time
 import shutil
 import asyncio
 import multiprocessing
@@ -8,7 +9,6 @@ from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from functools import partial
 from typing import Callable, Dict, List, Optional, Type, Union, cast
-from transformers import AutoModel, AutoTokenizer
 import tiktoken
 
 
@@ -22,13 +22,17 @@ from ._op import (
     chunking_by_video_segments,
     extract_entities,
     get_chunks,
-    videorag_query,
-    videorag_query_multiple_choice,
+    build_retrieval_context,
+    videorag_answer,
+    videorag_answer_multiple_choice,
+    _refine_visual_retrieval_query,
 )
 from ._storage import (
     JsonKVStorage,
+    AppendLogKVStorage,
     NanoVectorDBStorage,
     NanoVectorDBVideoSegmentStorage,
+    HNSWVectorStorage,
     NetworkXStorage,
 )
 from ._utils import (
@@ -46,6 +50,7 @@ from .base import (
     BaseVectorStorage,
     StorageNameSpace,
     QueryParam,
+    RetrievalContext,
 )
 from ._videoutil import(
     split_video,
@@ -53,12 +58,35 @@ from ._videoutil import(
     segment_caption,
     merge_segment_information,
     saving_video_segments,
+    segment_cache_dir,
+    release_imagebind_embedders,
+    CAPTION_BACKENDS,
+    build_caption_backend,
 )
 import torch
 torch.backends.cudnn.enabled = False
 torch.backends.cuda.matmul.allow_tf32 = False
 os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
 
+# 影响检索结果的配置项，作为检索缓存 key 的一部分
+_RETRIEVAL_CONFIG_KEYS = (
+    "segment_retrieval_top_k",
+    "retrieval_topk_chunks",
+    "segment_filter_top_n",
+    "segment_filter_batch_size",
+    "max_fine_caption_segments",
+    "fine_num_frames_per_segment",
+    "query_better_than_threshold",
+    "enable_local",
+    "enable_naive_rag",
+)
+
+# vector_db_storage_cls 可以在配置中用名字指定
+VECTOR_DB_STORAGES = {
+    "nanovectordb": NanoVectorDBStorage,
+    "hnsw": HNSWVectorStorage,
+}
+
 @dataclass
 class VideoRAG:
     working_dir: str = field(
@@ -67,17 +95,50 @@ class VideoRAG:
     
     # video
     threads_for_split: int = 10
-    video_segment_length: int = 60 # seconds
+    video_segment_length: int = 60 # seconds (upper bound when video_segmentation == "scene")
+    video_segmentation: str = "fixed" # "fixed": every video_segment_length seconds, "scene": cut at shot changes (opt-in)
+    min_video_segment_length: int = 10 # seconds
+    scene_threshold: float = 0.3
+    scene_detection_method: str = "ffmpeg" # "ffmpeg" scene scores or "histogram" (NumPy frame histograms)
     rough_num_frames_per_segment: int = 40 # frames (increased for better video understanding)
     fine_num_frames_per_segment: int = 60 # frames
     video_output_format: str = "mp4"
+    segment_export_mode: str = "reencode" # "reencode": libx264 via MoviePy (exact boundaries), "copy": opt-in keyframe-aligned stream copy (clips may start/end at nearby keyframes, re-encode fallback), "none": ImageBind reads the original video
     audio_output_format: str = "mp3"
     video_embedding_batch_num: int = 2
     segment_retrieval_top_k: int = 4
     video_embedding_dim: int = 1024
+    imagebind_model_path: Optional[str] = None # None: $IMAGEBIND_MODEL_PATH, then /root/models/imagebind_huge.pth
+    imagebind_device: str = "auto" # "auto" picks cuda when available, otherwise cpu
+    imagebind_dtype: str = "fp32" # "fp16" / "bf16" halve GPU memory, ignored on cpu
+    query_embedding_cache_size: int = 1024 # refined query -> ImageBind text embedding LRU, 0 disables
+    query_templates: list = field(default_factory=list) # expected queries embedded at startup (useful on CPU)
+    
+    asr_model_path: Optional[str] = None # None: $WHISPER_MODEL_PATH, then /root/models/faster-whisper-large-v3-turbo
+    asr_device: str = "auto"
+    asr_compute_type: Optional[str] = None # default float16 on cuda, int8 on cpu
+    asr_num_workers: int = 2 # segments transcribed concurrently by the resident model
+    asr_cache: bool = True # reuse transcripts of identical segment audio
+    pipeline_video_insert: bool = True # split/ASR the next video while the previous one is captioned
     
     # query
     retrieval_topk_chunks: int = 2
+    segment_filter_top_n: int = 8 # segments judged by the LLM after the embedding pre-rank, 0 = all
+    segment_filter_batch_size: int = 8 # captions judged per LLM call, 1 = one call per segment
+    max_fine_caption_segments: int = 4 # fine captioning budget per query, 0 = unlimited
+    enable_fine_caption_cache: bool = True
+    enable_retrieval_cache: bool = True # reuse the retrieval stage for repeated (query, param) on an unchanged library
+    retrieval_cache_max_entries: int = 128 # least recently used retrieval contexts beyond this are evicted, 0 = unbounded
+    caption_max_open_videos: int = 2 # source videos kept open while sampling frames for fine captions
+    caption_batch_size: int = 4 # segments per caption model call when batching is supported
+    caption_backend: str = "minicpm" # "minicpm" (CUDA), "openai" (OpenAI-compatible vision endpoint) or "local_cpu"
+    caption_model_path: Optional[str] = None # minicpm / local_cpu checkpoint, None = backend default under /root/models
+    caption_cache: bool = True # reuse insert-time captions of identical (backend, prompt, frames)
+    caption_api_model: Optional[str] = None # default CAPTION_API_MODEL or gpt-4o-mini
+    caption_api_base_url: Optional[str] = None # default CAPTION_BASE_URL or LLM_BASE_URL
+    caption_api_key: Optional[str] = None # default CAPTION_API_KEY or LLM_API_KEY
+    caption_api_max_concurrency: int = 8 # caption requests in flight for the openai backend
+    caption_cpu_threads: Optional[int] = None # torch threads for the local_cpu backend, None = torch default
     query_better_than_threshold: float = 0.2
     
     # graph mode
@@ -97,10 +158,13 @@ class VideoRAG:
     chunk_token_size: int = 1200
     # chunk_overlap_token_size: int = 100
     tiktoken_model_name: str = "gpt-4o"
+    tiktoken_num_threads: Optional[int] = None # threads for encoding segments on insert, None = cpu count
 
     # entity extraction
     entity_extract_max_gleaning: int = 1
     entity_summary_to_max_tokens: int = 500
+    entity_extract_window_size: int = 32 # chunks extracted and merged into the graph together
+    entity_extract_checkpoint_interval: int = 8 # windows between checkpoints of graph / entity vdb / progress, 0 = only when the insert finishes
 
     # Change to your LLM provider
     llm: LLMConfig = field(default_factory=openai_config)
@@ -110,37 +174,60 @@ class VideoRAG:
     
     # storage
     key_string_value_json_storage_cls: Type[BaseKVStorage] = JsonKVStorage
-    vector_db_storage_cls: Type[BaseVectorStorage] = NanoVectorDBStorage
+    vector_db_storage_cls: Union[str, Type[BaseVectorStorage]] = NanoVectorDBStorage # or "nanovectordb" / "hnsw"
     vs_vector_db_storage_cls: Type[BaseVectorStorage] = NanoVectorDBVideoSegmentStorage
     vector_db_storage_cls_kwargs: dict = field(default_factory=dict)
     graph_storage_cls: Type[BaseGraphStorage] = NetworkXStorage
+    graph_export_graphml: bool = False # NetworkXStorage also writes graph_*.graphml on every save (export only, never read back)
     enable_llm_cache: bool = True
+    llm_response_cache_storage_cls: Type[BaseKVStorage] = AppendLogKVStorage
 
     # extension
     always_create_working_dir: bool = True
     addon_params: dict = field(default_factory=dict)
     convert_response_to_json_func: callable = convert_response_to_json
 
+    def caption_backend_spec(self):
+        """``(name, kwargs)`` of the configured caption backend; picklable so the
+        insert-time caption process can build its own instance."""
+        if self.caption_backend == "minicpm":
+            kwargs = {"model_path": self.caption_model_path, "batch_size": self.caption_batch_size}
+        elif self.caption_backend == "openai":
+            kwargs = {
+                "model": self.caption_api_model,
+                "base_url": self.caption_api_base_url,
+                "api_key": self.caption_api_key,
+                "max_concurrency": self.caption_api_max_concurrency,
+            }
+        else:
+            kwargs = {"model_path": self.caption_model_path, "num_threads": self.caption_cpu_threads}
+        return self.caption_backend, kwargs
+
     def load_caption_model(self, debug=False):
-        # caption model
+        # caption backend used for fine captioning at query time
         if not debug:
-            self.caption_model = AutoModel.from_pretrained(
-                '/root/models/MiniCPM-V-2_6-int4',
-                trust_remote_code=True,
-                torch_dtype=torch.float16,
-                device_map="cuda",
-            )
-            self.caption_tokenizer = AutoTokenizer.from_pretrained(
-                '/root/models/MiniCPM-V-2_6-int4',
-                trust_remote_code=True,
-                use_fast=False  # 显式指定使用慢速处理器，消除警告
-            )
-            self.caption_model.eval()
+            name, kwargs = self.caption_backend_spec()
+            if name == "minicpm":
+                # 先释放常驻显存的 ImageBind，查询时需要会再按需加载
+                release_imagebind_embedders()
+            self.caption_model = build_caption_backend(name, **kwargs)
         else:
             self.caption_model = None
-            self.caption_tokenizer = None
     
     def __post_init__(self):
+        # 配置文件里只能写字符串，这里换成对应的向量库类
+        if isinstance(self.vector_db_storage_cls, str):
+            if self.vector_db_storage_cls not in VECTOR_DB_STORAGES:
+                raise ValueError(
+                    f"Unknown vector_db_storage_cls {self.vector_db_storage_cls}, expected one of {list(VECTOR_DB_STORAGES)}"
+                )
+            self.vector_db_storage_cls = VECTOR_DB_STORAGES[self.vector_db_storage_cls]
+        if self.caption_backend not in CAPTION_BACKENDS:
+            raise ValueError(
+                f"Unknown caption_backend {self.caption_backend}, expected one of {list(CAPTION_BACKENDS)}"
+            )
+        self.caption_model = None
+
         # 确保 video_embedding_dim 与 LLM 的 embedding_dim 一致，避免维度不匹配
         if hasattr(self.llm, 'embedding_dim'):
             self.video_embedding_dim = self.llm.embedding_dim
@@ -165,18 +252,46 @@ class VideoRAG:
         )
 
         self.llm_response_cache = (
-            self.key_string_value_json_storage_cls(
+            self.llm_response_cache_storage_cls(
                 namespace="llm_response_cache", global_config=asdict(self)
             )
             if self.enable_llm_cache
             else None
         )
 
+        self.fine_caption_cache = (
+            self.key_string_value_json_storage_cls(
+                namespace="fine_caption_cache", global_config=asdict(self)
+            )
+            if self.enable_fine_caption_cache
+            else None
+        )
+
+        self.retrieval_context_cache = (
+            self.key_string_value_json_storage_cls(
+                namespace="retrieval_context_cache", global_config=asdict(self)
+            )
+            if self.enable_retrieval_cache
+            else None
+        )
+
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation", global_config=asdict(self)
         )
 
-        self.embedding_func = limit_async_func_call(self.llm.embedding_func_max_async)(wrap_embedding_func_with_attrs(
+        # 已完成实体抽取的 chunk，入库中断后据此续跑
+        self.entity_extracted_chunks = self.key_string_value_json_storage_cls(
+            namespace="entity_extracted_chunks", global_config=asdict(self)
+        )
+
+        # 已完成 chunk 与实体抽取的视频；video_segments 中有而这里没有的视频会在下次 insert_video 时补做
+        self.indexed_videos = self.key_string_value_json_storage_cls(
+            namespace="indexed_videos", global_config=asdict(self)
+        )
+
+        self.embedding_func = limit_async_func_call(
+            self.llm.embedding_func_max_async, self.llm.embedding_func_max_rpm
+        )(wrap_embedding_func_with_attrs(
                 embedding_dim = self.llm.embedding_dim,
                 max_token_size = self.llm.embedding_max_token_size,
                 model_name = self.llm.embedding_model_name)(self.llm.embedding_func))
@@ -208,114 +323,239 @@ class VideoRAG:
             )
         )
         
-        self.llm.best_model_func = limit_async_func_call(self.llm.best_model_max_async)(
-            partial(self.llm.best_model_func, hashing_kv=self.llm_response_cache)
-        )
-        self.llm.cheap_model_func = limit_async_func_call(self.llm.cheap_model_max_async)(
-            partial(self.llm.cheap_model_func, hashing_kv=self.llm_response_cache)
-        )
+        self.llm.best_model_func = limit_async_func_call(
+            self.llm.best_model_max_async, self.llm.best_model_max_rpm
+        )(partial(self.llm.best_model_func, hashing_kv=self.llm_response_cache))
+        self.llm.cheap_model_func = limit_async_func_call(
+            self.llm.cheap_model_max_async, self.llm.cheap_model_max_rpm
+        )(partial(self.llm.cheap_model_func, hashing_kv=self.llm_response_cache))
+
+        if self.query_templates:
+            loop = always_get_an_event_loop()
+            loop.run_until_complete(self.aprecompute_query_embeddings(self.query_templates))
+
+    def llm_call_stats(self) -> dict:
+        """Queue depth, wait time and in-flight counters of the rate-limited model calls."""
+        return {
+            name: func.limiter_stats.to_dict()
+            for name, func in [
+                ("best_model_func", self.llm.best_model_func),
+                ("cheap_model_func", self.llm.cheap_model_func),
+                ("embedding_func", self.embedding_func),
+            ]
+            if hasattr(func, "limiter_stats")
+        }
+
+    async def aprecompute_query_embeddings(self, queries: list[str], refine: bool = True):
+        # 模板先经过与查询时相同的改写（命中 llm_response_cache），再缓存其 ImageBind 向量
+        if refine:
+            queries = await asyncio.gather(
+                *[_refine_visual_retrieval_query(q, QueryParam(), asdict(self)) for q in queries]
+            )
+        await self.video_segment_feature_vdb.precompute_query_embeddings(list(queries))
+        await self._query_done()
+        logger.info(f"Query embedding cache: {self.video_segment_feature_vdb.query_cache_stats()}")
 
     def insert_video(self, video_path_list=None):
+        """Index new videos, chunking and extracting entities for them only.
+
+        Videos whose segments were saved but whose chunking or entity
+        extraction did not finish (tracked in ``indexed_videos``) are
+        indexed again on the next call.
+
+        With ``pipeline_video_insert`` the next video is split and transcribed
+        while the previous one is still being captioned and saved.
+        """
         loop = always_get_an_event_loop()
-        for video_path in video_path_list:
-            # Step0: check the existence
-            video_name = os.path.basename(video_path).split('.')[0]
-            if video_name in self.video_segments._data:
-                logger.info(f"Find the video named {os.path.basename(video_path)} in storage and skip it.")
-                continue
-            loop.run_until_complete(self.video_path_db.upsert(
-                {video_name: video_path}
-            ))
-            
-            # Step1: split the videos
-            segment_index2name, segment_times_info = split_video(
-                video_path, 
-                self.working_dir, 
-                self.video_segment_length,
-                self.rough_num_frames_per_segment,
-                self.audio_output_format,
-            )
-            
-            # Step2: obtain transcript with whisper (also returns language info)
-            transcripts, languages = speech_to_text(
-                video_name, 
-                self.working_dir, 
-                segment_index2name,
-                self.audio_output_format
-            )
-            
-            # Step3: saving video segments **as well as** obtain caption with vision language model
-            manager = multiprocessing.Manager()
-            captions = manager.dict()
-            error_queue = manager.Queue()
-            
-            process_saving_video_segments = multiprocessing.Process(
-                target=saving_video_segments,
-                args=(
-                    video_name,
-                    video_path,
-                    self.working_dir,
-                    segment_index2name,
-                    segment_times_info,
-                    error_queue,
-                    self.video_output_format,
+        inserted_video_names = []
+        pending_job = None
+        try:
+            for video_path in video_path_list:
+                # Step0: check the existence
+                video_name = os.path.basename(video_path).split('.')[0]
+                if video_name in inserted_video_names or not loop.run_until_complete(
+                    self.video_segments.filter_keys([video_name])
+                ):
+                    logger.info(f"Find the video named {os.path.basename(video_path)} in storage and skip it.")
+                    continue
+                loop.run_until_complete(self.video_path_db.upsert(
+                    {video_name: video_path}
+                ))
+
+                # Step1: split the videos
+                segment_index2name, segment_times_info = split_video(
+                    video_path, 
+                    self.working_dir, 
+                    self.video_segment_length,
+                    self.rough_num_frames_per_segment,
+                    self.audio_output_format,
+                    segmentation=self.video_segmentation,
+                    min_segment_length=self.min_video_segment_length,
+                    scene_threshold=self.scene_threshold,
+                    scene_detection_method=self.scene_detection_method,
+                    export_segments=self.segment_export_mode == "copy",
+                    video_output_format=self.video_output_format,
                 )
-            )
-            
-            process_segment_caption = multiprocessing.Process(
-                target=segment_caption,
-                args=(
-                    video_name,
-                    video_path,
+
+                # Step2: obtain transcript with whisper (also returns language info)
+                transcripts, languages = speech_to_text(
+                    video_name, 
+                    self.working_dir, 
                     segment_index2name,
-                    transcripts,
-                    segment_times_info,
-                    captions,
-                    error_queue,
+                    self.audio_output_format,
+                    model_path=self.asr_model_path,
+                    device=self.asr_device,
+                    compute_type=self.asr_compute_type,
+                    num_workers=self.asr_num_workers,
+                    use_cache=self.asr_cache,
                 )
-            )
-            
-            process_saving_video_segments.start()
-            process_segment_caption.start()
-            process_saving_video_segments.join()
-            process_segment_caption.join()
-            
-            # if raise error in this two, stop the processing
-            while not error_queue.empty():
-                error_message = error_queue.get()
-                with open('error_log_videorag.txt', 'a', encoding='utf-8') as log_file:
-                    log_file.write(f"Video Name:{video_name} Error processing:\n{error_message}\n\n")
-                raise RuntimeError(error_message)
-            
-            # Step4: insert video segments information (with language info from ASR)
-            segments_information = merge_segment_information(
+
+                # the previous video has been captioning meanwhile, collect it before starting the next one
+                if pending_job is not None:
+                    self._finish_video_job(pending_job)
+                    pending_job = None
+                pending_job = self._start_video_job(
+                    video_name, video_path, segment_index2name, segment_times_info, transcripts, languages
+                )
+                if not self.pipeline_video_insert:
+                    self._finish_video_job(pending_job)
+                    pending_job = None
+                inserted_video_names.append(video_name)
+
+            if pending_job is not None:
+                self._finish_video_job(pending_job)
+                pending_job = None
+        finally:
+            # 出错时不能留下仍在运行的子进程和 Manager
+            if pending_job is not None:
+                self._abort_video_job(pending_job)
+        # 包括之前 ainsert 失败或进程中断、已保存片段但未完成索引的视频
+        unindexed_video_names = loop.run_until_complete(self._unindexed_video_names())
+        if not unindexed_video_names:
+            return
+        loop.run_until_complete(self.ainsert(
+            loop.run_until_complete(self._get_video_segments(unindexed_video_names))
+        ))
+        loop.run_until_complete(self._mark_videos_indexed(unindexed_video_names))
+
+    def _start_video_job(self, video_name, video_path, segment_index2name, segment_times_info, transcripts, languages):
+        # Step3: saving video segments **as well as** obtain caption with vision language model
+        manager = multiprocessing.Manager()
+        captions = manager.dict()
+        error_queue = manager.Queue()
+        
+        process_saving_video_segments = multiprocessing.Process(
+            target=saving_video_segments,
+            args=(
+                video_name,
+                video_path,
+                self.working_dir,
                 segment_index2name,
                 segment_times_info,
-                transcripts,
-                captions,
-                languages,
+                error_queue,
+                self.video_output_format,
+                self.segment_export_mode,
             )
-            manager.shutdown()
-            loop.run_until_complete(self.video_segments.upsert(
-                {video_name: segments_information}
-            ))
-            
-            # Step5: encode video segment features
-            loop.run_until_complete(self.video_segment_feature_vdb.upsert(
+        )
+        
+        process_segment_caption = multiprocessing.Process(
+            target=segment_caption,
+            args=(
                 video_name,
+                video_path,
                 segment_index2name,
-                self.video_output_format,
-            ))
-            
-            # Step6: delete the cache file
-            video_segment_cache_path = os.path.join(self.working_dir, '_cache', video_name)
-            if os.path.exists(video_segment_cache_path):
-                shutil.rmtree(video_segment_cache_path)
-            
-            # Step 7: saving current video information
-            loop.run_until_complete(self._save_video_segments())
+                transcripts,
+                segment_times_info,
+                captions,
+                error_queue,
+                self.caption_backend_spec(),
+                os.path.join(self.working_dir, "_caption_cache") if self.caption_cache else None,
+            )
+        )
         
-        loop.run_until_complete(self.ainsert(self.video_segments._data))
+        process_saving_video_segments.start()
+        process_segment_caption.start()
+        return {
+            "video_name": video_name,
+            "video_path": video_path,
+            "segment_index2name": segment_index2name,
+            "segment_times_info": segment_times_info,
+            "transcripts": transcripts,
+            "languages": languages,
+            "manager": manager,
+            "captions": captions,
+            "error_queue": error_queue,
+            "processes": [process_saving_video_segments, process_segment_caption],
+        }
+
+    def _abort_video_job(self, job):
+        for process in job["processes"]:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        job["manager"].shutdown()
+
+    def _finish_video_job(self, job):
+        loop = always_get_an_event_loop()
+        video_name = job["video_name"]
+        for process in job["processes"]:
+            process.join()
+        
+        # if raise error in this two, stop the processing
+        error_queue = job["error_queue"]
+        while not error_queue.empty():
+            error_message = error_queue.get()
+            with open('error_log_videorag.txt', 'a', encoding='utf-8') as log_file:
+                log_file.write(f"Video Name:{video_name} Error processing:\n{error_message}\n\n")
+            job["manager"].shutdown()
+            raise RuntimeError(error_message)
+        
+        # Step4: insert video segments information (with language info from ASR)
+        segments_information = merge_segment_information(
+            job["segment_index2name"],
+            job["segment_times_info"],
+            job["transcripts"],
+            dict(job["captions"]),
+            job["languages"],
+        )
+        job["manager"].shutdown()
+        loop.run_until_complete(self.video_segments.upsert(
+            {video_name: segments_information}
+        ))
+        
+        # Step5: encode video segment features
+        loop.run_until_complete(self.video_segment_feature_vdb.upsert(
+            video_name,
+            job["segment_index2name"],
+            self.video_output_format,
+            video_path=job["video_path"],
+            segment_times_info=job["segment_times_info"],
+        ))
+        
+        # Step6: delete the audio files and caption frames, their results are stored with the segments
+        video_segment_cache_path = segment_cache_dir(self.working_dir, video_name)
+        for segment_name in job["segment_index2name"].values():
+            audio_file = os.path.join(video_segment_cache_path, f"{segment_name}.{self.audio_output_format}")
+            if os.path.exists(audio_file):
+                os.remove(audio_file)
+        shutil.rmtree(os.path.join(video_segment_cache_path, 'frames'), ignore_errors=True)
+        
+        # Step 7: saving current video information
+        loop.run_until_complete(self._save_video_segments())
+
+    async def _get_video_segments(self, video_names):
+        return dict(zip(video_names, await self.video_segments.get_by_ids(video_names)))
+
+    async def _unindexed_video_names(self):
+        video_names = await self.video_segments.all_keys()
+        missing = await self.indexed_videos.filter_keys(video_names)
+        return [name for name in video_names if name in missing]
+
+    async def _mark_videos_indexed(self, video_names):
+        # 只有 ainsert 成功返回后才标记，之前失败的视频下次会重新 chunk 与抽取
+        indexed_at = datetime.now().isoformat()
+        await self.indexed_videos.upsert({name: {"indexed_at": indexed_at} for name in video_names})
+        await self.indexed_videos.index_done_callback()
 
     def query(self, query: str, param: QueryParam = QueryParam()):
         loop = always_get_an_event_loop()
@@ -323,41 +563,122 @@ class VideoRAG:
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
         if param.mode == "videorag":
-            response = await videorag_query(
-                query,
-                self.entities_vdb,
-                self.text_chunks,
-                self.chunks_vdb,
-                self.video_path_db,
-                self.video_segments,
-                self.video_segment_feature_vdb,
-                self.chunk_entity_relation_graph,
-                self.caption_model, 
-                self.caption_tokenizer,
-                param,
-                asdict(self),
-            )
+            context = await self.aretrieve(query, param, require_chunks=True)
+            response = await videorag_answer(query, context, param, asdict(self))
         # NOTE: update here
         elif param.mode == "videorag_multiple_choice":
-            response = await videorag_query_multiple_choice(
-                query,
-                self.entities_vdb,
-                self.text_chunks,
-                self.chunks_vdb,
-                self.video_path_db,
-                self.video_segments,
-                self.video_segment_feature_vdb,
-                self.chunk_entity_relation_graph,
-                self.caption_model, 
-                self.caption_tokenizer,
-                param,
-                asdict(self),
-            )
+            context = await self.aretrieve(query, param)
+            response = await videorag_answer_multiple_choice(query, context, param, asdict(self))
         else:
             raise ValueError(f"Unknown mode {param.mode}")
         await self._query_done()
         return response
 
+    def query_batch(self, queries: list[str], param: QueryParam = QueryParam(), retrieval_query: str = None):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aquery_batch(queries, param, retrieval_query))
+
+    async def aquery_batch(self, queries: list[str], param: QueryParam = QueryParam(), retrieval_query: str = None):
+        """Answer several questions (e.g. variants of one benchmark question)
+        with a single retrieval pass.
+
+        Retrieval runs once for ``retrieval_query`` (default: the distinct
+        questions joined by newlines) and every question is answered
+        concurrently from that shared context.
+        """
+        if param.mode == "videorag":
+            answer_func = videorag_answer
+        elif param.mode == "videorag_multiple_choice":
+            answer_func = videorag_answer_multiple_choice
+        else:
+            raise ValueError(f"Unknown mode {param.mode}")
+        if not queries:
+            return []
+        retrieval_query = retrieval_query or "\n".join(dict.fromkeys(queries))
+        context = await self.aretrieve(retrieval_query, param, require_chunks=param.mode == "videorag")
+        global_config = asdict(self)
+        responses = await asyncio.gather(
+            *[answer_func(query, context, param, global_config) for query in queries]
+        )
+        await self._query_done()
+        return list(responses)
+
+    async def _library_version(self) -> str:
+        # 入库新视频或新 chunk 后版本变化，旧的检索结果随之失效
+        video_names = sorted(await self.video_segments.all_keys())
+        chunk_count = len(await self.text_chunks.all_keys())
+        return compute_mdhash_id(json.dumps([video_names, chunk_count]))
+
+    async def _retrieval_cache_key(self, query: str, param: QueryParam) -> str:
+        return compute_mdhash_id(
+            json.dumps(
+                {
+                    "query": query,
+                    "top_k": param.top_k,
+                    "naive_max_token_for_text_unit": param.naive_max_token_for_text_unit,
+                    "video_names": sorted(param.video_names),
+                    "config": {k: getattr(self, k) for k in _RETRIEVAL_CONFIG_KEYS},
+                    "caption_model": self.caption_model.cache_tag if self.caption_model is not None else None,
+                    # 换用其它检索/过滤模型后旧的检索结果不再适用
+                    "models": [self.llm.embedding_model_name, self.llm.best_model_name, self.llm.cheap_model_name],
+                    "version": await self._library_version(),
+                },
+                ensure_ascii=False,
+                sort_keys=True,
+            ),
+            prefix="ctx-",
+        )
+
+    async def aretrieve(self, query: str, param: QueryParam = QueryParam(), require_chunks: bool = False) -> RetrievalContext:
+        """Retrieval stage of the videorag modes, cached by (query, param, library version).
+
+        At most ``retrieval_cache_max_entries`` contexts are kept; the least
+        recently used ones are evicted.
+        """
+        cache_key = None
+        if self.retrieval_context_cache is not None:
+            cache_key = await self._retrieval_cache_key(query, param)
+            cached = await self.retrieval_context_cache.get_by_id(cache_key)
+            if cached is not None and "context" in cached:
+                logger.info(f"Reuse cached retrieval context for query {query!r}")
+                # 刷新使用时间，淘汰时按最近使用排序
+                await self.retrieval_context_cache.upsert({cache_key: {**cached, "used_at": time.time()}})
+                return RetrievalContext(**cached["context"])
+        context = await build_retrieval_context(
+            query,
+            self.entities_vdb,
+            self.text_chunks,
+            self.chunks_vdb,
+            self.video_path_db,
+            self.video_segments,
+            self.video_segment_feature_vdb,
+            self.chunk_entity_relation_graph,
+            self.caption_model,
+            param,
+            asdict(self),
+            fine_caption_cache=self.fine_caption_cache,
+            require_chunks=require_chunks,
+        )
+        # 提前终止的检索结果不完整，不写入缓存
+        if cache_key is not None and context.complete:
+            await self.retrieval_context_cache.upsert(
+                {cache_key: {"context": asdict(context), "used_at": time.time()}}
+            )
+            await self._evict_retrieval_cache()
+        return context
+
+    async def _evict_retrieval_cache(self):
+        if not self.retrieval_cache_max_entries:
+            return
+        keys = await self.retrieval_context_cache.all_keys()
+        if len(keys) <= self.retrieval_cache_max_entries:
+            return
+        entries = await self.retrieval_context_cache.get_by_ids(keys, fields={"used_at"})
+        # 旧格式（没有 used_at）的条目最先淘汰
+        by_age = sorted(zip(keys, entries), key=lambda item: (item[1] or {}).get("used_at", 0.0))
+        stale = [key for key, _ in by_age[: len(keys) - self.retrieval_cache_max_entries]]
+        await self.retrieval_context_cache.delete(stale)
+
     async def ainsert(self, new_video_segment):
         await self._insert_start()
         try:
@@ -365,6 +686,8 @@ class VideoRAG:
             inserting_chunks = get_chunks(
                 new_videos=new_video_segment,
                 chunk_func=self.chunk_func,
+                tiktoken_model_name=self.tiktoken_model_name,
+                encode_num_threads=self.tiktoken_num_threads,
                 max_token_size=self.chunk_token_size,
             )
             _add_chunk_keys = await self.text_chunks.filter_keys(
@@ -391,11 +714,13 @@ class VideoRAG:
                 knowledge_graph_inst=self.chunk_entity_relation_graph,
                 entity_vdb=self.entities_vdb,
                 global_config=asdict(self),
+                processed_chunks_kv=self.entity_extracted_chunks,
             )
             if maybe_new_kg is None:
+                # chunk 已写入 chunks_vdb，仍然提交，naive RAG 可以检索到
                 logger.warning("No new entities found")
-                return
-            self.chunk_entity_relation_graph = maybe_new_kg
+            else:
+                self.chunk_entity_relation_graph = maybe_new_kg
             # ---------- commit upsertings and indexing
             await self.text_chunks.upsert(inserting_chunks)
         finally:
@@ -428,6 +753,7 @@ class VideoRAG:
         for storage_inst in [
             self.text_chunks,
             self.llm_response_cache,
+            self.entity_extracted_chunks,
             self.entities_vdb,
             self.chunks_vdb,
             self.chunk_entity_relation_graph,
@@ -442,8 +768,12 @@ class VideoRAG:
 
     async def _query_done(self):
         tasks = []
-        for storage_inst in [self.llm_response_cache]:
+        for storage_inst in [self.llm_response_cache, self.fine_caption_cache, self.retrieval_context_cache]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
+        for storage_inst in [self.video_segment_feature_vdb]:
+            if storage_inst is None:
+                continue
+            tasks.append(cast(StorageNameSpace, storage_inst).query_done_callback())
         await asyncio.gather(*tasks)
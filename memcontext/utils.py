@@ -126,6 +126,7 @@ def ensure_directory_exists(path):
 # ---- Embedding Utilities ----
 _model_cache = {}
 _embedding_cache = {}  # 添加embedding缓存
+DEFAULT_REMOTE_EMBEDDING_BATCH_SIZE = 32  # 远程 embedding 接口单次请求的文本数上限
 
 def _get_valid_kwargs(func, kwargs):
     """Helper to filter kwargs for a given function's signature."""
@@ -152,12 +153,39 @@ def get_embedding(text, model_name="all-MiniLM-L6-v2", use_cache=True, **kwargs)
                    - for BGE-M3: `use_fp16=True`, `max_length=8192`
     :return: 文本的embedding向量 (numpy array)。
     """
+    return get_embeddings([text], model_name=model_name, use_cache=use_cache, **kwargs)[0]
+
+
+def get_embeddings(texts, model_name="all-MiniLM-L6-v2", use_cache=True, **kwargs):
+    """
+    批量获取多段文本的embedding向量，参数含义与 get_embedding 相同。
+    未命中缓存的文本按 remote_batch_size 分批发起远程请求（本地模型一次 encode），结果顺序与输入一致。
+
+    :param remote_batch_size: 单次远程请求携带的最大文本数，默认读取 EMBEDDING_REMOTE_BATCH_SIZE（32），
+                              避免长视频一次性写入时请求超过服务商的条数/长度上限。
+    :return: embedding 向量列表 (list of numpy array)。
+    """
+    texts = list(texts)
+    # 分批大小不影响向量结果，不参与缓存 key
+    remote_batch_size = kwargs.pop("remote_batch_size", None) or int(
+        os.environ.get("EMBEDDING_REMOTE_BATCH_SIZE", DEFAULT_REMOTE_EMBEDDING_BATCH_SIZE)
+    )
+    remote_batch_size = max(1, remote_batch_size)
     model_config_key = json.dumps({"model_name": model_name, **kwargs}, sort_keys=True)
-    
-    if use_cache:
-        cache_key = f"{model_config_key}::{hash(text)}"
-        if cache_key in _embedding_cache:
-            return _embedding_cache[cache_key]
+    embeddings = [None] * len(texts)
+
+    missing_indices = []
+    for i, text in enumerate(texts):
+        if use_cache:
+            cache_key = f"{model_config_key}::{hash(text)}"
+            if cache_key in _embedding_cache:
+                embeddings[i] = _embedding_cache[cache_key]
+                continue
+        missing_indices.append(i)
+
+    if not missing_indices:
+        return embeddings
+    missing_texts = [texts[i] for i in missing_indices]
     
     # 检查是否是豆包 embedding 模型（通过模型名称判断）
     is_doubao_embedding = 'doubao' in model_name.lower() and 'embedding' in model_name.lower()
@@ -172,24 +200,27 @@ def get_embedding(text, model_name="all-MiniLM-L6-v2", use_cache=True, **kwargs)
         
         # 使用同步方式调用（因为 get_embedding 是同步函数）
         import requests
-        response = requests.post(
-            f"{embedding_base_url}/embeddings",
-            headers={
-                "Authorization": f"Bearer {embedding_api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model_name,
-                "input": [text],
-                "encoding_format": "float"
-            },
-            timeout=60.0
-        )
-        response.raise_for_status()
-        result = response.json()
-        if not result.get("data"):
-            raise RuntimeError(f"豆包 embedding 返回数据为空: {result}")
-        embedding = np.array(result["data"][0]["embedding"], dtype=np.float32)
+        new_embeddings = []
+        for start in range(0, len(missing_texts), remote_batch_size):
+            response = requests.post(
+                f"{embedding_base_url}/embeddings",
+                headers={
+                    "Authorization": f"Bearer {embedding_api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": model_name,
+                    "input": missing_texts[start:start + remote_batch_size],
+                    "encoding_format": "float"
+                },
+                timeout=60.0
+            )
+            response.raise_for_status()
+            result = response.json()
+            if not result.get("data"):
+                raise RuntimeError(f"豆包 embedding 返回数据为空: {result}")
+            data = sorted(result["data"], key=lambda item: item.get("index", 0))
+            new_embeddings.extend(np.array(item["embedding"], dtype=np.float32) for item in data)
     else:
         # 保留原有的 siliconflow 和本地模型逻辑（向后兼容）
         use_siliconflow = kwargs.pop("use_siliconflow", False)
@@ -198,13 +229,15 @@ def get_embedding(text, model_name="all-MiniLM-L6-v2", use_cache=True, **kwargs)
             siliconflow_model = kwargs.pop("siliconflow_model", model_name)
             siliconflow_endpoint = kwargs.pop("siliconflow_endpoint", os.environ.get("SILICONFLOW_EMBEDDING_ENDPOINT", "https://api.siliconflow.cn/v1/embeddings"))
             siliconflow_timeout = kwargs.pop("siliconflow_timeout", 60.0)
-            embedding = _call_siliconflow_embedding(
-                text,
-                model=siliconflow_model,
-                api_key=siliconflow_api_key,
-                endpoint=siliconflow_endpoint,
-                timeout=siliconflow_timeout,
-            )
+            new_embeddings = []
+            for start in range(0, len(missing_texts), remote_batch_size):
+                new_embeddings.extend(_call_siliconflow_embedding(
+                    missing_texts[start:start + remote_batch_size],
+                    model=siliconflow_model,
+                    api_key=siliconflow_api_key,
+                    endpoint=siliconflow_endpoint,
+                    timeout=siliconflow_timeout,
+                ))
         else:
             # --- Model Loading ---
             model_init_key = json.dumps({"model_name": model_name, **{k:v for k,v in kwargs.items() if k not in ['batch_size', 'max_length']}}, sort_keys=True)
@@ -232,27 +265,30 @@ def get_embedding(text, model_name="all-MiniLM-L6-v2", use_cache=True, **kwargs)
             # --- Encoding ---
             if 'bge-m3' in model_name.lower():
                 encode_kwargs = _get_valid_kwargs(model.encode, kwargs)
-                print(f"-> Encoding with BGEM3FlagModel using kwargs: {encode_kwargs}")
-                result = model.encode([text], **encode_kwargs)
-                embedding = result['dense_vecs'][0]
+                print(f"-> Encoding {len(missing_texts)} text(s) with BGEM3FlagModel using kwargs: {encode_kwargs}")
+                result = model.encode(missing_texts, **encode_kwargs)
+                new_embeddings = list(result['dense_vecs'])
             else: # Default to SentenceTransformer-based models
                 encode_kwargs = _get_valid_kwargs(model.encode, kwargs)
-                print(f"-> Encoding with SentenceTransformer using kwargs: {encode_kwargs}")
-                embedding = model.encode([text], **encode_kwargs)[0]
-
-    if use_cache:
-        cache_key = f"{model_config_key}::{hash(text)}"
-        _embedding_cache[cache_key] = embedding
-        if len(_embedding_cache) > 10000:
-            keys_to_remove = list(_embedding_cache.keys())[:1000]
-            for key in keys_to_remove:
-                try:
-                    del _embedding_cache[key]
-                except KeyError:
-                    pass
-            print("Cleaned embedding cache to prevent memory overflow")
+                print(f"-> Encoding {len(missing_texts)} text(s) with SentenceTransformer using kwargs: {encode_kwargs}")
+                new_embeddings = list(model.encode(missing_texts, **encode_kwargs))
+
+    for i, embedding in zip(missing_indices, new_embeddings):
+        embeddings[i] = embedding
+        if use_cache:
+            cache_key = f"{model_config_key}::{hash(texts[i])}"
+            _embedding_cache[cache_key] = embedding
+
+    if use_cache and len(_embedding_cache) > 10000:
+        keys_to_remove = list(_embedding_cache.keys())[:1000]
+        for key in keys_to_remove:
+            try:
+                del _embedding_cache[key]
+            except KeyError:
+                pass
+        print("Cleaned embedding cache to prevent memory overflow")
     
-    return embedding
+    return embeddings
 
 
 def clear_embedding_cache():
@@ -268,16 +304,18 @@ def normalize_vector(vec):
         return vec
     return vec / norm
 
-def _call_siliconflow_embedding(text, model, api_key, endpoint, timeout=60.0):
+def _call_siliconflow_embedding(texts, model, api_key, endpoint, timeout=60.0):
+    """调用 SiliconFlow embedding 接口，texts 可以是单条文本或文本列表（一次请求）"""
     if not api_key:
         raise RuntimeError("SILICONFLOW_API_KEY 未配置，无法调用远程 embedding。")
+    single = isinstance(texts, str)
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
     payload = {
         "model": model,
-        "input": [text],
+        "input": [texts] if single else list(texts),
         "encoding_format": "float"
     }
     response = requests.post(endpoint, headers=headers, json=payload, timeout=timeout)
@@ -285,8 +323,9 @@ def _call_siliconflow_embedding(text, model, api_key, endpoint, timeout=60.0):
     result = response.json()
     if not result.get("data"):
         raise RuntimeError(f"SiliconFlow embedding 返回数据为空: {result}")
-    vector = result["data"][0]["embedding"]
-    return np.array(vector, dtype=np.float32)
+    data = sorted(result["data"], key=lambda item: item.get("index", 0))
+    vectors = [np.array(item["embedding"], dtype=np.float32) for item in data]
+    return vectors[0] if single else vectors
 
 # ---- Time Decay Function ----
 def compute_time_decay(event_timestamp_str, current_timestamp_str, tau_hours=24):